@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Batch Runner - Generates many storybooks from a JSONL file of prompts
+
+Each input line is a JSON object with a "prompt" and optional "id", "text_model", "target_words",
+"target_age", "image_model" and "image_size" fields. Every book is generated in its own workspace
+under BOOKS_DIR/<id>, several books run at once, and all of them share the process-wide API rate limiters.
+
+Usage:
+    python batch.py prompts.jsonl [--results books/results.jsonl] [--max-books 4]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import run_storybook_pipeline, workspace_dirs
+from config import (
+    TARGET_WORDS, TARGET_AGE, TEXT_MODEL, IMAGE_MODEL, IMAGE_SIZE, FORMAT_OPTIONS,
+    PDF_RENDER_WORKERS, BATCH_MAX_CONCURRENT_BOOKS, BOOKS_DIR, BATCH_RESULTS_FILE, TRACING_ENABLED, TRACE_FILE
+)
+
+
+def read_book_requests(path):
+    """Stream (line_number, request or None, error) tuples from a JSONL file without loading it in memory."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(request, dict) or not (request.get('prompt') or request.get('user_prompt')):
+                yield line_number, None, "Missing 'prompt'"
+                continue
+            yield line_number, request, None
+
+
+def book_id_for(request, line_number):
+    """
+    Return a filesystem-safe identifier for a book request, also the name of its workspace under BOOKS_DIR.
+
+    Raises:
+        ValueError: If the id is made only of dots ("." or ".." would put the workspace outside BOOKS_DIR).
+    """
+    book_id = re.sub(r'[^A-Za-z0-9_.-]', '_', str(request.get('id') or request.get('book_id') or f"book_{line_number:05d}"))
+    if not book_id.strip('.'):
+        raise ValueError(f"Invalid id {book_id!r}")
+    return book_id
+
+
+def generate_book(request, line_number, books_dir=BOOKS_DIR, render_workers=PDF_RENDER_WORKERS):
+    """
+    Generate one book in its own workspace and return its result line.
+
+        Args:
+            request (dict): Book request read from the JSONL file
+            line_number (int): Line of the request in the JSONL file
+            books_dir (str): Root of the per-book workspaces
+            render_workers (int): 1 renders the pages in this process, otherwise they go to the render pool shared by every book
+
+    Returns:
+        dict: Result with the book id, status, output paths, timing and error if any
+    """
+    book_id = book_id_for(request, line_number)
+    output_dir = os.path.join(books_dir, book_id)
+    result = {
+        'id': book_id,
+        'line': line_number,
+        'prompt': request.get('prompt') or request.get('user_prompt'),
+        'output_dir': output_dir
+    }
+    if TRACING_ENABLED:
+        # Saved by the pipeline whether the book succeeds or fails
+        result['trace'] = os.path.join(workspace_dirs(output_dir)[2], TRACE_FILE)
+
+    start = time.perf_counter()
+    try:
+        story_dict, formatter = run_storybook_pipeline(
+            result['prompt'],
+            request.get('text_model', TEXT_MODEL),
+            int(request.get('target_words', TARGET_WORDS)),
+            int(request.get('target_age', TARGET_AGE)),
+            request.get('image_model', IMAGE_MODEL),
+            request.get('image_size', IMAGE_SIZE),
+            format_options=FORMAT_OPTIONS,
+            render_workers=render_workers,
+            output_dir=output_dir
+        )
+        result.update({
+            'status': 'ok' if not formatter.failed_pages and not story_dict.get('failed_images') else 'partial',
+            'title': story_dict.get('title'),
+            'pdf': os.path.join(formatter.pdf_dir, 'storybook.pdf'),
+            'images': story_dict.get('images', []),
+            'failed_pages': {str(page_number): error for page_number, error in formatter.failed_pages.items()},
+            'failed_images': story_dict.get('failed_images', {}),
+            'book_id': story_dict.get('book_id')
+        })
+    except Exception as e:
+        result.update({'status': 'error', 'error': str(e)})
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(input_path, results_path=None, max_books=BATCH_MAX_CONCURRENT_BOOKS, books_dir=BOOKS_DIR):
+    """
+    Generate every book of a JSONL file, max_books at a time, writing one result line per book.
+
+        Args:
+            input_path (str): JSONL file of book requests
+            results_path (str): JSONL file receiving the results, defaults to BOOKS_DIR/BATCH_RESULTS_FILE
+            max_books (int): Number of books generated at the same time
+            books_dir (str): Root of the per-book workspaces
+
+    Returns:
+        dict: Number of books per status
+    """
+    results_path = results_path or os.path.join(books_dir, BATCH_RESULTS_FILE)
+    if os.path.dirname(results_path):
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    os.makedirs(books_dir, exist_ok=True)
+
+    max_books = max(1, max_books)
+
+    in_flight = threading.BoundedSemaphore(max_books)
+    results_lock = threading.Lock()
+    status_counts = {}
+
+    with open(results_path, 'a', encoding='utf-8') as results_file:
+
+        def write_result(result):
+            with results_lock:
+                results_file.write(json.dumps(result) + "\n")
+                results_file.flush()
+                status_counts[result['status']] = status_counts.get(result['status'], 0) + 1
+            print(f"📘 {result['id']}: {result['status']} in {result.get('seconds', 0)}s")
+
+        def run_one(request, line_number):
+            try:
+                write_result(generate_book(request, line_number, books_dir))
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=max_books) as executor:
+            seen_ids = {}  # book id -> line of its request, two books must never share a workspace
+            for line_number, request, error in read_book_requests(input_path):
+                if error is None:
+                    try:
+                        book_id = book_id_for(request, line_number)
+                    except ValueError as e:
+                        error = str(e)
+                    else:
+                        if book_id in seen_ids:
+                            error = f"Duplicate id {book_id!r}, already used on line {seen_ids[book_id]}"
+                        seen_ids.setdefault(book_id, line_number)
+                if error is not None:
+                    write_result({'id': f"line_{line_number}", 'line': line_number, 'status': 'error', 'error': error})
+                    continue
+                # Only read the next line once a slot is free, so huge batches are streamed
+                in_flight.acquire()
+                executor.submit(run_one, request, line_number)
+
+    print(f"✅ Batch finished: {status_counts}")
+    return status_counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file with one book request per line")
+    parser.add_argument("--results", default=None, help=f"JSONL file receiving one result per book (default: {BOOKS_DIR}/{BATCH_RESULTS_FILE})")
+    parser.add_argument("--max-books", type=int, default=BATCH_MAX_CONCURRENT_BOOKS, help="Books generated at the same time")
+    parser.add_argument("--books-dir", default=BOOKS_DIR, help="Root of the per-book workspaces")
+    args = parser.parse_args()
+
+    status_counts = run_batch(args.input, args.results, args.max_books, args.books_dir)
+    sys.exit(0 if set(status_counts) <= {'ok'} else 1)
+
+
+if __name__ == "__main__":
+    main()
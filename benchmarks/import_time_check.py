@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Import Time Check - Regression check on the startup cost of the CLI
+
+Runs `python -X importtime -c "import cli"` in a fresh interpreter and fails if a heavy dependency
+is imported at module load, or if the cumulative import time of the CLI exceeds its budget.
+With --report, also prints the cold import time of the modules loaded by each subcommand.
+
+Usage:
+    python benchmarks/import_time_check.py [--budget-ms 150] [--report]
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+# Modules that must only be imported by the subcommand that needs them
+HEAVY_MODULES = ["gradio", "weasyprint", "openai", "jinja2", "httpx", "PIL"]
+
+# Modules loaded by each subcommand, relative to the repository root
+SUBCOMMAND_MODULES = {
+    "generate": ("pipeline", []),
+    "render": ("formatting", ["book_format"]),
+    "serve": ("interface", ["gradio_interface", "story_and_image_gen"]),
+    "batch": ("batch", []),
+    "resume": ("story_and_image_generator", ["story_and_image_gen"]),
+    "books": ("catalog", []),
+    "worker": ("workers", []),
+    "api": ("job_api", []),
+}
+
+
+def import_times(module, extra_paths=()):
+    """Import module in a fresh interpreter and return {module name: cumulative import time in microseconds}."""
+    setup = "".join(f"sys.path.append({os.path.join(parent_dir, path)!r});" for path in extra_paths)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys;{setup}import {module}"],
+        cwd=parent_dir, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.splitlines()[-1] if result.stderr else ''}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time:  self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=150, help="Maximum cumulative import time of cli.py")
+    parser.add_argument("--report", action="store_true", help="Also report the import time of each subcommand")
+    args = parser.parse_args()
+
+    times = import_times("cli")
+    cli_ms = times.get("cli", 0) / 1000
+    heavy = sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES)
+    print(f"cli: {cli_ms:.1f} ms cumulative import time (budget {args.budget_ms:.0f} ms)")
+
+    if args.report:
+        for subcommand, (module, extra_paths) in SUBCOMMAND_MODULES.items():
+            try:
+                module_ms = import_times(module, extra_paths).get(module, 0) / 1000
+                print(f"  {subcommand:<9} {module:<12} {module_ms:>8.1f} ms")
+            except RuntimeError as e:
+                print(f"  {subcommand:<9} {module:<12} not importable here ({e})")
+
+    failed = False
+    if heavy:
+        print(f"❌ Heavy modules imported at CLI startup: {', '.join(heavy)}")
+        failed = True
+    if cli_ms > args.budget_ms:
+        print(f"❌ CLI import time over budget")
+        failed = True
+    if not failed:
+        print("✅ Import time check passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Mock OpenAI Server - Local stand-in for the chat completions and images endpoints
+
+Serves canned create_story / create_image_prompts_table / create_story_plan tool calls and placeholder b64 PNG images,
+after a latency drawn from a configurable distribution, and can inject 429 rate-limit errors. With
+--max-in-flight, responses carry x-ratelimit-limit/remaining-requests headers like the real API.
+Only the standard library is used. The OpenAI client is pointed at it with OPENAI_BASE_URL.
+
+Latency distributions (in seconds):
+    fixed:S, uniform:MIN,MAX, normal:MEAN,STD, lognormal:MEDIAN,SIGMA
+
+Usage:
+    python benchmarks/mock_openai_server.py [--port 8765] [--chat-latency lognormal:2,0.3]
+        [--image-latency lognormal:10,0.25] [--rate-limit-ratio 0.05] [--max-in-flight 5]
+    export OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock
+"""
+
+import re
+import sys
+import json
+import time
+import zlib
+import math
+import base64
+import random
+import struct
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STORY_SENTENCES = [
+    "Benny the bubble floated over the garden and giggled at the sleepy cat.",
+    "A gentle breeze carried him past the tall sunflowers.",
+    "Lily the ladybug waved from a bright red tulip.",
+    "Together they raced the clouds across the blue sky.",
+    "When the sun went down, Benny rested on a soft leaf.",
+]
+PLACEHOLDER_COLORS = [(255, 200, 120), (120, 200, 255), (180, 240, 160), (250, 160, 200)]
+DEFAULT_IMAGE_SIZE = (1024, 1024)
+
+
+def placeholder_png(width=1536, height=1024, color=(255, 200, 120), noise=False):
+    """Return a solid color (or random noise, as large as a real illustration) RGB PNG without any imaging dependency."""
+    if noise:
+        raw = zlib.compress(b"".join(b"\x00" + random.randbytes(3 * width) for _ in range(height)), 6)
+    else:
+        row = b"\x00" + bytes(color) * width
+        raw = zlib.compress(row * height, 6)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", raw)
+        + chunk(b"IEND", b"")
+    )
+
+
+class LatencyDistribution:
+    """Latency in seconds drawn from a distribution given as "name:param1,param2".
+
+    Args:
+        spec: "fixed:S", "uniform:MIN,MAX", "normal:MEAN,STD" or "lognormal:MEDIAN,SIGMA"
+    """
+
+    PARAMETERS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+
+    def __init__(self, spec="fixed:0"):
+        self.spec = spec
+        name, _, params = spec.partition(":")
+        try:
+            self.params = [float(param) for param in params.split(",")] if params else []
+        except ValueError:
+            raise ValueError(f"Invalid latency distribution: {spec}")
+        if name not in self.PARAMETERS or len(self.params) != self.PARAMETERS[name]:
+            raise ValueError(f"Invalid latency distribution: {spec}")
+        self.name = name
+
+    def sample(self, rng):
+        """Draw a non-negative latency in seconds."""
+        if self.name == "fixed":
+            value = self.params[0]
+        elif self.name == "uniform":
+            value = rng.uniform(*self.params)
+        elif self.name == "normal":
+            value = rng.gauss(*self.params)
+        else:
+            value = rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        return max(0.0, value)
+
+    def __repr__(self):
+        return self.spec
+
+
+class MockOpenAIServer:
+    """Threaded HTTP server answering like the OpenAI chat completions and images endpoints.
+
+    Args:
+        host: interface to listen on
+        port: port to listen on, 0 for any free port
+        chat_latency: LatencyDistribution spec of chat completion calls
+        image_latency: LatencyDistribution spec of image generation calls
+        rate_limit_ratio: probability of answering a call with a 429 error
+        max_in_flight: calls processed at the same time before answering 429, None for no limit
+        retry_after: seconds sent in the retry-after header of 429 errors
+        story_words: approximate number of words of the canned stories
+        image_prompts: number of image prompts returned when it cannot be read from the request
+        noise_images: return random noise images, as large as real illustrations, instead of solid colors
+        seed: seed of the latency and 429 draws, for reproducible runs
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, chat_latency="lognormal:2,0.3", image_latency="lognormal:10,0.25", rate_limit_ratio=0.0, max_in_flight=None, retry_after=1.0, story_words=300, image_prompts=6, noise_images=False, seed=None):
+        self.host = host
+        self.port = port
+        self.chat_latency = LatencyDistribution(chat_latency)
+        self.image_latency = LatencyDistribution(image_latency)
+        self.rate_limit_ratio = rate_limit_ratio
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.story_words = story_words
+        self.image_prompts = image_prompts
+        self.noise_images = noise_images
+        self.counters = {"chat": 0, "images": 0, "rate_limited": 0, "errors": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._images = {}  # (width, height, color index) -> b64 PNG
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def config(self):
+        """Return the settings of the server, to store them with benchmark results."""
+        return {
+            "chat_latency": self.chat_latency.spec,
+            "image_latency": self.image_latency.spec,
+            "rate_limit_ratio": self.rate_limit_ratio,
+            "max_in_flight": self.max_in_flight,
+            "story_words": self.story_words,
+            "noise_images": self.noise_images,
+        }
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def start(self):
+        """Start serving in a background thread and return the base URL for the OpenAI client."""
+        handler = type("MockOpenAIHandler", (_MockOpenAIHandler,), {"mock": self})
+        self._httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-openai-server", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def admit(self):
+        """Return True if a call is admitted, False if it must be answered with a 429."""
+        with self._lock:
+            limited = self._rng.random() < self.rate_limit_ratio
+            if self.max_in_flight is not None and self._in_flight >= self.max_in_flight:
+                limited = True
+            if limited:
+                self.counters["rate_limited"] += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def rate_limit_headers(self):
+        """Return the x-ratelimit-* headers of a response, the quota being max_in_flight calls at once."""
+        if self.max_in_flight is None:
+            return {}
+        with self._lock:
+            remaining = max(0, self.max_in_flight - self._in_flight)
+        return {"x-ratelimit-limit-requests": str(self.max_in_flight), "x-ratelimit-remaining-requests": str(remaining)}
+
+    def sample_latency(self, distribution):
+        with self._lock:
+            return distribution.sample(self._rng)
+
+    def chat_completion(self, request):
+        """Return the canned chat completion answering a forced function call."""
+        self._count("chat")
+        tool_choice = request.get("tool_choice") or {}
+        function_name = tool_choice.get("function", {}).get("name") if isinstance(tool_choice, dict) else None
+        prompt = " ".join(str(message.get("content", "")) for message in request.get("messages", []))
+
+        if function_name == "create_image_prompts_table":
+            arguments = {"image_prompts": self._image_prompts(prompt)}
+        else:
+            words_per_sentence = len(" ".join(STORY_SENTENCES).split()) / len(STORY_SENTENCES)
+            nb_sentences = max(1, round(self.story_words / words_per_sentence))
+            arguments = {
+                "title": "Benny the Bubble's Adventure",
+                "summary": "A little bubble floats through the garden and makes a new friend.",
+                "story_content": " ".join(STORY_SENTENCES[i % len(STORY_SENTENCES)] for i in range(nb_sentences))
+            }
+            if function_name == "create_story_plan":
+                arguments["image_prompts"] = self._image_prompts(prompt)
+            function_name = function_name or "create_story"
+
+        arguments_json = json.dumps(arguments)
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(arguments_json) // 4
+        return {
+            "id": f"chatcmpl-mock-{self._rng.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [{
+                        "id": "call_mock",
+                        "type": "function",
+                        "function": {"name": function_name, "arguments": arguments_json}
+                    }]
+                }
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+    def _image_prompts(self, prompt):
+        return [
+            {"image_number": i + 1, "prompt": f"Watercolor illustration {i + 1} of Benny the bubble in a sunny garden"}
+            for i in range(self._total_images(prompt))
+        ]
+
+    def _total_images(self, prompt):
+        """Read the number of image prompts asked for in the breakdown prompt, e.g. "8 images"."""
+        counts = [int(count) for count in re.findall(r"(\d+)\s+(?:\w+\s+)?(?:images|image prompts|illustrations)", prompt)]
+        return max(counts) if counts else self.image_prompts
+
+    def image_generation(self, request):
+        """Return placeholder b64 PNG images of the requested size."""
+        self._count("images")
+        match = re.fullmatch(r"(\d+)x(\d+)", str(request.get("size", "")))
+        width, height = (int(match.group(1)), int(match.group(2))) if match else DEFAULT_IMAGE_SIZE
+        prompt = str(request.get("prompt", ""))
+        data = [{"b64_json": self._image(width, height, (zlib.crc32(prompt.encode("utf-8")) + i) % len(PLACEHOLDER_COLORS))}
+                for i in range(int(request.get("n", 1) or 1))]
+        input_tokens = len(prompt) // 4
+        output_tokens = 272 if request.get("quality") == "low" else 1056
+        return {
+            "created": int(time.time()),
+            "data": data,
+            "usage": {
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+                "input_tokens_details": {"text_tokens": input_tokens, "image_tokens": 0}
+            }
+        }
+
+    def _image(self, width, height, color_index):
+        key = (width, height, color_index)
+        with self._lock:
+            image = self._images.get(key)
+        if image is None:
+            image = base64.b64encode(placeholder_png(width, height, PLACEHOLDER_COLORS[color_index], self.noise_images)).decode("ascii")
+            with self._lock:
+                self._images[key] = image
+        return image
+
+
+class _MockOpenAIHandler(BaseHTTPRequestHandler):
+    mock = None  # MockOpenAIServer, set on the subclass built by MockOpenAIServer.start
+    protocol_version = "HTTP/1.1"
+
+    ROUTES = {
+        "/v1/chat/completions": ("chat_completion", "chat_latency"),
+        "/v1/images/generations": ("image_generation", "image_latency"),
+    }
+
+    def do_POST(self):
+        route = self.ROUTES.get(self.path.split("?")[0].rstrip("/"))
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if route is None:
+            self._send_json(404, {"error": {"message": f"Unknown endpoint {self.path}", "type": "invalid_request_error"}})
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        if not self.mock.admit():
+            self._send_json(429, {"error": {
+                "message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"
+            }}, headers={
+                "retry-after": f"{self.mock.retry_after:g}",
+                "x-ratelimit-remaining-requests": "0",
+            })
+            return
+
+        handler_name, latency_name = route
+        try:
+            time.sleep(self.mock.sample_latency(getattr(self.mock, latency_name)))
+            response = getattr(self.mock, handler_name)(request)
+        except Exception as e:
+            self.mock._count("errors")
+            self._send_json(500, {"error": {"message": str(e), "type": "server_error"}})
+            return
+        else:
+            headers = self.mock.rate_limit_headers()
+        finally:
+            self.mock.release()
+        self._send_json(200, response, headers=headers)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+
+def add_mock_arguments(parser):
+    """Add the mock server options to an argument parser."""
+    parser.add_argument("--chat-latency", default="lognormal:2,0.3", help="Latency distribution of chat completions")
+    parser.add_argument("--image-latency", default="lognormal:10,0.25", help="Latency distribution of image generations")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Probability of answering a call with a 429")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Concurrent calls before answering 429")
+    parser.add_argument("--story-words", type=int, default=300, help="Approximate words of the canned stories")
+    parser.add_argument("--noise-images", action="store_true", help="Return noise images as large as real illustrations")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the latency and 429 draws")
+
+
+def mock_server_from_args(args, host="127.0.0.1", port=0):
+    """Build a MockOpenAIServer from the options added by add_mock_arguments."""
+    return MockOpenAIServer(
+        host=host, port=port, chat_latency=args.chat_latency, image_latency=args.image_latency,
+        rate_limit_ratio=args.rate_limit_ratio, max_in_flight=args.max_in_flight,
+        story_words=args.story_words, noise_images=args.noise_images, seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = mock_server_from_args(args, args.host, args.port)
+    print(f"Mock OpenAI server listening, use: export OPENAI_BASE_URL={server.start()} OPENAI_API_KEY=mock")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Calls so far: {server.stats()}")
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
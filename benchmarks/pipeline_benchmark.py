@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Pipeline Benchmark - End-to-end book latency, image throughput and render time against a mock OpenAI server
+
+A MockOpenAIServer is started in-process and the OpenAI clients are pointed at it with OPENAI_BASE_URL,
+so no real API call is made. The image and text response caches are disabled so that every book goes
+through the API path, and the shared rate limiters are lifted unless --respect-rate-limits is given.
+
+Scenarios:
+    generate  generate_story_and_images for each book: book latency and images per minute
+    render    StorybookFormatter on the generated stories: render time per page, per_page and single_pass
+    pipeline  run_storybook_pipeline (page renders overlapped with image generation): book latency
+    planning  generate with the two_call then the single_call planning mode: time to first image and
+              text input tokens per book (not run by default)
+
+Every run is appended to benchmarks/results.jsonl and compared with the previous run that used the same
+mock server settings (or with --baseline RUN_ID).
+
+Usage:
+    python benchmarks/pipeline_benchmark.py [--books 3] [--scenarios generate render pipeline]
+        [--chat-latency fixed:1] [--image-latency lognormal:10,0.25] [--rate-limit-ratio 0.05] [--label name]
+    python benchmarks/pipeline_benchmark.py --scenarios planning --chat-latency lognormal:8,0.3
+    python benchmarks/pipeline_benchmark.py --list
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+# Add repository directories to path to access config and other modules
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+sys.path.append(os.path.join(parent_dir, 'story_and_image_gen'))
+sys.path.append(os.path.join(parent_dir, 'book_format'))
+
+from mock_openai_server import add_mock_arguments, mock_server_from_args
+
+RESULTS_PATH = os.path.join(current_dir, "results.jsonl")
+USER_PROMPT = "a golden retriever that wanted to eat the biggest steak in the world"
+SCENARIOS = ["generate", "render", "pipeline", "planning"]
+DEFAULT_SCENARIOS = ["generate", "render", "pipeline"]
+
+
+def counter_delta(before, after, name):
+    """Return the increase of a counter between two tracing.METRICS snapshots."""
+    return after['counters'].get(name, 0) - before['counters'].get(name, 0)
+
+
+def span_delta(before, after, name):
+    """Return (count, seconds) of a span name between two tracing.METRICS snapshots."""
+    start = before['spans'].get(name, {'count': 0, 'seconds': 0.0})
+    end = after['spans'].get(name, {'count': 0, 'seconds': 0.0})
+    return end['count'] - start['count'], end['seconds'] - start['seconds']
+
+
+def latency_metrics(prefix, latencies):
+    """Return mean/p50/max metrics of a list of latencies in seconds."""
+    if not latencies:
+        return {}
+    return {
+        f"{prefix}_mean": statistics.mean(latencies),
+        f"{prefix}_p50": statistics.median(latencies),
+        f"{prefix}_max": max(latencies),
+    }
+
+
+def benchmark_generate(args, workdir, metrics, planning_mode=None, prefix="generate"):
+    """Generate args.books stories and their images, and return the story dictionaries."""
+    from story_and_image_generator import generate_story_and_images
+    import tracing
+    from config import TEXT_MODEL, TARGET_WORDS, TARGET_AGE, IMAGE_MODEL, IMAGE_SIZE, STORY_PLANNING_MODE
+
+    planning_mode = planning_mode or STORY_PLANNING_MODE
+    before = tracing.METRICS.snapshot()
+    stories, latencies, nb_images, failures = [], [], 0, 0
+    start = time.perf_counter()
+    for book in range(args.books):
+        book_start = time.perf_counter()
+        result = generate_story_and_images(
+            USER_PROMPT, TEXT_MODEL, TARGET_WORDS, TARGET_AGE, IMAGE_MODEL, IMAGE_SIZE,
+            output_format="dictionnary", images_dir=os.path.join(workdir, f"{prefix}_{book}", "images"),
+            planning_mode=planning_mode
+        )
+        latencies.append(time.perf_counter() - book_start)
+        if isinstance(result, dict):
+            stories.append(result)
+            nb_images += len(result.get('images', []))
+        else:
+            failures += 1
+    elapsed = time.perf_counter() - start
+    after = tracing.METRICS.snapshot()
+
+    image_calls, image_seconds = span_delta(before, after, "openai.images")
+    _, rate_limit_seconds = span_delta(before, after, "rate_limit_wait")
+    first_images, first_image_seconds = span_delta(before, after, "time_to_first_image")
+    metrics.update(latency_metrics(f"{prefix}.book_seconds", latencies))
+    metrics.update({
+        f"{prefix}.time_to_first_image_mean": first_image_seconds / first_images if first_images else 0.0,
+        f"{prefix}.text_input_tokens_per_book": counter_delta(before, after, "openai.chat.prompt_tokens") / args.books if args.books else 0.0,
+        f"{prefix}.text_calls_per_book": counter_delta(before, after, "openai.chat.requests") / args.books if args.books else 0.0,
+        f"{prefix}.images_per_minute": nb_images / elapsed * 60 if elapsed else 0.0,
+        f"{prefix}.image_call_seconds_mean": image_seconds / image_calls if image_calls else 0.0,
+        f"{prefix}.rate_limit_wait_seconds": rate_limit_seconds,
+        f"{prefix}.image_concurrency_limit": after['gauges'].get("image_concurrency_limit", 0),
+        f"{prefix}.failures": failures,
+    })
+    return stories
+
+
+def benchmark_planning(args, workdir, metrics):
+    """Generate args.books books with each planning mode, to compare the single call with the two-call flow."""
+    for planning_mode in ("two_call", "single_call"):
+        benchmark_generate(args, workdir, metrics, planning_mode=planning_mode, prefix=f"planning.{planning_mode}")
+
+
+def benchmark_render(args, workdir, stories, metrics):
+    """Render every generated story with both render modes and record the render time per page."""
+    from formatting import StorybookFormatter
+    from config import FORMAT_OPTIONS
+
+    for render_mode in ("per_page", "single_pass"):
+        page_seconds = []
+        for book, story_dict in enumerate(stories):
+            book_dir = os.path.join(workdir, f"render_{render_mode}_{book}")
+            formatter = StorybookFormatter(
+                story_dict, FORMAT_OPTIONS, render_mode=render_mode, incremental=False,
+                html_dir=os.path.join(book_dir, "html"), pdf_dir=os.path.join(book_dir, "pdf")
+            )
+            start = time.perf_counter()
+            formatter.build_storybook()
+            page_seconds.append((time.perf_counter() - start) / (formatter.nb_pages + 2))
+        metrics.update(latency_metrics(f"render.{render_mode}.page_seconds", page_seconds))
+
+
+def benchmark_pipeline(args, workdir, metrics):
+    """Generate args.books storybooks with the overlapped pipeline and record the book latency."""
+    from pipeline import run_storybook_pipeline
+    from config import TEXT_MODEL, TARGET_WORDS, TARGET_AGE, IMAGE_MODEL, IMAGE_SIZE
+
+    latencies, failures = [], 0
+    for book in range(args.books):
+        start = time.perf_counter()
+        try:
+            run_storybook_pipeline(
+                USER_PROMPT, TEXT_MODEL, TARGET_WORDS, TARGET_AGE, IMAGE_MODEL, IMAGE_SIZE,
+                output_dir=os.path.join(workdir, f"pipeline_{book}")
+            )
+        except Exception as e:
+            print(f"Error: {e}")
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+    metrics.update(latency_metrics("pipeline.book_seconds", latencies))
+    metrics["pipeline.failures"] = failures
+
+
+def git_commit():
+    """Return the short hash of the checked out commit, or None."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=parent_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_results(path):
+    """Read every stored benchmark run."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_baseline(runs, run, baseline_id=None):
+    """Return the run to compare with: baseline_id, or the last run with the same mock server and settings."""
+    if baseline_id is not None:
+        return next((previous for previous in runs if previous['run_id'] == baseline_id), None)
+    for previous in reversed(runs):
+        if previous['mock'] == run['mock'] and previous['settings'] == run['settings']:
+            return previous
+    return None
+
+
+def print_comparison(run, baseline):
+    """Print the metrics of a run next to those of its baseline."""
+    title = f"run {run['run_id']}" + (f" vs {baseline['run_id']} ({baseline.get('label') or baseline.get('git_commit')})" if baseline else "")
+    print(f"\n{title}")
+    print(f"{'metric':<48} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, value in run['metrics'].items():
+        previous = baseline['metrics'].get(name) if baseline else None
+        change = f"{(value - previous) / previous * 100:>+7.1f}%" if previous else ""
+        previous_text = f"{previous:>10.3f}" if previous is not None else f"{'':>10}"
+        print(f"{name:<48} {previous_text} {value:>10.3f} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=3, help="Books generated per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=DEFAULT_SCENARIOS)
+    parser.add_argument("--respect-rate-limits", action="store_true", help="Keep the configured API rate limiters")
+    parser.add_argument("--label", default=None, help="Name stored with the run")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSONL file the runs are appended to")
+    parser.add_argument("--baseline", default=None, help="Run id to compare with")
+    parser.add_argument("--list", action="store_true", help="List the stored runs and exit")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    runs = read_results(args.results)
+    if args.list:
+        for run in runs:
+            print(f"{run['run_id']}  {run['timestamp']}  {run.get('git_commit') or '-':<9} {run.get('label') or ''}  {run['mock']}")
+        return 0
+
+    server = mock_server_from_args(args)
+    os.environ["OPENAI_BASE_URL"] = server.start()
+    os.environ["OPENAI_API_KEY"] = "mock"
+    metrics = {}
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # Caches and the default output directories are created relative to the working directory
+            os.chdir(workdir)
+            import tracing
+            import story_and_image_generator
+            from utils import RateLimiter
+
+            tracing.METRICS.path = None  # Do not overwrite the metrics file of real runs
+            story_and_image_generator.IMAGE_CACHE = None
+            story_and_image_generator.RESPONSE_CACHE = None
+            if not args.respect_rate_limits:
+                story_and_image_generator.IMAGE_RATE_LIMITER = RateLimiter(10 ** 9, 10 ** 6)
+                story_and_image_generator.TEXT_RATE_LIMITER = RateLimiter(10 ** 9, 10 ** 6)
+
+            stories = []
+            if "generate" in args.scenarios or "render" in args.scenarios:
+                stories = benchmark_generate(args, workdir, metrics)
+                if "generate" not in args.scenarios:
+                    metrics.clear()  # Stories were only generated as render input
+            if "render" in args.scenarios:
+                benchmark_render(args, workdir, stories, metrics)
+            if "pipeline" in args.scenarios:
+                benchmark_pipeline(args, workdir, metrics)
+            if "planning" in args.scenarios:
+                benchmark_planning(args, workdir, metrics)
+    finally:
+        os.chdir(parent_dir)
+        server.stop()
+
+    run = {
+        "run_id": f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}",
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "label": args.label,
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} {os.cpu_count()} cpus",
+        "mock": server.config(),
+        "settings": {"books": args.books, "scenarios": sorted(args.scenarios), "respect_rate_limits": args.respect_rate_limits},
+        "mock_calls": server.stats(),
+        "metrics": {name: round(value, 6) for name, value in metrics.items()},
+    }
+    print_comparison(run, find_baseline(runs, run, args.baseline))
+
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + "\n")
+    print(f"\nMock server calls: {run['mock_calls']}")
+    print(f"Results appended to {args.results}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Render Benchmark - Compares the per-page and single-pass PDF rendering paths of StorybookFormatter
+
+With --optimize-images, compares instead the single-pass render of raw images against images
+downscaled and recompressed to print resolution, and reports the bytes saved.
+
+With --hot-path, compares the per-page template and stylesheet work: compiling the template and
+parsing the page CSS for every page (before) against the compiled template registry and the
+stylesheet parsed once per process (after).
+
+Usage:
+    python benchmarks/render_benchmark.py [--pages 3 8 17] [--repeat 3] [--optimize-images | --hot-path]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# Add repository directories to path to access config and other modules
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.append(parent_dir)
+sys.path.append(os.path.join(parent_dir, 'book_format'))
+
+from config import FORMAT_OPTIONS
+from formatting import StorybookFormatter
+from image_processing import optimize_story_images
+from jinja2 import Template
+from weasyprint import CSS
+from prompts import STORY_PAGE_CSS, STORY_STANDARD_TEMPLATE
+from rendering import render_template, get_page_stylesheet
+from mock_openai_server import placeholder_png
+
+SENTENCE = "Benny the bubble floated over the garden and giggled at the sleepy cat."
+
+
+def write_placeholder_png(path, width=1536, height=1024, color=(255, 200, 120), noise=False):
+    """Write a solid color (or random noise, as large as a real illustration) RGB PNG without any imaging dependency."""
+    with open(path, "wb") as f:
+        f.write(placeholder_png(width, height, color, noise))
+
+
+def make_story_dict(total_pages, noise=False):
+    """Build a story dictionary with total_pages pages (title + content + "The End")."""
+    nb_content_pages = total_pages - 2
+    os.makedirs("images", exist_ok=True)
+    images = []
+    for i in range(total_pages):
+        path = f"images/output_{i}.png"
+        write_placeholder_png(path, color=(255, (40 * i) % 256, 120), noise=noise)
+        images.append(path)
+    return {
+        "title": "Benny the Bubble's Adventure",
+        "summary": "A magical bubble learns to fly",
+        "story_content": " ".join([SENTENCE] * (nb_content_pages * 2)),
+        "images": images
+    }
+
+
+def time_render(story_dict, render_mode, repeat):
+    """Return the best wall-clock time of build_storybook over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        formatter = StorybookFormatter(story_dict, FORMAT_OPTIONS, render_mode=render_mode, optimize_images=False)
+        start = time.perf_counter()
+        formatter.build_storybook()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_image_optimization(page_counts, repeat):
+    """Compare single-pass render time and image bytes of raw and print-optimized images."""
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        for total_pages in page_counts:
+            story_dict = make_story_dict(total_pages, noise=True)
+            optimized_story, report = optimize_story_images(story_dict, FORMAT_OPTIONS)
+            raw = time_render(story_dict, "single_pass", repeat)
+            optimized = time_render(optimized_story, "single_pass", repeat)
+            results.append((total_pages, report['bytes_before'], report['bytes_after'], raw, optimized))
+
+    print(f"\n{'pages':>6} {'raw (MB)':>9} {'opt (MB)':>9} {'raw render (s)':>15} {'opt render (s)':>15}")
+    for total_pages, bytes_before, bytes_after, raw, optimized in results:
+        print(f"{total_pages:>6} {bytes_before / 1e6:>9.1f} {bytes_after / 1e6:>9.1f} {raw:>15.3f} {optimized:>15.3f}")
+
+
+def benchmark_hot_path(page_counts, repeat):
+    """Compare per-page template compile + CSS parse against the template registry and cached stylesheet."""
+    page_width, page_height = FORMAT_OPTIONS['page_size_width'], FORMAT_OPTIONS['page_size_height']
+
+    def before(total_pages):
+        for page_number in range(total_pages):
+            Template(STORY_STANDARD_TEMPLATE).render(text=SENTENCE, image=f"images/output_{page_number}.png")
+            CSS(string=Template(STORY_PAGE_CSS).render(page_width=page_width, page_height=page_height))
+
+    def after(total_pages):
+        for page_number in range(total_pages):
+            render_template("standard", text=SENTENCE, image=f"images/output_{page_number}.png")
+            get_page_stylesheet(page_width, page_height)
+
+    def best_of(function, total_pages):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(total_pages)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    print(f"\n{'pages':>6} {'before (ms)':>12} {'after (ms)':>11} {'speedup':>8}")
+    for total_pages in page_counts:
+        before_time, after_time = best_of(before, total_pages), best_of(after, total_pages)
+        print(f"{total_pages:>6} {before_time * 1000:>12.2f} {after_time * 1000:>11.2f} {before_time / after_time:>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[3, 8, 17], help="Total pages per book (title and 'The End' included)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the best one is kept")
+    parser.add_argument("--optimize-images", action="store_true", help="Compare raw and print-optimized images instead of render paths")
+    parser.add_argument("--hot-path", action="store_true", help="Compare per-page template and stylesheet work before/after the rendering layer")
+    args = parser.parse_args()
+
+    if args.hot_path:
+        benchmark_hot_path(args.pages, args.repeat)
+        return
+
+    if args.optimize_images:
+        benchmark_image_optimization(args.pages, args.repeat)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        for total_pages in args.pages:
+            story_dict = make_story_dict(total_pages)
+            per_page = time_render(story_dict, "per_page", args.repeat)
+            single_pass = time_render(story_dict, "single_pass", args.repeat)
+            results.append((total_pages, per_page, single_pass))
+
+    print(f"\n{'pages':>6} {'per_page (s)':>14} {'single_pass (s)':>16} {'speedup':>8}")
+    for total_pages, per_page, single_pass in results:
+        print(f"{total_pages:>6} {per_page:>14.3f} {single_pass:>16.3f} {per_page / single_pass:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,25 @@ Story and Image Formatting - Takes story text and image output and turns it into
 
 
 import re
-from jinja2 import Template
+import json
+import time
+import shutil
+import hashlib
 from weasyprint import HTML
 import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import webbrowser
-from config import IMAGE_GENERATION_DELAY, IMAGE_MODEL, IMAGE_SIZE, TARGET_WORDS, TARGET_AGE, TEXT_MODEL, NB_IMAGES_MAX, HTML_DIR, PDF_DIR
-from prompts import STORY_STANDARD_TEMPLATE, STORY_TITLE_TEMPLATE
+from config import IMAGE_GENERATION_DELAY, IMAGE_MODEL, IMAGE_SIZE, TARGET_WORDS, TARGET_AGE, TEXT_MODEL, NB_IMAGES_MAX, HTML_DIR, PDF_DIR, PDF_RENDER_MODE, PDF_RENDER_WORKERS, INCREMENTAL_REBUILD, PAGE_MANIFEST_FILE, IMAGE_OPTIMIZATION_ENABLED
+from prompts import STORY_PAGE_CSS
+from rendering import TEMPLATE_SOURCES, render_template, get_page_stylesheet
+from image_processing import optimize_story_images
+from layout import PageLayout
+from image_store import make_url_fetcher
+from tracing import span, add_counter
 
 # Try to import PyPDF2 for PDF merging, fallback to pypdf if not available
 try:
@@ -22,10 +34,66 @@ except ImportError:
     except ImportError:
         PdfMerger = None
 
+
+# Process-wide page render pool shared by every book and kept alive between books, so each worker process
+# imports WeasyPrint, compiles the templates and parses the page stylesheet once and reuses them
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """Return the process-wide pool of PDF_RENDER_WORKERS page render processes, started on first use."""
+    global _render_pool
+    with _render_pool_lock:
+        # A pool whose worker died is broken for good, start a new one
+        if _render_pool is None or getattr(_render_pool, "_broken", False):
+            # Spawned, not forked: books run from threads of processes with live client, writer and lease threads
+            _render_pool = ProcessPoolExecutor(max_workers=max(1, PDF_RENDER_WORKERS or 1), mp_context=multiprocessing.get_context("spawn"))
+        return _render_pool
+
+
+@atexit.register
+def shutdown_render_pool():
+    """Stop the page render processes, if they were started."""
+    global _render_pool
+    with _render_pool_lock:
+        pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def render_page_pdf(html_path, pdf_path, base_url, page_size, images=None):
+    """Render one HTML page file to a PDF file. Module-level so it can run in a worker process.
+
+    page_size is the (width, height) of the shared page stylesheet, parsed once per worker process.
+    images maps the memory: URLs used by the page to their bytes, served through a custom url_fetcher.
+    """
+    html_options = {'url_fetcher': make_url_fetcher(images)} if images else {}
+    HTML(filename=html_path, base_url=base_url, **html_options).write_pdf(
+        pdf_path,
+        stylesheets=[get_page_stylesheet(*page_size)],
+        presentational_hints=True
+    )
+    return pdf_path
+
+
 class StorybookFormatter:
-    def __init__(self, story_dict, format_options, nb_pages=None):
+    def __init__(self, story_dict, format_options, nb_pages=None, render_mode=PDF_RENDER_MODE, render_workers=PDF_RENDER_WORKERS, incremental=INCREMENTAL_REBUILD, html_dir=HTML_DIR, pdf_dir=PDF_DIR, optimize_images=IMAGE_OPTIMIZATION_ENABLED, image_store=None, trace=None):
         self.story_dict = story_dict
+        self.trace = trace
         self.format_options = format_options
+        self.image_store = image_store
+        self.optimize_images = optimize_images
+        self.html_dir = html_dir
+        self.pdf_dir = pdf_dir
+        self.render_mode = render_mode
+        self.render_workers = render_workers
+        self.incremental = incremental
+        self.failed_pages = {}
+        self.page_hashes = None
+        self.pages_to_render = None
+        self.book_changed = True
+        self.layout = PageLayout(format_options)
         
         # Calculate nb_pages from the number of images if not provided
         if nb_pages is None:
@@ -38,23 +106,22 @@ class StorybookFormatter:
 
     def break_story_into_pages(self):
         """
-        Break the story text into N_PAGES = N_IMAGES
+        Break the story text into N_PAGES = N_IMAGES, balanced with the font metrics of the page text box
+
+        Pages break between sentences (or clauses and words for short stories) and keep the original
+        punctuation. Pages still taller than the text box are reported.
 
-        PB: we loose the original punctuation, needs to be improved with a GPT4.1 call instead of this regex rule   
-        
         Returns:
             story_pages: dictionary of page_number: page_content
         """
+        start = time.perf_counter()
         story_pages = {}
-        
-        # Split the story text into sentences
-        sentence_pattern = r'(?<=[.!?])\s+(?=[A-Z])'
-        sentences = re.split(sentence_pattern, self.story_dict['story_content'])
-        
-        if len(sentences) % self.nb_pages == 0:
-            nb_sentences_per_page = (round(len(sentences) / self.nb_pages))
-        else:
-            nb_sentences_per_page = (round(len(sentences) / self.nb_pages)) + 1
+
+        page_texts = self.layout.paginate(self.story_dict['story_content'], self.nb_pages)
+        overflowing_pages = [index + 1 for index in self.layout.overflowing_pages(page_texts)]
+        for page_number in overflowing_pages:
+            print(f"⚠️ Page {page_number} text is taller than the text box "
+                  f"({self.layout.count_lines(page_texts[page_number - 1])} lines, max {self.layout.max_lines})")
 
         # Create the title page
         title_page_content = {
@@ -65,10 +132,8 @@ class StorybookFormatter:
 
         # Create each page content
         for page_number in range(1, self.nb_pages+1):
-            # Evenly split the sentences across the pages
-            page_sentences = sentences[(page_number-1) * nb_sentences_per_page:(page_number) * nb_sentences_per_page]
             page_content = {
-                'text': '. '.join(page_sentences),
+                'text': page_texts[page_number-1],
                 'image': self.story_dict['images'][page_number]
             }
             story_pages[page_number] = page_content
@@ -80,11 +145,88 @@ class StorybookFormatter:
         }
         story_pages[self.nb_pages+1] = end_page_content
 
+        if self.trace is not None:
+            self.trace.record("paginate", start, time.perf_counter() - start, pages=len(story_pages), overflowing_pages=overflowing_pages)
         return story_pages
 
+    def _page_template(self, page_number):
+        """Return the name of the registered template used for a page."""
+        return "title" if page_number == 0 else "standard"
+
+    def _page_size(self):
+        """Return the (width, height) of the pages from the format options."""
+        return self.format_options['page_size_width'], self.format_options['page_size_height']
+
+    def _image_src(self, path):
+        """Return the URL of an image in the templates: a memory: URL when it is in the image store."""
+        if self.image_store is not None and path:
+            return self.image_store.src_for(path)
+        return path
+
+    def _file_hash(self, path):
+        """Return the SHA-256 of a file (from the image store when it is there), or None if it does not exist."""
+        if self.image_store is not None and path and path in self.image_store:
+            return hashlib.sha256(self.image_store.get(path)).hexdigest()
+        if not path or not os.path.exists(path):
+            return None
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def compute_page_hashes(self, story_pages):
+        """Hash everything a page render depends on: text, image file content, template and format options
+
+        Args:
+            story_pages: dictionary of page_number: page_content
+
+        Returns:
+            dict: page_number -> content hash
+        """
+        page_hashes = {}
+        for page_number, content in story_pages.items():
+            payload = json.dumps({
+                'text': content['text'],
+                'image': content['image'],
+                'image_hash': self._file_hash(content['image']),
+                'template': TEMPLATE_SOURCES[self._page_template(page_number)],
+                'stylesheet': STORY_PAGE_CSS,
+                'format_options': self.format_options
+            }, sort_keys=True)
+            page_hashes[page_number] = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        return page_hashes
+
+    def load_manifest(self):
+        """Load the page manifest of the previous build, empty if there is none."""
+        manifest_path = f"{self.pdf_dir}/{PAGE_MANIFEST_FILE}"
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return {int(page_number): page_hash for page_number, page_hash in json.load(f)['pages'].items()}
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def save_manifest(self, page_hashes):
+        """Save the page manifest of the current build."""
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        with open(f"{self.pdf_dir}/{PAGE_MANIFEST_FILE}", 'w', encoding='utf-8') as f:
+            json.dump({'pages': {str(page_number): page_hash for page_number, page_hash in sorted(page_hashes.items())}}, f, indent=2)
+
+    def _remove_stale_files(self, directory, prefix, extension):
+        """Remove page files left over from a previous build with more pages."""
+        if not os.path.exists(directory):
+            return
+        for filename in os.listdir(directory):
+            match = re.fullmatch(rf'{prefix}(\d+)\.{extension}', filename)
+            if match and int(match.group(1)) >= self.nb_pages + 2:
+                os.remove(os.path.join(directory, filename))
+
     def build_html(self, story_pages):
         """Build HTML for all pages
 
+        In incremental mode only pages whose content hash changed since the last build are
+        written, and the pages to re-render are stored in self.pages_to_render for build_pdf.
+
         Args:
             story_pages: dictionary of page_number: page_content
 
@@ -92,81 +234,172 @@ class StorybookFormatter:
             None
         """
 
-        rendered_pages = []
+        if self.incremental:
+            # Compare with the manifest of the previous build and keep unchanged pages
+            self.page_hashes = self.compute_page_hashes(story_pages)
+            previous_hashes = self.load_manifest()
+            self.book_changed = previous_hashes != self.page_hashes
+            self.pages_to_render = [
+                page_number for page_number in sorted(story_pages.keys())
+                if previous_hashes.get(page_number) != self.page_hashes[page_number]
+                or not os.path.exists(f"{self.html_dir}/storybook_html_page_{page_number}.html")
+                or not os.path.exists(f"{self.pdf_dir}/storybook_pdf_page_{page_number}.pdf")
+            ]
+            self._remove_stale_files(self.html_dir, 'storybook_html_page_', 'html')
+            print(f"♻️ {len(story_pages) - len(self.pages_to_render)} unchanged pages reused, {len(self.pages_to_render)} pages to render")
+            add_counter(self.trace, "pdf.pages_reused", len(story_pages) - len(self.pages_to_render))
 
-        # Store all HTML rendered pages in a directory
-        if os.path.exists(HTML_DIR):
-            os.system(f"rm -rf {HTML_DIR}")
-        
-        os.makedirs(HTML_DIR, exist_ok=True)
+        else:
+            self.book_changed = True
+            self.pages_to_render = sorted(story_pages.keys())
 
-        # Create the title page
-        page_number = 0
-        content = story_pages[page_number]
-        template_title = Template(STORY_TITLE_TEMPLATE)
-        page_html = template_title.render(
-            text=content['text'], 
-            image=content['image'],
-            page_width=self.format_options['page_size_width'], 
-            page_height=self.format_options['page_size_height']
-        )
-        rendered_pages.append(page_html)
+            # Store all HTML rendered pages in a directory
+            if os.path.exists(self.html_dir):
+                shutil.rmtree(self.html_dir)
         
-        # Save title page
-        with open(f"{HTML_DIR}/storybook_html_page_{page_number}.html", 'w', encoding='utf-8') as f:
-            f.write(page_html)
-        print(f"Title page saved to {HTML_DIR}/storybook_html_page_{page_number}.html")
-
-        # Create the main story pages
-        for page_number in sorted(story_pages.keys()):
-            if page_number == 0:  # Skip title page, already handled
-                continue
-            
-            content = story_pages[page_number]
-            
-            # Regular content page
-            template_standard = Template(STORY_STANDARD_TEMPLATE)
-            page_html = template_standard.render(
+        os.makedirs(self.html_dir, exist_ok=True)
+
+        for page_number in self.pages_to_render:
+            self.write_page_html(page_number, story_pages[page_number])
+
+    def write_page_html(self, page_number, content):
+        """Render one page with its template and write it to the HTML directory
+
+        Args:
+            page_number: number of the page (0 for the title page)
+            content: page content with 'text' and 'image'
+
+        Returns:
+            str: path of the written HTML file
+        """
+        with span(self.trace, "html_render", page_number=page_number):
+            # Title page or regular content page
+            page_html = render_template(
+                self._page_template(page_number),
                 text=content['text'], 
-                image=content['image'],
-                page_width=self.format_options['page_size_width'], 
-                page_height=self.format_options['page_size_height']
+                image=self._image_src(content['image'])
             )
             
-            rendered_pages.append(page_html)
-            
-            with open(f"{HTML_DIR}/storybook_html_page_{page_number}.html", 'w', encoding='utf-8') as f:
+            html_path = f"{self.html_dir}/storybook_html_page_{page_number}.html"
+            with open(html_path, 'w', encoding='utf-8') as f:
                 f.write(page_html)
+        if page_number == 0:
+            print(f"Title page saved to {html_path}")
+        else:
             if page_number == self.nb_pages + 1:  # "The End" page
                 print(f"Creating 'The End' page with text: {content['text']}")
-            print(f"Page {page_number} saved to {HTML_DIR}/storybook_html_page_{page_number}.html")
+            print(f"Page {page_number} saved to {html_path}")
+        return html_path
+
+    def submit_page_pdf(self, executor, page_number):
+        """Submit the PDF render of one page (whose HTML is already written) to an executor
+
+        Args:
+            executor: concurrent.futures executor running render_page_pdf
+            page_number: number of the page to render
+
+        Returns:
+            Future of the rendered PDF path
+        """
+        return self._trace_page_render(executor.submit(render_page_pdf, *self._page_job(page_number)), page_number)
+
+    def _trace_page_render(self, future, page_number):
+        """Record a pdf_render span for a page rendered in a worker process, from submission to completion."""
+        if self.trace is None:
+            return future
+        start = time.perf_counter()
+
+        def _record(done):
+            error = done.exception()
+            attributes = {'error': str(error)} if error is not None else self._page_pdf_attributes(page_number)
+            self.trace.record("pdf_render", start, time.perf_counter() - start, page_number=page_number, **attributes)
+
+        future.add_done_callback(_record)
+        return future
+
+    def _page_pdf_attributes(self, page_number):
+        """Return the span attributes of a rendered page PDF, and count its bytes."""
+        pdf_path = f"{self.pdf_dir}/storybook_pdf_page_{page_number}.pdf"
+        pdf_bytes = os.path.getsize(pdf_path) if os.path.exists(pdf_path) else 0
+        add_counter(self.trace, "pdf.pages_rendered")
+        add_counter(self.trace, "pdf.page_bytes", pdf_bytes)
+        return {'bytes': pdf_bytes}
+
+    def _page_job(self, page_number):
+        """Return the render_page_pdf arguments of a page, with its in-memory image if any."""
+        images = None
+        if self.image_store is not None:
+            page_images = self.story_dict.get('images', [])
+            images = self.image_store.subset(page_images[page_number:page_number+1])
+        return (
+            f"{self.html_dir}/storybook_html_page_{page_number}.html",
+            f"{self.pdf_dir}/storybook_pdf_page_{page_number}.pdf",
+            os.getcwd(),
+            self._page_size(),
+            images
+        )
     
     def build_pdf(self):
         """Build PDF for all pages
 
+        Pages are rendered by the process-wide render pool shared by every book (in this process when
+        self.render_workers is 1).
+        A page that fails is recorded in self.failed_pages and reported, the other pages are still rendered.
+        In incremental mode only the pages selected by build_html are rendered and the others are kept.
+
         Args:
             None
 
         Returns:
-            None
+            bool: True if every page was rendered, False otherwise
         """
-        # Store all PDF rendered pages in a directory
-        if os.path.exists(PDF_DIR):
-            os.system(f"rm -rf {PDF_DIR}")
+        pages_to_render = self.pages_to_render
+        if pages_to_render is None:
+            pages_to_render = list(range(self.nb_pages+2))  # +2 for title and "The End" pages
+
+        if self.incremental:
+            self._remove_stale_files(self.pdf_dir, 'storybook_pdf_page_', 'pdf')
+        elif os.path.exists(self.pdf_dir):
+            # Store all PDF rendered pages in a directory
+            shutil.rmtree(self.pdf_dir)
         
-        os.makedirs(PDF_DIR, exist_ok=True)
+        os.makedirs(self.pdf_dir, exist_ok=True)
 
-        for page_number in range(self.nb_pages+2):  # +2 for title and "The End" pages
-            try:
-                HTML(string=f"{HTML_DIR}/storybook_html_page_{page_number}.html", base_url=os.getcwd()).write_pdf(
-                    f"{PDF_DIR}/storybook_pdf_page_{page_number}.pdf",
-                    stylesheets=[],
-                    presentational_hints=True
-                )
+        page_jobs = {page_number: self._page_job(page_number) for page_number in pages_to_render}
 
-            except Exception as e:
-                print(f"Error creating PDF: {e}")
-                return False
+        self.failed_pages = {}
+        workers = max(1, min(self.render_workers or 1, len(page_jobs) or 1))
+        if workers == 1:
+            for page_number, job in page_jobs.items():
+                try:
+                    with span(self.trace, "pdf_render", page_number=page_number) as attributes:
+                        render_page_pdf(*job)
+                        if self.trace is not None:
+                            attributes.update(self._page_pdf_attributes(page_number))
+                except Exception as e:
+                    self.failed_pages[page_number] = str(e)
+        else:
+            executor = get_render_pool()
+            futures = {
+                page_number: self._trace_page_render(executor.submit(render_page_pdf, *job), page_number)
+                for page_number, job in page_jobs.items()
+            }
+            for page_number, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    self.failed_pages[page_number] = str(e)
+
+        for page_number, error in sorted(self.failed_pages.items()):
+            print(f"Error creating PDF for page {page_number}: {error}")
+
+        if self.incremental and self.page_hashes is not None:
+            # Failed pages are left out of the manifest so they are rendered again next time
+            self.save_manifest({
+                page_number: page_hash for page_number, page_hash in self.page_hashes.items()
+                if page_number not in self.failed_pages
+            })
+        return not self.failed_pages
 
     def merge_pdfs(self, output_filename="storybook.pdf"):
         """Merge individual PDF pages into a single storybook PDF
@@ -178,20 +411,23 @@ class StorybookFormatter:
             bool: True if successful, False otherwise
         """         
         try:
-            merger = PdfMerger()
-            
-            # Add each page PDF to the merger
-            for page_number in range(self.nb_pages+2):  # +2 for title and "The End" pages
-                pdf_path = f"{PDF_DIR}/storybook_pdf_page_{page_number}.pdf"
-                if os.path.exists(pdf_path):
-                    merger.append(pdf_path)
-                else:
-                    print(f"Warning: Page {page_number} PDF not found at {pdf_path}")
-            
-            # Write the merged PDF
-            output_path = f"{PDF_DIR}/{output_filename}"
-            merger.write(output_path)
-            merger.close()
+            with span(self.trace, "pdf_merge") as attributes:
+                merger = PdfMerger()
+                
+                # Add each page PDF to the merger
+                for page_number in range(self.nb_pages+2):  # +2 for title and "The End" pages
+                    pdf_path = f"{self.pdf_dir}/storybook_pdf_page_{page_number}.pdf"
+                    if os.path.exists(pdf_path):
+                        merger.append(pdf_path)
+                    else:
+                        print(f"Warning: Page {page_number} PDF not found at {pdf_path}")
+                
+                # Write the merged PDF
+                output_path = f"{self.pdf_dir}/{output_filename}"
+                merger.write(output_path)
+                merger.close()
+                attributes['bytes'] = os.path.getsize(output_path)
+            self._count_book(output_path)
             
             return True
             
@@ -199,6 +435,53 @@ class StorybookFormatter:
             print(f"Error merging PDFs: {e}")
             return False
 
+    def _count_book(self, output_path):
+        """Count the pages and bytes of a written storybook PDF in the trace."""
+        add_counter(self.trace, "pdf.books")
+        add_counter(self.trace, "pdf.pages", self.nb_pages + 2)  # +2 for title and "The End" pages
+        add_counter(self.trace, "pdf.bytes", os.path.getsize(output_path))
+
+    def build_single_pass_pdf(self, story_pages, output_filename="storybook.pdf"):
+        """Render all pages into one multi-page HTML document and write the storybook PDF in a single pass
+
+        No intermediate HTML or per-page PDF files are written, and WeasyPrint lays out
+        and subsets fonts once for the whole book instead of once per page.
+
+        Args:
+            story_pages: dictionary of page_number: page_content
+            output_filename: Name of the output PDF file
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        pages = [
+            {
+                'text': story_pages[page_number]['text'],
+                'image': self._image_src(story_pages[page_number]['image']),
+                'is_title': page_number == 0
+            }
+            for page_number in sorted(story_pages.keys())
+        ]
+        book_html = render_template("book", pages=pages)
+
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        html_options = {'url_fetcher': self.image_store.url_fetcher} if self.image_store is not None else {}
+        output_path = f"{self.pdf_dir}/{output_filename}"
+        try:
+            with span(self.trace, "single_pass_render", pages=len(pages)) as attributes:
+                HTML(string=book_html, base_url=os.getcwd(), **html_options).write_pdf(
+                    output_path,
+                    stylesheets=[get_page_stylesheet(*self._page_size())],
+                    presentational_hints=True
+                )
+                attributes['bytes'] = os.path.getsize(output_path)
+            self._count_book(output_path)
+            return True
+
+        except Exception as e:
+            print(f"Error creating PDF: {e}")
+            return False
+
     def build_storybook(self):
         """Build the storybook
         
@@ -209,16 +492,33 @@ class StorybookFormatter:
             None
         """
 
+        # Downscale and recompress images to print resolution before layout
+        if self.optimize_images:
+            with span(self.trace, "optimize_images") as attributes:
+                self.story_dict, report = optimize_story_images(self.story_dict, self.format_options)
+                attributes.update(report)
+            add_counter(self.trace, "image.optimized_bytes_before", report['bytes_before'])
+            add_counter(self.trace, "image.optimized_bytes_after", report['bytes_after'])
+
         # Break down story into pages
         story_pages = self.break_story_into_pages()
 
+        if self.render_mode == "single_pass":
+            # Render the whole book in one WeasyPrint pass
+            self.build_single_pass_pdf(story_pages)
+            print(f"✅ Storybook PDF generated")
+            return
+
         # Build HTML of each page
         self.build_html(story_pages)
         
         # Convert HTML to PDF
         self.build_pdf()
         
-        # Merge individual PDFs into a single storybook
+        # Merge individual PDFs into a single storybook, unless nothing changed since the last build
+        if self.incremental and not self.book_changed and not self.pages_to_render and os.path.exists(f"{self.pdf_dir}/storybook.pdf"):
+            print(f"✅ Storybook PDF unchanged")
+            return
         self.merge_pdfs()
 
         print(f"✅ Storybook PDF generated")
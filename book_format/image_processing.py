@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Image Processing - Downscales and recompresses story images to print resolution before layout
+"""
+
+import io
+import os
+import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import IMAGE_TARGET_DPI, IMAGE_OUTPUT_FORMAT, IMAGE_OUTPUT_QUALITY, IMAGE_PROCESSING_WORKERS
+
+# Pillow is optional, images are left untouched if it is not available
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CSS_PX_PER_INCH = 96  # CSS pixels are defined at 96 DPI
+OUTPUT_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+
+def css_length_to_px(length):
+    """Convert a CSS length from FORMAT_OPTIONS ("1536px", "8.5in", "21cm"...) to CSS pixels."""
+    match = re.fullmatch(r'\s*([\d.]+)\s*(px|in|cm|mm|pt)?\s*', str(length))
+    if match is None:
+        raise ValueError(f"Unsupported CSS length: {length}")
+    value, unit = float(match.group(1)), match.group(2) or 'px'
+    per_inch = {'px': CSS_PX_PER_INCH, 'in': 1, 'cm': 2.54, 'mm': 25.4, 'pt': 72}[unit]
+    return value * CSS_PX_PER_INCH / per_inch
+
+
+def target_size(format_options, dpi=IMAGE_TARGET_DPI):
+    """Return the (width, height) in image pixels of the page box printed at dpi."""
+    scale = dpi / CSS_PX_PER_INCH
+    return (
+        round(css_length_to_px(format_options['page_size_width']) * scale),
+        round(css_length_to_px(format_options['page_size_height']) * scale)
+    )
+
+
+def optimized_path(image_path, output_format=IMAGE_OUTPUT_FORMAT):
+    """Return the path of the optimized version of an image."""
+    root, _ = os.path.splitext(image_path)
+    return f"{root}.print.{OUTPUT_EXTENSIONS[output_format]}"
+
+
+def optimize_image_bytes(image_bytes, box_size, output_format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_OUTPUT_QUALITY):
+    """
+    Downscale an encoded image so that it still covers box_size, and re-encode it.
+
+    Images are never upscaled, since the page template crops them with object-fit: cover.
+
+    Args:
+        image_bytes: encoded source image
+        box_size: (width, height) in pixels of the page box at the target DPI
+        output_format: "JPEG" or "WEBP"
+        quality: encoder quality (1-100)
+
+    Returns:
+        bytes: encoded optimized image
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        scale = max(box_size[0] / image.width, box_size[1] / image.height)
+        if scale < 1:
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format=output_format, quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def optimize_image(image_path, box_size, output_format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_OUTPUT_QUALITY):
+    """
+    Optimize an image file with optimize_image_bytes and write it next to the source.
+
+    Args:
+        image_path: path of the source image
+        box_size: (width, height) in pixels of the page box at the target DPI
+        output_format: "JPEG" or "WEBP"
+        quality: encoder quality (1-100)
+
+    Returns:
+        tuple: (optimized image path, source size in bytes, optimized size in bytes)
+    """
+    output_path = optimized_path(image_path, output_format)
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    optimized_bytes = optimize_image_bytes(image_bytes, box_size, output_format, quality)
+    with open(output_path, 'wb') as f:
+        f.write(optimized_bytes)
+    return output_path, len(image_bytes), len(optimized_bytes)
+
+
+def optimize_story_images(story_dict, format_options, dpi=IMAGE_TARGET_DPI, output_format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_OUTPUT_QUALITY, workers=IMAGE_PROCESSING_WORKERS):
+    """
+    Optimize every image of a story on a process pool and point the story to the optimized files.
+
+    Missing images and images that fail to process are kept as they are.
+
+    Args:
+        story_dict: story dictionary with the list of image paths in 'images'
+        format_options: storybook formatting options with the page size
+        dpi: print resolution of the page box
+        output_format: "JPEG" or "WEBP"
+        quality: encoder quality (1-100)
+        workers: processes used to optimize the images
+
+    Returns:
+        tuple: (story dictionary with optimized image paths, report with bytes before/after)
+    """
+    report = {'images': 0, 'bytes_before': 0, 'bytes_after': 0}
+    if Image is None:
+        print("Warning: Pillow is not installed, images are not optimized")
+        return story_dict, report
+
+    box_size = target_size(format_options, dpi)
+    images = list(story_dict.get('images', []))
+    existing = [i for i, path in enumerate(images) if path and os.path.exists(path)]
+
+    with ProcessPoolExecutor(max_workers=max(1, min(workers or 1, len(existing) or 1)), mp_context=multiprocessing.get_context("spawn")) as executor:  # Not forked from a threaded process
+        futures = {i: executor.submit(optimize_image, images[i], box_size, output_format, quality) for i in existing}
+        for i, future in futures.items():
+            try:
+                output_path, bytes_before, bytes_after = future.result()
+            except Exception as e:
+                print(f"Error optimizing image {images[i]}: {e}")
+                continue
+            images[i] = output_path
+            report['images'] += 1
+            report['bytes_before'] += bytes_before
+            report['bytes_after'] += bytes_after
+
+    saved = report['bytes_before'] - report['bytes_after']
+    print(f"🖼️ Optimized {report['images']} images to {box_size[0]}x{box_size[1]} {output_format}: "
+          f"{report['bytes_before'] / 1e6:.1f} MB -> {report['bytes_after'] / 1e6:.1f} MB ({saved / 1e6:.1f} MB saved)")
+
+    optimized_story = dict(story_dict)
+    optimized_story['images'] = images
+    return optimized_story, report
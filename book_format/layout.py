@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Page Layout - Spreads the story text over the pages using the font metrics of the page template
+
+Text is measured without a WeasyPrint render, with the glyph advances of the page text font through
+Pillow: LAYOUT_FONT_FILE when it is set, otherwise the file fontconfig picks for the font-family of
+STORY_PAGE_CSS in bold (the same lookup WeasyPrint does). Without Pillow or fontconfig the built-in
+Arial Bold metrics are used. Lines are wrapped at spaces like the browser does, and the sentences are
+spread over the pages so that the fullest page is as short as possible, keeping the original text and
+punctuation.
+"""
+
+import re
+import subprocess
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+from image_processing import css_length_to_px
+from config import LAYOUT_FONT_FILE
+from prompts import STORY_PAGE_CSS
+
+# Pillow is optional, the built-in metrics are used if it is not available
+try:
+    from PIL import ImageFont
+except ImportError:
+    ImageFont = None
+
+# Must match .text-overlay and .text in STORY_PAGE_CSS (CSS pixels)
+TEXT_FONT_SIZE = 24
+TEXT_LINE_HEIGHT = 1.4
+TEXT_BOX_HORIZONTAL_INSETS = 2 * 96 + 2 * 72 + 2 * 3  # left/right 1in, padding 0.75in, 3px border
+DEFAULT_TEXT_BOX_MAX_HEIGHT = "336px"
+
+# Advance widths of Arial Bold (metric-compatible with Helvetica Bold) in 1/1000 em, for " " to "~"
+ARIAL_BOLD_WIDTHS = dict(zip(map(chr, range(32, 127)), [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,  # space to /
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,  # 0 to ?
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,  # @ to O
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,  # P to _
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,  # ` to o
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,       # p to ~
+]))
+ARIAL_BOLD_WIDTHS.update({"’": 278, "‘": 278, "“": 500, "”": 500, "—": 1000, "–": 556, "…": 1000})
+DEFAULT_GLYPH_WIDTH = 556
+
+# Page breaks, from the preferred to the last resort: after a sentence, after a clause, between words
+BREAK_PATTERNS = [
+    re.compile(r'[.!?…]+["\'”’)\]]*(\s+)(?=[^\sa-z])'),
+    re.compile(r'[,;:—]["\'”’)\]]*(\s+)'),
+    re.compile(r'(\s+)'),
+]
+
+# Abbreviations ending with a period that do not end a sentence
+NO_BREAK_AFTER = {"Mr.", "Mrs.", "Ms.", "Dr.", "St.", "Mt."}
+
+
+@lru_cache(maxsize=None)
+def page_font_file(css: str = STORY_PAGE_CSS) -> Optional[str]:
+    """Return the font file fontconfig picks for the bold page text of css, None if fontconfig is not available."""
+    match = re.search(r"font-family:\s*([^;]+);", css)
+    if match is None:
+        return None
+    # fontconfig pattern "Family 1,Family 2:bold", with its special characters escaped in the names
+    families = [re.sub(r"([\\\-:,])", r"\\\1", family.strip().strip("\"'")) for family in match.group(1).split(",")]
+    try:
+        result = subprocess.run(["fc-match", "--format=%{file}", ",".join(families) + ":bold"], capture_output=True, text=True, timeout=10, check=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+@lru_cache(maxsize=None)
+def _load_font(font_file: str, size: int):
+    return ImageFont.truetype(font_file, size)
+
+
+@lru_cache(maxsize=65536)
+def text_width(font_file: Optional[str], size: int, text: str) -> float:
+    """Return the advance width of text in CSS pixels, cached per (font, size, string)."""
+    if font_file is not None and ImageFont is not None:
+        return _load_font(font_file, size).getlength(text)
+    return sum(ARIAL_BOLD_WIDTHS.get(character, DEFAULT_GLYPH_WIDTH) for character in text) * size / 1000
+
+
+def split_units(text: str, pattern: re.Pattern) -> List[Tuple[int, int]]:
+    """Return the (start, end) offsets of the pieces of text between the breaks matched by pattern."""
+    units, start = [], 0
+    for match in pattern.finditer(text):
+        if text[:match.start(1)].rsplit(None, 1)[-1] in NO_BREAK_AFTER:
+            continue
+        if text[start:match.start(1)].strip():
+            units.append((start, match.start(1)))
+        start = match.end(1)
+    if text[start:].strip():
+        units.append((start, len(text.rstrip())))
+    return units
+
+
+class PageLayout:
+    """Text box of the story pages for a set of format options.
+
+    Args:
+        format_options: storybook format options, giving the page width and optional text_box_max_height
+        font_file: TrueType font file measured through Pillow, None for the page CSS font found by fontconfig
+        font_size: font size of the page text in CSS pixels
+        line_height: line height of the page text, as a multiple of font_size
+    """
+
+    def __init__(self, format_options, font_file: Optional[str] = LAYOUT_FONT_FILE, font_size: int = TEXT_FONT_SIZE, line_height: float = TEXT_LINE_HEIGHT):
+        self.font_file = font_file if font_file is not None else page_font_file()
+        if self.font_file is not None and ImageFont is None:
+            self.font_file = None  # The file cannot be measured without Pillow, fall back to the built-in metrics
+        self.font_size = font_size
+        self.line_px = font_size * line_height
+        self.width = css_length_to_px(format_options['page_size_width']) - TEXT_BOX_HORIZONTAL_INSETS
+        self.max_height = css_length_to_px(format_options.get('text_box_max_height', DEFAULT_TEXT_BOX_MAX_HEIGHT))
+        self.max_lines = max(1, int(self.max_height // self.line_px))
+
+    def count_lines(self, text: str) -> int:
+        """Return the number of lines text wraps to in the text box."""
+        space = text_width(self.font_file, self.font_size, " ")
+        lines, line_width = 0, 0.0
+        for word in text.split():
+            width = text_width(self.font_file, self.font_size, word)
+            if lines and line_width + space + width <= self.width:
+                line_width += space + width
+            else:
+                lines, line_width = lines + 1, width
+        return lines
+
+    def line_width(self, text: str) -> float:
+        """Return the width in CSS pixels of text set on a single line (its words separated by one space)."""
+        words = text.split()
+        space = text_width(self.font_file, self.font_size, " ")
+        return sum(text_width(self.font_file, self.font_size, word) for word in words) + space * max(0, len(words) - 1)
+
+    def text_height(self, text: str) -> float:
+        """Return the height in CSS pixels of text in the text box."""
+        return self.count_lines(text) * self.line_px
+
+    def paginate(self, text: str, nb_pages: int) -> List[str]:
+        """
+        Split text into nb_pages page texts, breaking between sentences when there are enough of them.
+
+        Among the possible splits, the one with the fewest lines on its fullest page is kept, and then
+        the one with the most even amount of text per page. Page texts are slices of text, so the
+        punctuation is kept.
+
+        Args:
+            text: story text
+            nb_pages: number of pages, one per content image
+
+        Returns:
+            list of nb_pages page texts (empty strings if text has fewer words than pages)
+        """
+        if nb_pages <= 0:
+            return []
+        units = []
+        for pattern in BREAK_PATTERNS:
+            units = split_units(text, pattern)
+            if len(units) >= nb_pages:
+                break
+
+        if not units:
+            return [""] * nb_pages
+        unit_words = [[text_width(self.font_file, self.font_size, word) for word in text[first:last].split()] for first, last in units]
+        nb_units = len(units)
+        filled = min(nb_pages, nb_units)
+
+        # The fewest lines the fullest page can have, then only the pages that short are considered
+        low, high = 1, self.count_lines(text)
+        while low < high:
+            middle = (low + high) // 2
+            if self._fits(unit_words, filled, middle):
+                high = middle
+            else:
+                low = middle + 1
+        pages_from = [list(self._pages_from(unit_words, first, low)) for first in range(nb_units)]
+
+        # best[k][j]: (fullest page lines, sum of squared page widths, previous break) of units[:j] over k pages
+        best = [{0: (0, 0.0, None)}]
+        for k in range(1, filled + 1):
+            row = {}
+            for i, (fullest, squares, _) in sorted(best[k - 1].items()):
+                for j, lines, width in pages_from[i]:
+                    if j > nb_units - (filled - k):
+                        break
+                    candidate = (max(fullest, lines), squares + width * width, i)
+                    if j not in row or candidate[:2] < row[j][:2]:
+                        row[j] = candidate
+            best.append(row)
+
+        breaks, j = [], nb_units
+        for k in range(filled, 0, -1):
+            i = best[k][j][2]
+            breaks.append((i, j))
+            j = i
+        pages = [text[units[i][0]:units[j - 1][1]].strip() for i, j in reversed(breaks)]
+        return pages + [""] * (nb_pages - len(pages))
+
+    def _pages_from(self, unit_words: List[List[float]], first: int, max_lines: int) -> Iterator[Tuple[int, int, float]]:
+        """Yield (end, lines, width) of the pages made of units first to end - 1, while they fit in max_lines.
+
+        The words are wrapped once, extending the page one unit at a time: appending words never moves
+        the earlier line breaks, so the line count of each longer page follows from the previous one.
+        """
+        space = text_width(self.font_file, self.font_size, " ")
+        lines, line_width, width = 0, 0.0, -space
+        for last in range(first, len(unit_words)):
+            for word in unit_words[last]:
+                if lines and line_width + space + word <= self.width:
+                    line_width += space + word
+                else:
+                    lines, line_width = lines + 1, word
+                width += space + word
+            if lines > max_lines:
+                return
+            yield last + 1, lines, width
+
+    def _fits(self, unit_words: List[List[float]], nb_pages: int, max_lines: int) -> bool:
+        """Return True if the units can be spread over at most nb_pages pages of at most max_lines lines."""
+        first = 0
+        for _ in range(nb_pages):
+            end = first
+            for end, _, _ in self._pages_from(unit_words, first, max_lines):
+                pass
+            if end == first:
+                return False  # A single unit is taller than max_lines
+            if end == len(unit_words):
+                return True
+            first = end
+        return False
+
+    def overflowing_pages(self, pages: List[str]) -> List[int]:
+        """Return the indexes of the page texts taller than the text box."""
+        return [index for index, page in enumerate(pages) if self.count_lines(page) > self.max_lines]
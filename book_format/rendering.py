@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Rendering - Compiled page templates and shared parsed stylesheet
+
+Templates are compiled once by a module-level Jinja Environment, and the page CSS is parsed once
+per process and page size into a weasyprint.CSS object reused for every page and every book.
+"""
+
+from functools import lru_cache
+from jinja2 import Environment, DictLoader, Template
+from weasyprint import CSS
+from prompts import STORY_PAGE_CSS, STORY_STANDARD_TEMPLATE, STORY_TITLE_TEMPLATE, STORY_BOOK_TEMPLATE
+
+# Template name -> template source
+TEMPLATE_SOURCES = {
+    "title": STORY_TITLE_TEMPLATE,
+    "standard": STORY_STANDARD_TEMPLATE,
+    "book": STORY_BOOK_TEMPLATE,
+}
+
+# The Environment compiles each template on first use and keeps it in its cache
+TEMPLATE_ENVIRONMENT = Environment(loader=DictLoader(TEMPLATE_SOURCES), cache_size=-1, auto_reload=False)
+
+
+def get_template(name):
+    """Return the compiled template registered under name ("title", "standard" or "book")."""
+    return TEMPLATE_ENVIRONMENT.get_template(name)
+
+
+def render_template(name, **context):
+    """Render a registered template."""
+    return get_template(name).render(**context)
+
+
+@lru_cache(maxsize=None)
+def get_page_stylesheet(page_width, page_height):
+    """Return the page stylesheet for a page size, parsed once per process."""
+    return CSS(string=Template(STORY_PAGE_CSS).render(page_width=page_width, page_height=page_height))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Book Catalog - Persistent index of the generated storybooks and their assets
+
+Every finished book is recorded in a SQLite catalog (request, story JSON, image prompts, timings) and
+its images and PDF are copied to a content-addressed blob directory, so a past book can be exported
+again, or re-rendered by StorybookFormatter, without any API call even after images/ and pdf/ are overwritten.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from config import CATALOG_PATH, CATALOG_BLOBS_DIR
+
+
+class BlobStore:
+    """Content-addressed file store: each blob is kept once as {root}/{key[:2]}/{key}, key being its SHA-256 and extension.
+
+    Args:
+        root: directory of the blobs
+    """
+
+    def __init__(self, root: str = CATALOG_BLOBS_DIR):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data: bytes, extension: str = "") -> str:
+        """Store data and return its blob key."""
+        key = hashlib.sha256(data).hexdigest() + extension
+        path = self.path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return key
+
+    def put_file(self, source: str) -> str:
+        """Store the content of a file and return its blob key."""
+        with open(source, 'rb') as f:
+            data = f.read()
+        return self.put(data, os.path.splitext(source)[1].lower())
+
+    def link(self, key: str, destination: str):
+        """Materialise a blob at destination, as a hard link when possible or a copy otherwise."""
+        source = self.path(key)
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"Blob {key} is missing from {self.root}")
+        if os.path.dirname(destination):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+
+class BookCatalog:
+    """SQLite catalog of the generated books, with their assets in a BlobStore.
+
+    Books are indexed by creation date, title and prompt (case-insensitive prefix lookups use the indexes).
+
+    Args:
+        path: path of the SQLite database file
+        blobs_dir: directory of the content-addressed images and PDFs
+    """
+
+    def __init__(self, path: str = CATALOG_PATH, blobs_dir: str = CATALOG_BLOBS_DIR):
+        self.path = path
+        self.blobs = BlobStore(blobs_dir)
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS books ("
+                "book_id TEXT PRIMARY KEY, created_at REAL NOT NULL, user_prompt TEXT COLLATE NOCASE, title TEXT COLLATE NOCASE, "
+                "text_model TEXT, image_model TEXT, image_size TEXT, target_words INTEGER, target_age INTEGER, "
+                "story TEXT NOT NULL, nb_images INTEGER, pdf_blob TEXT, status TEXT, duration REAL, timings TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS book_images ("
+                "book_id TEXT NOT NULL, image_number INTEGER NOT NULL, blob TEXT, prompt TEXT, "
+                "PRIMARY KEY (book_id, image_number))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS books_created_at ON books (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS books_title ON books (title)")
+            conn.execute("CREATE INDEX IF NOT EXISTS books_user_prompt ON books (user_prompt)")
+
+    @contextmanager
+    def _connect(self):
+        # Committed on success, rolled back on error, and always closed
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add_book(self, story_dict: Dict, request: Dict, pdf_path: Optional[str] = None, image_prompts: Optional[List[str]] = None, trace=None, image_store=None) -> str:
+        """
+        Record a finished book and copy its images and PDF to the blob store.
+
+        Args:
+            story_dict: story dictionnary with the image paths used by the book
+            request: user_prompt, text_model, image_model, image_size, target_words and target_age of the book
+            pdf_path: path of the storybook PDF, if one was built
+            image_prompts: prompt of each image, in image order
+            trace: optional Trace whose span totals and counters are stored as the book timings
+            image_store: optional ImageStore holding the image bytes (read instead of the files when present)
+
+        Returns:
+            book_id of the recorded book
+        """
+        book_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        image_blobs = []
+        for image_path in story_dict.get('images', []):
+            if image_store is not None and image_path in image_store:
+                image_blobs.append(self.blobs.put(image_store.get(image_path), os.path.splitext(image_path)[1].lower()))
+            elif image_path and os.path.exists(image_path):
+                image_blobs.append(self.blobs.put_file(image_path))
+            else:
+                image_blobs.append(None)  # Failed image, the page is rendered without it
+        pdf_blob = self.blobs.put_file(pdf_path) if pdf_path and os.path.exists(pdf_path) else None
+
+        story = {key: value for key, value in story_dict.items() if key != 'images'}
+        timings = None
+        duration = None
+        if trace is not None:
+            trace_dict = trace.to_dict()
+            duration = trace_dict['duration']
+            timings = json.dumps({'spans': trace.span_totals(), 'counters': trace_dict['counters']})
+        image_prompts = image_prompts or []
+
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO books (book_id, created_at, user_prompt, title, text_model, image_model, image_size, target_words, target_age, "
+                "story, nb_images, pdf_blob, status, duration, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    book_id, time.time(), request.get('user_prompt'), story_dict.get('title'), request.get('text_model'),
+                    request.get('image_model'), request.get('image_size'), request.get('target_words'), request.get('target_age'),
+                    json.dumps(story), max(0, len(image_blobs) - 2), pdf_blob,
+                    'partial' if story_dict.get('failed_images') or None in image_blobs else 'ok', duration, timings
+                )
+            )
+            conn.executemany(
+                "INSERT INTO book_images (book_id, image_number, blob, prompt) VALUES (?, ?, ?, ?)",
+                [(book_id, image_number, blob, image_prompts[image_number] if image_number < len(image_prompts) else None)
+                 for image_number, blob in enumerate(image_blobs)]
+            )
+        return book_id
+
+    def get_book(self, book_id: str) -> Dict:
+        """
+        Return a catalogued book: its request fields, story, timings, PDF blob and images ({image_number, blob, prompt}).
+
+        Raises:
+            ValueError: If book_id is not in the catalog.
+        """
+        with self._lock, self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM books WHERE book_id = ?", (book_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Book {book_id} is not in the catalog {self.path}")
+            images = conn.execute(
+                "SELECT image_number, blob, prompt FROM book_images WHERE book_id = ? ORDER BY image_number", (book_id,)
+            ).fetchall()
+        book = dict(row)
+        book['story'] = json.loads(book['story'])
+        book['timings'] = json.loads(book['timings']) if book['timings'] else None
+        book['images'] = [dict(image) for image in images]
+        return book
+
+    def find_books(self, prompt: Optional[str] = None, title: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None, limit: int = 20) -> List[Dict]:
+        """
+        Return the newest books matching every given filter.
+
+        Args:
+            prompt: case-insensitive prefix of the user prompt
+            title: case-insensitive prefix of the title
+            since: oldest creation time (Unix timestamp)
+            until: newest creation time (Unix timestamp)
+            limit: maximum number of books
+
+        Returns:
+            list of {book_id, created_at, title, user_prompt, target_age, nb_images, status, duration}
+        """
+        conditions, parameters = [], []
+        for column, value in (("user_prompt", prompt), ("title", title)):
+            if value:
+                escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                conditions.append(f"{column} LIKE ? ESCAPE '\\'")
+                parameters.append(escaped + "%")
+        if since is not None:
+            conditions.append("created_at >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("created_at <= ?")
+            parameters.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock, self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT book_id, created_at, title, user_prompt, target_age, nb_images, status, duration "
+                f"FROM books {where} ORDER BY created_at DESC LIMIT ?",
+                parameters + [limit]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def restore_story(self, book_id: str, images_dir: str) -> Dict:
+        """
+        Materialise the images of a book in images_dir and return its story dictionnary, ready for StorybookFormatter.
+
+        Raises:
+            ValueError: If book_id is not in the catalog.
+        """
+        book = self.get_book(book_id)
+        story_dict = dict(book['story'])
+        story_dict['images'] = []
+        for image in book['images']:
+            if image['blob'] is None:
+                story_dict['images'].append(f"{images_dir}/output_{image['image_number']}.png")  # Missing, rendered without image
+                continue
+            image_path = f"{images_dir}/output_{image['image_number']}{os.path.splitext(image['blob'])[1]}"
+            self.blobs.link(image['blob'], image_path)
+            story_dict['images'].append(image_path)
+        return story_dict
+
+    def export_pdf(self, book_id: str, destination: str) -> str:
+        """
+        Copy the stored PDF of a book to destination and return its path.
+
+        Raises:
+            ValueError: If book_id is not in the catalog or has no stored PDF.
+        """
+        book = self.get_book(book_id)
+        if book['pdf_blob'] is None:
+            raise ValueError(f"Book {book_id} has no stored PDF, rebuild it from its images instead")
+        if os.path.dirname(destination):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(self.blobs.path(book['pdf_blob']), destination)  # A copy, so editing it never alters the blob
+        return destination
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_book_catalog() -> BookCatalog:
+    """Return the process-wide catalog at CATALOG_PATH, opened on first use and shared by concurrent runs."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = BookCatalog()
+        return _catalog
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Command line interface for the Children's Storybook Generator
+
+Each subcommand imports only the modules it needs, so that e.g. rendering a stored story does not
+load gradio or openai, and serving does not load weasyprint until a book is generated.
+
+Usage:
+    python cli.py generate "a golden retriever that wanted to eat the biggest steak in the world"
+    python cli.py render story.json
+    python cli.py serve [--api-port 8000]
+    python cli.py api [--port 8000]
+    python cli.py batch prompts.jsonl
+    python cli.py resume 20250101-120000-1a2b3c4d
+    python cli.py books --title "Benny"
+    python cli.py export 20250101-120000-1a2b3c4d storybook.pdf [--rebuild]
+    python cli.py submit "a golden retriever that wanted to eat the biggest steak in the world"
+    python cli.py worker --stage image [--concurrency 8] [--processes 2]
+    python cli.py queue [20250101-120000-1a2b3c4d]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from config import (
+    TARGET_WORDS, TARGET_AGE, TEXT_MODEL, IMAGE_MODEL, IMAGE_SIZE, FORMAT_OPTIONS,
+    PDF_RENDER_MODE, BATCH_MAX_CONCURRENT_BOOKS, IMAGES_DIR, HTML_DIR, PDF_DIR, BOOKS_DIR, GRADIO_CONCURRENCY_LIMIT, TRACING_ENABLED, TRACE_FILE,
+    STORY_PLANNING_MODE, JOB_API_HOST, JOB_API_PORT, JOB_API_MAX_CONCURRENT_BOOKS, JOB_API_MAX_QUEUED_BOOKS
+)
+
+DEFAULT_USER_PROMPT = "a golden retriever that wanted to eat the biggest steak in the world"
+
+
+def _add_package_paths(*packages):
+    """Make the modules of the given package directories importable."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    for package in packages:
+        path = os.path.join(root, package)
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+def generate_command(args):
+    """Generate a story, its images and the storybook PDF."""
+    from pipeline import generate_storybook
+
+    story_dict = generate_storybook(
+        args.prompt, args.text_model, args.target_words, args.target_age, args.image_model, args.image_size,
+        FORMAT_OPTIONS, output_dir=args.output_dir, planning_mode=args.planning_mode
+    )
+    if story_dict is None:
+        return 1
+    if args.save_story:
+        with open(args.save_story, 'w', encoding='utf-8') as f:
+            json.dump(story_dict, f, indent=2)
+    return 0
+
+
+def render_command(args):
+    """Render a storybook PDF from a story dictionary saved as JSON."""
+    _add_package_paths('book_format')
+    from formatting import StorybookFormatter
+    from tracing import Trace, finish_trace
+
+    with open(args.story, 'r', encoding='utf-8') as f:
+        story_dict = json.load(f)
+    trace = Trace("render", story=args.story, render_mode=args.mode) if TRACING_ENABLED else None
+    formatter = StorybookFormatter(story_dict, FORMAT_OPTIONS, render_mode=args.mode, trace=trace)
+    formatter.build_storybook()
+    finish_trace(trace, f"{formatter.pdf_dir}/{TRACE_FILE}")
+    return 0 if not formatter.failed_pages else 1
+
+
+def serve_command(args):
+    """Launch the Gradio interface."""
+    _add_package_paths('gradio_interface', 'story_and_image_gen')
+    from interface import launch_interface
+
+    if args.api_port is not None:
+        from job_api import JobAPIServer
+
+        print(f"🌐 Job API listening on {JobAPIServer(port=args.api_port).start()}")
+    launch_interface(concurrency_limit=args.concurrency)
+    return 0
+
+
+def api_command(args):
+    """Serve the headless HTTP job API."""
+    from job_api import JobAPIServer, BookJobs
+
+    JobAPIServer(BookJobs(max_books=args.max_books, max_queued=args.max_queued), host=args.host, port=args.port).serve_forever()
+    return 0
+
+
+def batch_command(args):
+    """Generate every book of a JSONL file."""
+    from batch import run_batch
+
+    status_counts = run_batch(args.input, args.results, args.max_books, args.books_dir)
+    return 0 if set(status_counts) <= {'ok'} else 1
+
+
+def resume_command(args):
+    """Finish a checkpointed run, generating only the failed or missing images (and the PDF of a storybook run)."""
+    _add_package_paths('story_and_image_gen')
+    from checkpoint import RunCheckpoint
+
+    try:
+        request = RunCheckpoint.load(args.run_id).request
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    if 'output_dir' in request:
+        # Storybook pipeline run (cli.py generate, batch, job API): finish it up to the PDF
+        from pipeline import resume_storybook
+
+        try:
+            story_dict, _ = resume_storybook(args.run_id)
+        except Exception as e:
+            print(f"Error: {e}")
+            return 1
+    else:
+        from story_and_image_generator import resume
+
+        story_dict = resume(args.run_id, output_format="dictionnary")
+    if not isinstance(story_dict, dict):
+        return 1
+    if args.save_story:
+        with open(args.save_story, 'w', encoding='utf-8') as f:
+            json.dump(story_dict, f, indent=2)
+    return 0 if not story_dict.get('failed_images') else 1
+
+
+def books_command(args):
+    """List the catalogued books, newest first."""
+    from catalog import BookCatalog
+
+    since = time.mktime(time.strptime(args.since, "%Y-%m-%d")) if args.since else None
+    for book in BookCatalog().find_books(prompt=args.prompt, title=args.title, since=since, limit=args.limit):
+        created_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(book['created_at']))
+        print(f"{book['book_id']}  {created_at}  {book['status']:<7}  {book['title']}  ({book['user_prompt']})")
+    return 0
+
+
+def export_command(args):
+    """Export a catalogued book: copy its stored PDF, or re-render it from its stored images with --rebuild."""
+    from catalog import BookCatalog
+
+    catalog = BookCatalog()
+    if not args.rebuild:
+        print(f"✅ Storybook exported to {catalog.export_pdf(args.book_id, args.output)}")
+        return 0
+
+    _add_package_paths('book_format')
+    from formatting import StorybookFormatter
+
+    workspace = args.workspace or f"export_{args.book_id}"
+    story_dict = catalog.restore_story(args.book_id, os.path.join(workspace, IMAGES_DIR))
+    # Stored images are the ones the book was laid out with, already optimized when optimization was on
+    formatter = StorybookFormatter(
+        story_dict, FORMAT_OPTIONS, render_mode=args.mode, optimize_images=False,
+        html_dir=os.path.join(workspace, HTML_DIR), pdf_dir=os.path.join(workspace, PDF_DIR)
+    )
+    formatter.build_storybook()
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    os.replace(os.path.join(formatter.pdf_dir, "storybook.pdf"), args.output)
+    print(f"✅ Storybook rebuilt to {args.output}")
+    return 0 if not formatter.failed_pages else 1
+
+
+def submit_command(args):
+    """Queue a book for the stage workers."""
+    from workers import submit_book
+
+    book_id = submit_book({
+        'user_prompt': args.prompt, 'text_model': args.text_model, 'target_words': args.target_words, 'target_age': args.target_age,
+        'image_model': args.image_model, 'image_size': args.image_size, 'planning_mode': args.planning_mode
+    }, books_dir=args.books_dir)
+    print(f"📥 Book {book_id} queued, run the text, image and render workers to generate it")
+    return 0
+
+
+def worker_command(args):
+    """Run the workers of one stage until interrupted, or until idle for --idle-timeout seconds."""
+    from workers import run_workers
+
+    processed = run_workers(args.stage, args.processes, concurrency=args.concurrency, idle_timeout=args.idle_timeout)
+    print(f"👷 {args.stage} workers processed {processed} jobs")
+    return 0
+
+
+def queue_command(args):
+    """Show the jobs of the queue per stage and status, or the status of one book."""
+    from workers import open_queue, book_status
+
+    queue = open_queue()
+    if args.book_id:
+        print(json.dumps(book_status(queue, args.book_id), indent=2))
+        return 0
+    for stage, counts in sorted(queue.stats().items()):
+        print(f"{stage:<7} " + "  ".join(f"{status}={count}" for status, count in sorted(counts.items())))
+    return 0
+
+
+def build_parser():
+    """Build the argument parser of the CLI."""
+    parser = argparse.ArgumentParser(description="Children's Storybook Generator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="Generate a story, its images and the storybook PDF")
+    generate.add_argument("prompt", nargs="?", default=DEFAULT_USER_PROMPT, help="Story prompt")
+    generate.add_argument("--text-model", default=TEXT_MODEL)
+    generate.add_argument("--target-words", type=int, default=TARGET_WORDS)
+    generate.add_argument("--target-age", type=int, default=TARGET_AGE)
+    generate.add_argument("--image-model", default=IMAGE_MODEL)
+    generate.add_argument("--image-size", default=IMAGE_SIZE)
+    generate.add_argument("--planning-mode", choices=["two_call", "single_call"], default=STORY_PLANNING_MODE,
+                          help="single_call returns the story and its image prompts in one text call")
+    generate.add_argument("--output-dir", default=None, help="Workspace for images/html/pdf (default: current directory)")
+    generate.add_argument("--save-story", default=None, help="Also save the story dictionary as JSON, for the render command")
+    generate.set_defaults(func=generate_command)
+
+    render = subparsers.add_parser("render", help="Render a storybook PDF from a saved story dictionary")
+    render.add_argument("story", help="JSON file with title, summary, story_content and images")
+    render.add_argument("--mode", choices=["single_pass", "per_page"], default=PDF_RENDER_MODE)
+    render.set_defaults(func=render_command)
+
+    serve = subparsers.add_parser("serve", help="Launch the Gradio interface")
+    serve.add_argument("--concurrency", type=int, default=GRADIO_CONCURRENCY_LIMIT, help="Generations running at the same time")
+    serve.add_argument("--api-port", type=int, default=None, help="Also serve the job API on this port")
+    serve.set_defaults(func=serve_command)
+
+    api = subparsers.add_parser("api", help="Serve the headless HTTP job API")
+    api.add_argument("--host", default=JOB_API_HOST)
+    api.add_argument("--port", type=int, default=JOB_API_PORT)
+    api.add_argument("--max-books", type=int, default=JOB_API_MAX_CONCURRENT_BOOKS, help="Books generated at the same time")
+    api.add_argument("--max-queued", type=int, default=JOB_API_MAX_QUEUED_BOOKS, help="Jobs waiting for a slot before submissions are rejected")
+    api.set_defaults(func=api_command)
+
+    batch = subparsers.add_parser("batch", help="Generate every book of a JSONL file of prompts")
+    batch.add_argument("input", help="JSONL file with one book request per line")
+    batch.add_argument("--results", default=None)
+    batch.add_argument("--max-books", type=int, default=BATCH_MAX_CONCURRENT_BOOKS)
+    batch.add_argument("--books-dir", default=BOOKS_DIR)
+    batch.set_defaults(func=batch_command)
+
+    resume = subparsers.add_parser("resume", help="Finish a checkpointed run, redoing only its failed or missing work")
+    resume.add_argument("run_id", help="Run id printed when the run started (checkpoints are in RUNS_DIR)")
+    resume.add_argument("--save-story", default=None, help="Also save the story dictionary as JSON, for the render command")
+    resume.set_defaults(func=resume_command)
+
+    books = subparsers.add_parser("books", help="List the catalogued books")
+    books.add_argument("--prompt", default=None, help="Start of the user prompt")
+    books.add_argument("--title", default=None, help="Start of the title")
+    books.add_argument("--since", default=None, help="Oldest creation date, YYYY-MM-DD")
+    books.add_argument("--limit", type=int, default=20)
+    books.set_defaults(func=books_command)
+
+    export = subparsers.add_parser("export", help="Export a catalogued book without regenerating it")
+    export.add_argument("book_id", help="Book id, see the books command")
+    export.add_argument("output", help="Path of the exported PDF")
+    export.add_argument("--rebuild", action="store_true", help="Re-render the PDF from the stored images and story instead of copying it")
+    export.add_argument("--mode", choices=["single_pass", "per_page"], default=PDF_RENDER_MODE)
+    export.add_argument("--workspace", default=None, help="Workspace for the restored images/html/pdf (default: export_<book_id>)")
+    export.set_defaults(func=export_command)
+
+    submit = subparsers.add_parser("submit", help="Queue a book for the stage workers")
+    submit.add_argument("prompt", nargs="?", default=DEFAULT_USER_PROMPT, help="Story prompt")
+    submit.add_argument("--text-model", default=TEXT_MODEL)
+    submit.add_argument("--target-words", type=int, default=TARGET_WORDS)
+    submit.add_argument("--target-age", type=int, default=TARGET_AGE)
+    submit.add_argument("--image-model", default=IMAGE_MODEL)
+    submit.add_argument("--image-size", default=IMAGE_SIZE)
+    submit.add_argument("--planning-mode", choices=["two_call", "single_call"], default=STORY_PLANNING_MODE)
+    submit.add_argument("--books-dir", default=BOOKS_DIR, help="Root of the book workspaces, shared by the workers")
+    submit.set_defaults(func=submit_command)
+
+    worker = subparsers.add_parser("worker", help="Process the queued jobs of one stage")
+    worker.add_argument("--stage", choices=["text", "image", "render"], required=True)
+    worker.add_argument("--concurrency", type=int, default=None, help="Jobs in progress per process (default: STAGE_CONCURRENCY)")
+    worker.add_argument("--processes", type=int, default=1, help="Worker processes")
+    worker.add_argument("--idle-timeout", type=float, default=None, help="Exit after this many seconds without a job")
+    worker.set_defaults(func=worker_command)
+
+    queue = subparsers.add_parser("queue", help="Show the queued jobs, or the status of a queued book")
+    queue.add_argument("book_id", nargs="?", default=None, help="Book id printed by the submit command")
+    queue.set_defaults(func=queue_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
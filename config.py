@@ -3,15 +3,21 @@
 Configuration file for the Children's Storybook Generator
 """
 
+import os
+
 # Story generation settings
 TARGET_WORDS = 50
 TARGET_AGE = 3
+TARGET_WORDS_MIN, TARGET_WORDS_MAX = 50, 1500  # Story lengths offered by the interface and accepted by the job API
+TARGET_AGE_MIN, TARGET_AGE_MAX = 3, 8  # Target ages offered by the interface and accepted by the job API
 TEXT_MODEL = "gpt-4.1"  # only OpenAI models are supported for now
+STORY_PLANNING_MODE = "two_call"  # "two_call": story then image prompts breakdown, "single_call": story and image prompts in one call
 
 # Image generation settings
 NB_IMAGES_MAX = 15
 IMAGE_MODEL = "gpt-image-1"  # only OpenAI models are supported for now
 IMAGE_SIZE = "1536x1024"  # Portrait format closest to book ratio (816x1056px)
+IMAGE_QUALITY = "low"
 
 # Age-based words per image settings
 WORDS_PER_IMAGE_AGES_3_4 = 50    # More images for younger children (3-4 years)
@@ -22,15 +28,128 @@ WORDS_PER_IMAGE_AGES_7_PLUS = 100  # Fewer images for older children (7+ years)
 FORMAT_OPTIONS = {
     "page_size_width": "1536px",  # 8.5 inches * 96 DPI
     "page_size_height": "1024px",  # 11 inches * 96 DPI
+    "text_box_max_height": "336px",  # Height of the story page text (10 lines), pages are balanced to fit it
 }
+LAYOUT_FONT_FILE = None  # TrueType file of the page text font measured for pagination, None for the page CSS font found by fontconfig (built-in Arial Bold metrics without Pillow or fontconfig)
+PDF_RENDER_MODE = "single_pass"  # "single_pass" renders the whole book at once, "per_page" writes one HTML/PDF per page then merges
+PDF_RENDER_WORKERS = os.cpu_count() or 1  # Processes of the page render pool shared by every book in "per_page" mode (1 renders in-process)
+IMAGE_OPTIMIZATION_ENABLED = True  # Downscale and recompress images to print resolution before layout (requires Pillow)
+IMAGE_TARGET_DPI = 150  # Print resolution of the page box used to size images
+IMAGE_OUTPUT_FORMAT = "JPEG"  # "JPEG" or "WEBP"
+IMAGE_OUTPUT_QUALITY = 85  # Encoder quality (1-100)
+IMAGE_PROCESSING_WORKERS = os.cpu_count() or 1  # Processes used to optimize images
+INCREMENTAL_REBUILD = True  # In "per_page" mode, only re-render pages whose content changed since the last build
+
+# Gradio serving settings
+GRADIO_CONCURRENCY_LIMIT = 4  # Generations running at the same time, other requests wait in the queue
+GRADIO_QUEUE_MAX_SIZE = 32  # Requests waiting in the queue before new ones are rejected
+SESSION_MAX_AGE = 3600  # Per-request workspaces untouched for this long (in seconds, newest file) are deleted once their request is over
+SESSION_CLEANUP_INTERVAL = 600  # Seconds between two background cleanups of old workspaces
+
+# HTTP job API settings
+JOB_API_HOST = "127.0.0.1"  # Interface the job API listens on
+JOB_API_PORT = 8000
+JOB_API_MAX_CONCURRENT_BOOKS = 4  # Books generated at the same time by the job API, other jobs wait queued
+JOB_API_MAX_QUEUED_BOOKS = 64  # Jobs waiting for a slot before new submissions are rejected with 503
+JOB_API_MAX_BODY_BYTES = 64 * 1024  # Largest accepted submission body, bigger ones are rejected with 413 without being read
+JOB_API_JOB_MAX_AGE = 24 * 3600  # Finished jobs and their workspaces older than this (in seconds) are deleted
 
 # API settings
 API_KEY_ENV_VAR = "OPENAI_API_KEY"
 
+# OpenAI HTTP client settings (one pooled client shared by every generator of the process)
+OPENAI_MAX_CONNECTIONS = 32  # Connections open at the same time across all concurrent books
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 16  # Idle connections kept alive for reuse
+OPENAI_KEEPALIVE_EXPIRY = 120  # Seconds an idle connection is kept alive
+OPENAI_CONNECT_TIMEOUT = 10  # Seconds to open a connection
+OPENAI_READ_TIMEOUT = 300  # Seconds to wait for a response (image generation is slow)
+OPENAI_POOL_TIMEOUT = 60  # Seconds to wait for a free connection from the pool
+OPENAI_MAX_RETRIES = 2  # Retries of the OpenAI client on connection errors, 429 and 5xx
+
 # Rate limiting settings (in seconds)
 IMAGE_GENERATION_DELAY = 2  # Delay between image API calls to avoid rate limits
 
+# Concurrent image generation settings
+IMAGE_GENERATION_WORKERS = 4  # Max number of image API calls in flight at once (per book, without adaptive concurrency)
+IMAGE_REQUESTS_PER_MINUTE = 30  # Shared budget for image API calls across all workers (without adaptive concurrency)
+IMAGE_REQUESTS_BURST = 4  # Number of image API calls allowed back-to-back before throttling
+TEXT_REQUESTS_PER_MINUTE = 60  # Shared budget for text API calls across all concurrent books
+TEXT_REQUESTS_BURST = 4  # Number of text API calls allowed back-to-back before throttling
+
+# Adaptive concurrency settings (AIMD limit on the API calls in flight, fed by 429s and x-ratelimit-* headers)
+ADAPTIVE_CONCURRENCY_ENABLED = True  # Tune the calls in flight to the account quota instead of only the fixed budgets above
+IMAGE_CONCURRENCY_INITIAL = IMAGE_GENERATION_WORKERS  # Image API calls in flight allowed at startup, across the process
+IMAGE_CONCURRENCY_MAX = 16  # The image limit never grows above this
+TEXT_CONCURRENCY_INITIAL = 4  # Text API calls in flight allowed at startup, across the process
+TEXT_CONCURRENCY_MAX = 16  # The text limit never grows above this
+CONCURRENCY_MIN = 1  # Limits are never cut below this
+CONCURRENCY_DECREASE_FACTOR = 0.5  # Multiplies the limit on a 429 or a nearly exhausted quota
+CONCURRENCY_DECREASE_INTERVAL = 2  # Seconds after a cut during which other throttled calls do not cut again
+RATE_LIMIT_HEADROOM = 0.1  # Remaining quota fraction (x-ratelimit-remaining-*) under which calls are throttled
+IMAGE_REQUESTS_PER_MINUTE_CEILING = None  # With adaptive concurrency, optional fixed cap on image calls per minute (None: the adaptive limit alone decides)
+IMAGE_BOOK_WORKERS = IMAGE_CONCURRENCY_MAX if ADAPTIVE_CONCURRENCY_ENABLED else IMAGE_GENERATION_WORKERS  # Image calls a book may have in flight, gated process-wide by the adaptive limit
+
+# Image request retry and hedging settings
+IMAGE_MAX_ATTEMPTS = 3  # Attempts of an image request on rate-limit, connection and server errors
+IMAGE_RETRY_BASE_DELAY = 2  # Seconds, backoff cap of the first retry (doubled at each retry, full jitter)
+IMAGE_RETRY_MAX_DELAY = 30  # Seconds, maximum backoff cap
+IMAGE_HEDGING_ENABLED = False  # Send a duplicate image request when a call is slower than IMAGE_HEDGE_PERCENTILE
+IMAGE_HEDGE_PERCENTILE = 90  # Percentile of the recent image call latencies past which a call is hedged
+IMAGE_HEDGE_MIN_SAMPLES = 10  # Image call latencies observed before hedging starts
+IMAGE_HEDGE_MIN_DELAY = 5  # Seconds, calls are never hedged earlier than this
+IMAGE_HEDGE_MAX_RATIO = 0.1  # Hedges allowed per image request, caps the extra API cost (0.1 = 10%)
+IMAGE_HEDGE_WINDOW = 200  # Number of recent image call latencies the percentile is computed on
+
+# Batch generation settings
+BATCH_MAX_CONCURRENT_BOOKS = 4  # Books generated at the same time by the batch runner
+
+# Stage worker queue settings
+STAGE_CONCURRENCY = {"text": 2, "image": IMAGE_BOOK_WORKERS, "render": 1}  # Jobs in progress per worker process of each stage
+QUEUE_LEASE_SECONDS = 120  # A claimed job whose worker stopped renewing its lease for this long is claimed again
+QUEUE_MAX_ATTEMPTS = 3  # Attempts of a stage job before it fails for good (a failed image job leaves its page without image)
+QUEUE_RETRY_STAGES = ("text", "render")  # Stages whose failed jobs are queued again; image jobs are already retried by the image generator
+QUEUE_RETRY_BASE_DELAY = 5  # Seconds, backoff cap of the first retry of a failed stage job (doubled at each retry, full jitter)
+QUEUE_POLL_INTERVAL = 1  # Seconds an idle worker waits before looking for a job again
+QUEUE_JOURNAL_MODE = "DELETE"  # SQLite journal of the queue: DELETE works on shared storage, WAL is faster but needs every worker on one host
+
+# In-memory image handoff settings
+IMAGE_STORE_ENABLED = True  # Keep generated images in memory and serve them to WeasyPrint without a disk round trip
+IMAGE_STORE_PERSIST = True  # Also write images to disk in the background (write-behind), needed by checkpoints to resume a run
+IMAGE_STORE_WRITERS = 4  # Threads writing images to disk, shared by every book of the process
+
+# Instrumentation settings
+TRACING_ENABLED = True  # Record per-stage timings, tokens and bytes of every book (saved as TRACE_FILE)
+
+# Run checkpoint settings
+CHECKPOINTS_ENABLED = True  # Write a checkpoint manifest of every run (story, image prompts, image status) resumable by run id
+RUNS_MAX_AGE = 7 * 24 * 3600  # Checkpoint manifests not updated for this long (in seconds) are deleted, even if their images are still there
+
+# Book catalog settings
+CATALOG_ENABLED = True  # Record every finished storybook (request, story, timings) and keep its images and PDF for re-export
+
+# Image cache settings
+IMAGE_CACHE_ENABLED = True  # Serve repeated image requests from disk instead of the API
+IMAGE_CACHE_MAX_BYTES = 500 * 1024 * 1024  # Least recently used images are evicted above this size
+
+# Text response cache settings
+RESPONSE_CACHE_BACKEND = "sqlite"  # "sqlite", "memory" or None to disable caching of text API responses
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # Cached responses older than this (in seconds) are discarded
+RESPONSE_CACHE_MAX_ENTRIES = 1000  # Least recently used responses are evicted above this count
+
 # File paths
 IMAGES_DIR = "images"
 HTML_DIR = "html"
-PDF_DIR = "pdf"
\ No newline at end of file
+PDF_DIR = "pdf"
+IMAGE_CACHE_DIR = ".cache/images"
+RESPONSE_CACHE_PATH = ".cache/responses.sqlite3"
+BOOKS_DIR = "books"  # Root of the per-book workspaces created by the batch runner
+SESSIONS_DIR = "sessions"  # Root of the per-request workspaces created by the Gradio interface
+JOB_API_DIR = "api_books"  # Root of the per-job workspaces created by the job API
+BATCH_RESULTS_FILE = "results.jsonl"  # Stored in BOOKS_DIR, one result line per book
+PAGE_MANIFEST_FILE = "page_manifest.json"  # Stored in PDF_DIR, content hashes of the last built pages
+TRACE_FILE = "trace.json"  # Stored in PDF_DIR (IMAGES_DIR when no PDF is built), spans and counters of the book
+CATALOG_PATH = ".cache/catalog.sqlite3"  # SQLite index of the generated books
+CATALOG_BLOBS_DIR = ".cache/blobs"  # Content-addressed images and PDFs of the catalogued books
+RUNS_DIR = ".cache/runs"  # Checkpoint manifests of the generation runs, one {run_id}.json per run
+QUEUE_PATH = ".cache/queue.sqlite3"  # Stage job queue, on storage shared by every worker host
+METRICS_PATH = ".cache/metrics.prom"  # Process-wide counters in the Prometheus text format, for a local scraper
\ No newline at end of file
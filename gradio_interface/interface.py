@@ -3,19 +3,22 @@
 Gradio Interface for Story Generator
 """
 
+import os
+import time
+import threading
 import gradio as gr
 from config import (
-    TARGET_WORDS, TARGET_AGE, TEXT_MODEL, NB_IMAGES_MAX, IMAGE_MODEL, IMAGE_SIZE
+    TARGET_WORDS, TARGET_AGE, TARGET_WORDS_MIN, TARGET_WORDS_MAX, TARGET_AGE_MIN, TARGET_AGE_MAX, TEXT_MODEL, NB_IMAGES_MAX, IMAGE_MODEL, IMAGE_SIZE, IMAGES_DIR,
+    SESSIONS_DIR, SESSION_MAX_AGE, SESSION_CLEANUP_INTERVAL, GRADIO_CONCURRENCY_LIMIT, GRADIO_QUEUE_MAX_SIZE
 )
 import sys
 sys.path.append('../story_and_image_gen')
-from story_and_image_generator import generate_story_and_images
+from story_and_image_generator import stream_story_and_images
+from checkpoint import cleanup_checkpoints
+from utils import create_workspace, cleanup_workspaces, active_workspace
 
-def generate_story_and_images_gradio(user_prompt, text_model, target_words, target_age, image_model, image_size):
-    """Generate story and images for the Gradio interface."""
-    result = generate_story_and_images(user_prompt, text_model, target_words, target_age, image_model, image_size, output_format="gradio")
-    
-    # Ensure we return the correct number of outputs for the interface
+def fit_outputs(result):
+    """Pad or truncate a result to the outputs of the interface."""
     # The interface expects: 3 story outputs + (NB_IMAGES_MAX+2) * 2 image outputs (title + content + "The End")
     expected_outputs = 3 + (NB_IMAGES_MAX + 2) * 2
     
@@ -28,6 +31,15 @@ def generate_story_and_images_gradio(user_prompt, text_model, target_words, targ
     
     return result
 
+def generate_story_and_images_gradio(user_prompt, text_model, target_words, target_age, image_model, image_size):
+    """Stream the story, then each image as it lands, in a workspace of its own so concurrent users never share files."""
+    workspace = create_workspace(SESSIONS_DIR)
+    images_dir = os.path.join(workspace, IMAGES_DIR)
+    # Kept from the cleanup thread until the request is over, however long the generation takes
+    with active_workspace(workspace):
+        for result in stream_story_and_images(user_prompt, text_model, target_words, target_age, image_model, image_size, images_dir=images_dir):
+            yield fit_outputs(result)
+
 def create_interface():
     """Create and configure the Gradio interface."""
     
@@ -36,8 +48,8 @@ def create_interface():
         inputs=[
             gr.Textbox(label="User Prompt", placeholder="Describe what you would like to see in your story", lines=4),
             gr.Dropdown(label="Text Model", choices=["gpt-4.1", "gpt-4o", "gpt-4o-mini", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo"], value=TEXT_MODEL),
-            gr.Slider(label="Target Words", value=TARGET_WORDS, minimum=50, maximum=1500, step=50),
-            gr.Slider(label="Target Age", value=TARGET_AGE, minimum=3, maximum=8, step=1),
+            gr.Slider(label="Target Words", value=TARGET_WORDS, minimum=TARGET_WORDS_MIN, maximum=TARGET_WORDS_MAX, step=50),
+            gr.Slider(label="Target Age", value=TARGET_AGE, minimum=TARGET_AGE_MIN, maximum=TARGET_AGE_MAX, step=1),
             gr.Dropdown(label="Image Model", choices=["gpt-image-1", "dall-e-3", "dall-e-2"], value=IMAGE_MODEL),
             gr.Dropdown(label="Image Size", choices=["1024x1536", "1024x1024", "1536x1024", "auto"], value=IMAGE_SIZE),
         ],
@@ -55,7 +67,26 @@ def create_interface():
     return demo
 
 
-def launch_interface():
-    """Launch the Gradio interface."""
+def start_workspace_cleanup(root=SESSIONS_DIR, max_age=SESSION_MAX_AGE, interval=SESSION_CLEANUP_INTERVAL):
+    """Start a daemon thread deleting old per-request workspaces, and then the run manifests pointing to them, every interval seconds."""
+    def _cleanup_loop():
+        while True:
+            removed = cleanup_workspaces(root, max_age)
+            if removed:
+                print(f"🧹 Removed {removed} old workspaces from {root}")
+            removed = cleanup_checkpoints(max_age)
+            if removed:
+                print(f"🧹 Removed {removed} expired run checkpoints")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=_cleanup_loop, name="workspace-cleanup", daemon=True)
+    thread.start()
+    return thread
+
+
+def launch_interface(concurrency_limit=GRADIO_CONCURRENCY_LIMIT, max_queue_size=GRADIO_QUEUE_MAX_SIZE):
+    """Launch the Gradio interface with a queue running up to concurrency_limit generations at once."""
+    start_workspace_cleanup()
     interface = create_interface()
+    interface.queue(default_concurrency_limit=concurrency_limit, max_size=max_queue_size)
     interface.launch() 
\ No newline at end of file
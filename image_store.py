@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+In-memory image store shared by the image generator and the storybook formatter
+
+Generated image bytes are kept in memory and served to WeasyPrint through a custom url_fetcher,
+so pages are laid out without reading images back from disk. Writing the files to disk is an
+optional write-behind done by a small pool of background threads.
+"""
+
+import os
+import mimetypes
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+from config import IMAGE_STORE_PERSIST, IMAGE_STORE_WRITERS
+
+MEMORY_URL_PREFIX = "memory:"
+
+# Process-wide write-behind pool shared by every store: bounded, so a long-lived server does not keep threads
+# per book, but with several threads so that concurrent books do not wait on each other's disk writes
+_WRITERS = ThreadPoolExecutor(max_workers=IMAGE_STORE_WRITERS, thread_name_prefix="image-store-writer")
+
+
+def make_url_fetcher(images: Dict[str, bytes]):
+    """
+    Build a WeasyPrint url_fetcher serving memory: URLs from images and every other URL as usual.
+
+    Args:
+        images: memory URL -> image bytes
+
+    Returns:
+        url_fetcher callable for weasyprint.HTML
+    """
+    from weasyprint import default_url_fetcher
+
+    def url_fetcher(url, *args, **kwargs):
+        if url.startswith(MEMORY_URL_PREFIX) and url in images:
+            path = url[len(MEMORY_URL_PREFIX):]
+            return {
+                'string': images[url],
+                'mime_type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                'redirected_url': url
+            }
+        return default_url_fetcher(url, *args, **kwargs)
+
+    return url_fetcher
+
+
+class ImageStore:
+    """Thread-safe in-memory store of image bytes keyed by their output path.
+
+    Args:
+        persist: also write every image to its path on disk, in the background
+    """
+
+    def __init__(self, persist: bool = IMAGE_STORE_PERSIST):
+        self.persist = persist
+        self._images = {}  # memory URL -> bytes
+        self._lock = threading.Lock()
+        self._pending_writes = []
+        self._writes = {}  # path -> Future of its latest write-behind not flushed yet
+
+    @staticmethod
+    def url_for(path: str) -> str:
+        """Return the memory URL of an image path."""
+        return f"{MEMORY_URL_PREFIX}{path}"
+
+    def put(self, path: str, image_bytes: bytes, write: bool = True) -> str:
+        """Store image bytes for path and return its memory URL. write=False skips the disk write-behind."""
+        url = self.url_for(path)
+        with self._lock:
+            self._images[url] = image_bytes
+            if self.persist and write:
+                future = _WRITERS.submit(self._write, path, image_bytes)
+                self._writes[path] = future
+                self._pending_writes.append(future)
+        return url
+
+    @staticmethod
+    def _write(path: str, image_bytes: bytes):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside then renamed, so a crash never leaves a truncated image at path
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, path)
+
+    def on_written(self, path: str, callback: Callable[[], None]):
+        """
+        Call callback() once the image of path is on disk: when its pending write-behind completes, or right
+        away if none is pending. It is not called if the write fails, and flush() also waits for it.
+
+        Raises:
+            ValueError: If the store does not persist its images, which then never reach the disk.
+        """
+        if not self.persist:
+            raise ValueError("images of a store created with persist=False are never written to disk")
+        called = Future()
+
+        def run(write):
+            try:
+                if write is None or write.exception() is None:
+                    callback()
+                called.set_result(None)
+            except Exception as e:
+                called.set_exception(e)
+
+        with self._lock:
+            write = self._writes.get(path)
+            self._pending_writes.append(called)
+        if write is None:
+            run(None)
+        else:
+            write.add_done_callback(run)
+
+    def get(self, path: str) -> Optional[bytes]:
+        """Return the bytes stored for an image path, or None."""
+        with self._lock:
+            return self._images.get(self.url_for(path))
+
+    def __contains__(self, path: str) -> bool:
+        with self._lock:
+            return self.url_for(path) in self._images
+
+    def src_for(self, path: str) -> str:
+        """Return the URL a template should use for an image: its memory URL when stored, its path otherwise."""
+        return self.url_for(path) if path in self else path
+
+    def subset(self, paths: Iterable[str]) -> Dict[str, bytes]:
+        """Return memory URL -> bytes for the given paths, to ship images to a render worker process."""
+        with self._lock:
+            return {
+                self.url_for(path): self._images[self.url_for(path)]
+                for path in paths if path and self.url_for(path) in self._images
+            }
+
+    def url_fetcher(self, url, *args, **kwargs):
+        """WeasyPrint url_fetcher serving stored images from memory."""
+        with self._lock:
+            image_bytes = self._images.get(url)
+        images = {url: image_bytes} if image_bytes is not None else {}
+        return make_url_fetcher(images)(url, *args, **kwargs)
+
+    def flush(self):
+        """Wait until every pending write-behind has reached the disk, and its on_written callbacks have run."""
+        with self._lock:
+            pending, self._pending_writes = self._pending_writes, []
+        for future in pending:
+            future.result()
+        with self._lock:
+            self._writes = {path: future for path, future in self._writes.items() if not future.done()}
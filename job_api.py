@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Job API - Headless HTTP API to generate storybooks without the Gradio interface
+
+A book is submitted as a job and generated in the background by the storybook pipeline, at most
+JOB_API_MAX_CONCURRENT_BOOKS at a time, each in its own workspace under JOB_API_DIR. Clients poll the
+job status or stream its progress events, then download the PDF. Only the standard library is used.
+
+Endpoints:
+    POST /books                  {"prompt": ..., "target_age": 5, ...} -> 202 {"job_id": ..., ...}
+    GET  /books/<job_id>         status and progress of the job
+    GET  /books/<job_id>/events  progress events as Server-Sent Events, until the job is finished
+    GET  /books/<job_id>/pdf     storybook PDF, once the job is finished
+    GET  /health                 number of running and queued jobs
+
+Usage:
+    python cli.py api [--port 8000] [--max-books 4]
+    curl -X POST localhost:8000/books -d '{"prompt": "a golden retriever that wanted to eat the biggest steak in the world"}'
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from utils import create_workspace
+from config import (
+    TEXT_MODEL, TARGET_WORDS, TARGET_AGE, TARGET_WORDS_MIN, TARGET_WORDS_MAX, TARGET_AGE_MIN, TARGET_AGE_MAX, IMAGE_MODEL, IMAGE_SIZE, FORMAT_OPTIONS, PDF_RENDER_WORKERS, STORY_PLANNING_MODE,
+    JOB_API_HOST, JOB_API_PORT, JOB_API_MAX_CONCURRENT_BOOKS, JOB_API_MAX_QUEUED_BOOKS, JOB_API_MAX_BODY_BYTES, JOB_API_JOB_MAX_AGE,
+    JOB_API_DIR, SESSION_CLEANUP_INTERVAL
+)
+
+FINISHED_STATUSES = {"ok", "partial", "error"}
+PLANNING_MODES = {"two_call", "single_call"}
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when a job is submitted while JOB_API_MAX_QUEUED_BOOKS jobs are already waiting."""
+
+
+def parse_book_request(payload) -> Dict:
+    """
+    Validate a submitted book request and fill in the defaults.
+
+    Raises:
+        ValueError: If the request is not a JSON object with a prompt, or a field has the wrong type or is out of range.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("The request body must be a JSON object")
+    user_prompt = payload.get('prompt') or payload.get('user_prompt')
+    if not isinstance(user_prompt, str) or not user_prompt.strip():
+        raise ValueError("Missing 'prompt'")
+    request = {'user_prompt': user_prompt.strip()}
+    for field, default in (('text_model', TEXT_MODEL), ('image_model', IMAGE_MODEL), ('image_size', IMAGE_SIZE), ('planning_mode', STORY_PLANNING_MODE)):
+        value = payload.get(field, default)
+        if not isinstance(value, str):
+            raise ValueError(f"'{field}' must be a string")
+        request[field] = value
+    # Bounded like the interface sliders: the story length drives the number of paid image calls
+    for field, default, minimum, maximum in (('target_words', TARGET_WORDS, TARGET_WORDS_MIN, TARGET_WORDS_MAX), ('target_age', TARGET_AGE, TARGET_AGE_MIN, TARGET_AGE_MAX)):
+        value = payload.get(field, default)
+        if isinstance(value, bool) or not isinstance(value, int) or not minimum <= value <= maximum:
+            raise ValueError(f"'{field}' must be an integer from {minimum} to {maximum}")
+        request[field] = value
+    if request['planning_mode'] not in PLANNING_MODES:
+        raise ValueError(f"'planning_mode' must be one of {sorted(PLANNING_MODES)}")
+    return request
+
+
+class BookJob:
+    """State and progress events of one submitted book.
+
+    Args:
+        job_id: identifier of the job, also the name of its workspace
+        request: validated book request (see parse_book_request)
+        output_dir: workspace of the book
+    """
+
+    def __init__(self, job_id: str, request: Dict, output_dir: str):
+        self.job_id = job_id
+        self.request = request
+        self.output_dir = output_dir
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.title = None
+        self.image_numbers = []
+        self.images_done = set()
+        self.failed_images = {}
+        self.failed_pages = []
+        self.pdf = None
+        self.book_id = None
+        self.error = None
+        self.events = []  # (event, data), in order
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def emit(self, event: str, data: Dict):
+        """Record a progress event, updating the job state, and wake up the event streams."""
+        with self._changed:
+            if event == "started":
+                self.status, self.started_at = "running", time.time()
+            elif event == "plan":
+                self.title, self.image_numbers = data['title'], data['image_numbers']
+            elif event == "image":
+                self.images_done.add(data['image_number'])
+            elif event == "image_failed":
+                self.failed_images[data['image_number']] = data['error']
+            elif event == "pdf":
+                self.pdf, self.failed_pages = data['pdf'], data['failed_pages']
+            elif event in FINISHED_STATUSES:
+                self.status, self.finished_at = event, time.time()
+                self.book_id, self.error = data.get('book_id'), data.get('error')
+            self.events.append((event, data))
+            self._changed.notify_all()
+
+    def wait_events(self, start: int, timeout: float) -> Tuple[List[Tuple[str, Dict]], bool]:
+        """Return (the events after the first start ones, True if the job is finished), waiting up to timeout seconds for one."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > start or self.finished, timeout)
+            return self.events[start:], self.finished
+
+    def to_dict(self) -> Dict:
+        with self._changed:
+            return {
+                'job_id': self.job_id,
+                'status': self.status,
+                'request': self.request,
+                'title': self.title,
+                'progress': {
+                    'images_total': len(self.image_numbers),
+                    'images_done': len(self.images_done),
+                    'images_failed': len(self.failed_images),
+                },
+                'failed_images': {str(image_number): error for image_number, error in sorted(self.failed_images.items())},
+                'failed_pages': self.failed_pages,
+                'pdf_url': f"/books/{self.job_id}/pdf" if self.finished and self.pdf else None,
+                'book_id': self.book_id,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+
+
+class BookJobs:
+    """Runs submitted books in the background, max_books at a time, and keeps their state for max_age seconds.
+
+    Args:
+        max_books: books generated at the same time
+        max_queued: jobs waiting for a slot before submissions are rejected
+        jobs_dir: root of the per-job workspaces
+        max_age: finished jobs older than this (in seconds) are deleted with their workspace
+    """
+
+    def __init__(self, max_books: int = JOB_API_MAX_CONCURRENT_BOOKS, max_queued: int = JOB_API_MAX_QUEUED_BOOKS, jobs_dir: str = JOB_API_DIR, max_age: float = JOB_API_JOB_MAX_AGE):
+        self.max_books = max(1, max_books)
+        self.max_queued = max_queued
+        self.jobs_dir = jobs_dir
+        self.max_age = max_age
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_books, thread_name_prefix="book-job")
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return {status: sum(1 for job in jobs if job.status == status) for status in ("queued", "running")}
+
+    def submit(self, payload) -> BookJob:
+        """
+        Validate a book request and queue it.
+
+        Raises:
+            ValueError: If the request is invalid.
+            JobQueueFull: If max_queued jobs are already waiting.
+        """
+        request = parse_book_request(payload)
+        # Checked and added under one lock, so concurrent submissions cannot go past max_queued
+        with self._lock:
+            if sum(1 for job in self.jobs.values() if job.status == "queued") >= self.max_queued:
+                raise JobQueueFull(f"{self.max_queued} books are already waiting, retry later")
+            output_dir = create_workspace(self.jobs_dir)
+            job = BookJob(os.path.basename(output_dir), request, output_dir)
+            self.jobs[job.job_id] = job
+        self._executor.submit(self._run, job)
+        print(f"📥 Job {job.job_id} queued: {request['user_prompt']}")
+        return job
+
+    def get(self, job_id: str) -> Optional[BookJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job: BookJob):
+        from pipeline import run_storybook_pipeline
+
+        job.emit("started", {})
+        request = job.request
+        try:
+            story_dict, formatter = run_storybook_pipeline(
+                request['user_prompt'], request['text_model'], request['target_words'], request['target_age'],
+                request['image_model'], request['image_size'], format_options=FORMAT_OPTIONS, render_workers=PDF_RENDER_WORKERS,
+                output_dir=job.output_dir, planning_mode=request['planning_mode'], on_progress=job.emit
+            )
+        except Exception as e:
+            print(f"Error: job {job.job_id} failed: {e}")
+            job.emit("error", {'error': str(e)})
+            return
+        status = "partial" if formatter.failed_pages or story_dict.get('failed_images') else "ok"
+        job.emit(status, {'book_id': story_dict.get('book_id')})
+        print(f"📘 Job {job.job_id}: {status}")
+
+    def cleanup(self) -> int:
+        """Delete the finished jobs older than max_age and their workspaces, and return how many were deleted."""
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            expired = [job for job in self.jobs.values() if job.finished and job.finished_at < cutoff]
+            for job in expired:
+                del self.jobs[job.job_id]
+        for job in expired:
+            shutil.rmtree(job.output_dir, ignore_errors=True)
+        with self._lock:
+            active = {job.job_id for job in self.jobs.values()}
+        # Workspaces left over by a previous process, unknown to this one
+        for name in os.listdir(self.jobs_dir) if os.path.exists(self.jobs_dir) else []:
+            if name not in active:
+                path = os.path.join(self.jobs_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        shutil.rmtree(path, ignore_errors=True)
+                except OSError:
+                    continue  # Removed concurrently
+        return len(expired)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JobAPIServer:
+    """Threaded HTTP server of the job API.
+
+    Args:
+        jobs: BookJobs running the submitted books
+        host: interface to listen on
+        port: port to listen on, 0 for any free port
+        cleanup_interval: seconds between two cleanups of the old jobs
+    """
+
+    def __init__(self, jobs: Optional[BookJobs] = None, host: str = JOB_API_HOST, port: int = JOB_API_PORT, cleanup_interval: float = SESSION_CLEANUP_INTERVAL):
+        self.jobs = jobs or BookJobs()
+        self.host = host
+        self.port = port
+        self.cleanup_interval = cleanup_interval
+        self._httpd = None
+        self._stop = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """Start serving in background threads and return the URL of the API."""
+        handler = type("JobAPIHandler", (_JobAPIHandler,), {"jobs": self.jobs})
+        self._httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        threading.Thread(target=self._httpd.serve_forever, name="job-api-server", daemon=True).start()
+        threading.Thread(target=self._cleanup_loop, name="job-api-cleanup", daemon=True).start()
+        return self.url
+
+    def _cleanup_loop(self):
+        while not self._stop.wait(self.cleanup_interval):
+            removed = self.jobs.cleanup()
+            if removed:
+                print(f"🧹 Removed {removed} old jobs from {self.jobs.jobs_dir}")
+
+    def stop(self):
+        self._stop.set()
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+        self.jobs.shutdown()
+
+    def serve_forever(self):
+        """Serve until interrupted."""
+        print(f"🌐 Job API listening on {self.start()}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+class _JobAPIHandler(BaseHTTPRequestHandler):
+    jobs = None  # BookJobs, set on the subclass built by JobAPIServer.start
+    protocol_version = "HTTP/1.1"
+    event_keepalive = 15  # Seconds between two comments keeping an idle event stream open
+    max_body_bytes = JOB_API_MAX_BODY_BYTES
+
+    JOB_PATH = re.compile(r"^/books/([A-Za-z0-9_.-]+)(/events|/pdf)?$")
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= self.max_body_bytes:
+            # The body is left unread, so the connection cannot be reused
+            self.close_connection = True
+            if length < 0:
+                self._send_json(400, {"error": "Invalid Content-Length header"}, headers={"Connection": "close"})
+            else:
+                self._send_json(413, {"error": f"Request body larger than {self.max_body_bytes} bytes"}, headers={"Connection": "close"})
+            return
+        body = self.rfile.read(length)
+        if self.path.split("?")[0].rstrip("/") != "/books":
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        try:
+            job = self.jobs.submit(json.loads(body or b"{}"))
+        except ValueError as e:
+            self._send_json(400, {"error": str(e) if not isinstance(e, json.JSONDecodeError) else "Invalid JSON body"})
+            return
+        except JobQueueFull as e:
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": "30"})
+            return
+        self._send_json(202, {
+            'job_id': job.job_id, 'status': job.status, 'status_url': f"/books/{job.job_id}",
+            'events_url': f"/books/{job.job_id}/events", 'pdf_url': f"/books/{job.job_id}/pdf"
+        }, headers={"Location": f"/books/{job.job_id}"})
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/health":
+            self._send_json(200, {'status': 'ok', **self.jobs.counts()})
+            return
+        match = self.JOB_PATH.match(path)
+        job = self.jobs.get(match.group(1)) if match else None
+        if job is None:
+            self._send_json(404, {"error": f"Unknown job or endpoint {self.path}"})
+        elif match.group(2) == "/events":
+            self._stream_events(job)
+        elif match.group(2) == "/pdf":
+            self._send_pdf(job)
+        else:
+            self._send_json(200, job.to_dict())
+
+    def _send_pdf(self, job: BookJob):
+        if not job.finished:
+            self._send_json(409, {"error": f"Job {job.job_id} is {job.status}, the PDF is not ready"})
+            return
+        if not job.pdf or not os.path.exists(job.pdf):
+            self._send_json(404, {"error": f"Job {job.job_id} has no PDF" + (f": {job.error}" if job.error else "")})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(os.path.getsize(job.pdf)))
+        self.send_header("Content-Disposition", f'attachment; filename="storybook_{job.job_id}.pdf"')
+        self.end_headers()
+        with open(job.pdf, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def _stream_events(self, job: BookJob):
+        # Events are numbered from 0, a reconnecting client resumes after Last-Event-ID
+        try:
+            next_event = int(self.headers.get("Last-Event-ID", -1)) + 1
+        except ValueError:
+            next_event = 0
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                events, finished = job.wait_events(next_event, self.event_keepalive)
+                for event, data in events:
+                    self.wfile.write(f"id: {next_event}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                    next_event += 1
+                if finished and not events:
+                    return
+                if not events:
+                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return  # Client went away, the job keeps running
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Job progress is printed by BookJobs
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Job Queue - Durable local work queue backed by SQLite
+
+Jobs are rows of a SQLite database, so they survive restarts and can be shared by worker processes
+(or hosts sharing the file on a filesystem with working locks, with the default rollback journal). A worker claims a job with a lease
+that it renews while working, and a job whose lease expired (its worker died) is claimed again.
+Finishing a job and enqueuing its follow-up jobs happen in the same transaction, so no step is lost
+or done twice when a worker crashes between them.
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from config import QUEUE_PATH, QUEUE_LEASE_SECONDS, QUEUE_JOURNAL_MODE
+
+
+def worker_id(name: str = "worker") -> str:
+    """Return an identifier unique to this host, process and thread."""
+    return f"{name}@{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+class JobQueue:
+    """Durable multi-stage job queue stored in a SQLite database.
+
+    Args:
+        path: path of the SQLite database file, shared by every worker
+        journal_mode: SQLite journal mode, "DELETE" for a database on shared storage or "WAL" for workers on one host
+    """
+
+    def __init__(self, path: str = QUEUE_PATH, journal_mode: str = QUEUE_JOURNAL_MODE):
+        self.path = path
+        self.journal_mode = journal_mode
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id INTEGER PRIMARY KEY AUTOINCREMENT, stage TEXT NOT NULL, book_id TEXT, payload TEXT NOT NULL, "
+                "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, lease_until REAL, "
+                "available_at REAL NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_stage_status ON jobs (stage, status, available_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_book ON jobs (book_id, stage, status)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers run beside the worker claiming a job, but its shared memory index only works on one host
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        return conn
+
+    @contextmanager
+    def read(self):
+        """Yield a connection for reads outside of a write transaction, closed on exit."""
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Yield a connection in a write transaction, committed on exit and rolled back on error."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def enqueue_in(conn, stage: str, payload: Dict, book_id: Optional[str] = None, delay: float = 0) -> int:
+        """Enqueue a job within the transaction of conn and return its job_id."""
+        now = time.time()
+        cursor = conn.execute(
+            "INSERT INTO jobs (stage, book_id, payload, status, available_at, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (stage, book_id, json.dumps(payload), now + delay, now, now)
+        )
+        return cursor.lastrowid
+
+    def enqueue(self, stage: str, payload: Dict, book_id: Optional[str] = None, delay: float = 0) -> int:
+        """Enqueue a job for the workers of stage and return its job_id."""
+        with self.transaction() as conn:
+            return self.enqueue_in(conn, stage, payload, book_id, delay)
+
+    def claim(self, stage: str, worker: str, lease: float = QUEUE_LEASE_SECONDS) -> Optional[Dict]:
+        """
+        Claim the oldest available job of stage: a queued job, or a running job whose lease expired.
+
+        Returns:
+            The job ({job_id, stage, book_id, payload, attempts...}, attempts counting this one), or None if there is none
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE stage = ? AND ((status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until < ?)) "
+                "ORDER BY available_at, job_id LIMIT 1",
+                (stage, now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                (worker, now + lease, now, row['job_id'])
+            )
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['attempts'] += 1
+        return job
+
+    def extend_lease(self, job_id: int, worker: str, lease: float = QUEUE_LEASE_SECONDS) -> bool:
+        """Renew the lease of a running job, False if the worker lost it."""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (time.time() + lease, time.time(), job_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def heartbeat(self, job_id: int, worker: str, lease: float = QUEUE_LEASE_SECONDS):
+        """Keep renewing the lease of a job while the enclosed block runs."""
+        stop = threading.Event()
+
+        def _renew():
+            while not stop.wait(lease / 3):
+                try:
+                    self.extend_lease(job_id, worker, lease)
+                except sqlite3.Error as e:
+                    print(f"Warning: could not renew the lease of job {job_id}: {e}")
+
+        thread = threading.Thread(target=_renew, name=f"lease-{job_id}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+
+    def finish(self, job_id: int, worker: str, status: str = "done", error: Optional[str] = None, follow_up: Optional[Callable] = None) -> bool:
+        """
+        Mark a job done or failed and run follow_up(conn) in the same transaction, e.g. to enqueue the next stage.
+
+        Returns:
+            False (and nothing is written) if the worker lost the job's lease to another worker
+        """
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (status, error, time.time(), job_id, worker)
+            )
+            if cursor.rowcount != 1:
+                return False
+            if follow_up is not None:
+                follow_up(conn)
+        return True
+
+    def retry(self, job_id: int, worker: str, error: str, delay: float) -> bool:
+        """Put a job back in the queue, available again after delay seconds."""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, worker = NULL, lease_until = NULL, available_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (error, time.time() + delay, time.time(), job_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return stage -> status -> number of jobs."""
+        with self.read() as conn:
+            rows = conn.execute("SELECT stage, status, COUNT(*) AS count FROM jobs GROUP BY stage, status").fetchall()
+        stats = {}
+        for row in rows:
+            stats.setdefault(row['stage'], {})[row['status']] = row['count']
+        return stats
+
+    def book_jobs(self, book_id: str, stage: Optional[str] = None) -> List[Dict]:
+        """Return the jobs of a book, of one stage or all of them."""
+        with self.read() as conn:
+            query = "SELECT * FROM jobs WHERE book_id = ?" + (" AND stage = ?" if stage else "") + " ORDER BY job_id"
+            rows = conn.execute(query, (book_id, stage) if stage else (book_id,)).fetchall()
+        jobs = [dict(row) for row in rows]
+        for job in jobs:
+            job['payload'] = json.loads(job['payload'])
+        return jobs
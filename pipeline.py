@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Storybook Pipeline - Overlaps image generation with page rendering
+
+The story text and page split are known as soon as the image prompts are ready, so each page's
+HTML/PDF render is started the moment its image lands, and only the final merge waits for all of them.
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+# Add package directories to path to access the generation and formatting modules
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, 'story_and_image_gen'))
+sys.path.append(os.path.join(current_dir, 'book_format'))
+
+from openai import OpenAIError
+from story_and_image_generator import generate_story_and_image_prompts, generate_images, print_image_cache_stats
+from formatting import StorybookFormatter, get_render_pool
+from image_store import ImageStore
+from catalog import get_book_catalog
+from checkpoint import RunCheckpoint
+from tracing import Trace, span, add_counter, finish_trace
+import image_processing
+from utils import create_success_output_dictionnary, workspace_dirs
+from config import FORMAT_OPTIONS, PDF_RENDER_WORKERS, IMAGE_OPTIMIZATION_ENABLED, IMAGE_STORE_ENABLED, IMAGE_STORE_PERSIST, TRACING_ENABLED, TRACE_FILE, STORY_PLANNING_MODE, CATALOG_ENABLED, CHECKPOINTS_ENABLED
+
+
+def run_storybook_pipeline(user_prompt, text_model, target_words, target_age, image_model, image_size, format_options=FORMAT_OPTIONS, render_workers=PDF_RENDER_WORKERS, output_dir=None, planning_mode=STORY_PLANNING_MODE, on_progress=None, run_id=None):
+    """
+    Generate the story, its images and the storybook PDF, rendering pages while images are still coming in.
+
+    Unlike generate_storybook, errors are raised to the caller. When tracing is enabled, the spans and
+    counters of the book are saved to TRACE_FILE in the PDF directory, whether it succeeds or fails.
+    When checkpoints are enabled, the run is checkpointed like generate_story_and_images, and a failed
+    run is finished with resume_storybook(run_id).
+
+        Args:
+            user_prompt (str): The user's story prompt
+            text_model (str): OpenAI model for text generation
+            target_words (int): Target words for the story
+            target_age (int): Target age group
+            image_model (str): OpenAI model for image generation
+            image_size (str): Size of generated images
+            format_options (dict): Storybook formatting options
+            render_workers (int): 1 renders the pages in this process, otherwise they go to the render pool shared by every book
+            output_dir (str): Root of an isolated book workspace, None for the global images/html/pdf directories
+            planning_mode (str): "two_call" or "single_call" (story and image prompts in one text call)
+            on_progress (callable): Optional callback(event, data) called from the worker threads with
+                "plan" ({title, nb_images, image_numbers}), "image" ({image_number}), "image_failed"
+                ({image_number, error}) and "pdf" ({pdf, failed_pages}) as the book progresses
+            run_id (str): Id of the run checkpoint, a new one by default
+
+    Returns:
+        tuple: (story dictionnary with the image paths, StorybookFormatter used to render it)
+    """
+    # output_dir marks the checkpoint as a storybook run, resumed up to the PDF by resume_storybook
+    request = {
+        'user_prompt': user_prompt, 'text_model': text_model, 'target_words': target_words, 'target_age': target_age,
+        'image_model': image_model, 'image_size': image_size, 'planning_mode': planning_mode, 'output_dir': output_dir
+    }
+    checkpoint = None
+    if CHECKPOINTS_ENABLED and not _images_reach_disk():
+        print("⚠️ Run not checkpointed: IMAGE_STORE_PERSIST is off, so its images are never written to disk to resume from")
+    elif CHECKPOINTS_ENABLED:
+        # Stored absolute, so that the run resumes into the same workspace from any working directory
+        request['output_dir'] = os.path.abspath(output_dir if output_dir is not None else os.curdir)
+        checkpoint = RunCheckpoint.create(request, workspace_dirs(request['output_dir'])[0], run_id)
+        print(f"📌 Run {checkpoint.run_id} (resume it with python cli.py resume {checkpoint.run_id} if it fails)")
+    return _run_checkpointed_pipeline(request, format_options, render_workers, checkpoint, on_progress=on_progress)
+
+
+def resume_storybook(run_id, format_options=FORMAT_OPTIONS, render_workers=PDF_RENDER_WORKERS, on_progress=None):
+    """
+    Finish a checkpointed storybook run: the checkpointed story and image prompts are reused, only the
+    images that failed or are missing are generated again, and the storybook PDF is rendered.
+
+        Args:
+            run_id (str): Id of the run, printed when it started
+            format_options (dict): Storybook formatting options
+            render_workers (int): 1 renders the pages in this process, otherwise they go to the render pool shared by every book
+            on_progress (callable): Optional callback(event, data), as for run_storybook_pipeline
+
+    Returns:
+        tuple: (story dictionnary with the image paths, StorybookFormatter used to render it)
+
+    Raises:
+        ValueError: If there is no checkpoint for run_id, or images are not written to disk (IMAGE_STORE_PERSIST off).
+    """
+    if not _images_reach_disk():
+        raise ValueError("Runs cannot be resumed with IMAGE_STORE_PERSIST off: their images are never written to disk")
+    checkpoint = RunCheckpoint.load(run_id)
+    checkpoint.start_attempt()
+    print(f"📌 Resuming run {run_id} ({len(checkpoint.pending_image_prompts()) if checkpoint.has_plan else 'all'} images to generate)")
+    return _run_checkpointed_pipeline(checkpoint.request, format_options, render_workers, checkpoint, resumed=True, on_progress=on_progress)
+
+
+def _images_reach_disk():
+    """Whether the generated images are written to disk, which checkpoints need to resume from them."""
+    return not IMAGE_STORE_ENABLED or IMAGE_STORE_PERSIST
+
+
+def _run_checkpointed_pipeline(request, format_options, render_workers, checkpoint, resumed=False, on_progress=None):
+    """Trace and run _run_storybook_pipeline for request, recording its outcome in checkpoint (if any)."""
+    images_dir, html_dir, pdf_dir = workspace_dirs(request['output_dir'])
+    if checkpoint is not None:
+        images_dir = checkpoint.images_dir  # Absolute path recorded when the run started, and in its image paths
+    trace = Trace(
+        "storybook", user_prompt=request['user_prompt'], text_model=request['text_model'], image_model=request['image_model'], image_size=request['image_size'],
+        target_words=request['target_words'], target_age=request['target_age'], output_dir=request['output_dir'], planning_mode=request['planning_mode'],
+        run_id=checkpoint.run_id if checkpoint else None, resumed=resumed
+    ) if TRACING_ENABLED else None
+    try:
+        story_dict, formatter = _run_storybook_pipeline(
+            request['user_prompt'], request['text_model'], request['target_words'], request['target_age'], request['image_model'], request['image_size'],
+            format_options, render_workers, images_dir, html_dir, pdf_dir, trace, request['planning_mode'], on_progress, checkpoint, resumed
+        )
+    except Exception as e:
+        finish_trace(trace, f"{pdf_dir}/{TRACE_FILE}", error=e)
+        if checkpoint is not None:
+            checkpoint.finish("failed", error=e)
+        raise
+    finish_trace(trace, f"{pdf_dir}/{TRACE_FILE}")
+    if checkpoint is not None:
+        checkpoint.finish("partial" if story_dict.get('failed_images') else "complete")
+    return story_dict, formatter
+
+
+def _run_storybook_pipeline(user_prompt, text_model, target_words, target_age, image_model, image_size, format_options, render_workers, images_dir, html_dir, pdf_dir, trace, planning_mode, on_progress=None, checkpoint=None, resumed=False):
+    """Body of run_storybook_pipeline, recording its spans and counters in trace and its progress in checkpoint (if any)."""
+    on_progress = on_progress or (lambda event, data: None)
+
+    # Images are handed to the renderer in memory, the files on disk are a write-behind
+    image_store = ImageStore() if IMAGE_STORE_ENABLED else None
+
+    story, nb_images, image_generator, image_prompts = generate_story_and_image_prompts(
+        user_prompt, text_model, target_words, target_age, image_model, image_size, images_dir, image_store, trace, planning_mode, checkpoint
+    )
+    image_prompts_list = [prompt_data.get('prompt', '') for prompt_data in image_prompts.get('image_prompts', [])]
+    story_dict = create_success_output_dictionnary(story, nb_images, image_prompts_list, images_dir)
+    on_progress("plan", {
+        'title': story.get('title'), 'nb_images': nb_images,
+        'image_numbers': [prompt_data.get('image_number', 1) - 1 for prompt_data in image_prompts.get('image_prompts', [])]
+    })
+
+    # The page split only depends on the text, so it is ready before any image
+    formatter = StorybookFormatter(story_dict, format_options, render_mode="per_page", render_workers=render_workers, html_dir=html_dir, pdf_dir=pdf_dir, image_store=image_store, trace=trace)
+    story_pages = formatter.break_story_into_pages()
+
+    for directory in (html_dir, pdf_dir):
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+
+    render_futures = {}
+    render_lock = threading.Lock()
+    optimize_images = IMAGE_OPTIMIZATION_ENABLED and image_processing.Image is not None
+    box_size = image_processing.target_size(format_options)
+
+    # Pages go to the process-wide render pool, shared with the other books and kept warm between them
+    # (one render thread in this process when render_workers is 1)
+    local_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-render") if render_workers == 1 else None
+    with local_executor or nullcontext(get_render_pool()) as render_executor:
+
+        def start_page_render(page_number):
+            try:
+                formatter.write_page_html(page_number, story_pages[page_number])
+                with render_lock:
+                    render_futures[page_number] = formatter.submit_page_pdf(render_executor, page_number)
+            except Exception as e:
+                formatter.failed_pages[page_number] = str(e)
+
+        def on_image_ready(image_number, image_bytes):
+            if checkpoint is not None:
+                # Only checkpointed once the file is on disk, so a resume never reads a missing or partial image
+                image_path = f"{images_dir}/output_{image_number}.png"
+                record = lambda: checkpoint.image_done(image_number, image_path)
+                if image_store is not None:
+                    image_store.on_written(image_path, record)
+                else:
+                    record()
+            on_progress("image", {'image_number': image_number})
+            # Image n illustrates page n (title page is 0, "The End" page is nb_pages+1)
+            if image_number not in story_pages:
+                return
+            if optimize_images:
+                # Downscale and recompress to print resolution before the page is laid out
+                try:
+                    image_path = story_pages[image_number]['image']
+                    with span(trace, "image_optimization", image_number=image_number) as attributes:
+                        if image_store is not None:
+                            optimized_path = image_processing.optimized_path(image_path)
+                            optimized_bytes = image_processing.optimize_image_bytes(image_bytes, box_size)
+                            image_store.put(optimized_path, optimized_bytes)
+                            bytes_after = len(optimized_bytes)
+                        else:
+                            optimized_path, _, bytes_after = image_processing.optimize_image(image_path, box_size)
+                        attributes.update(bytes_before=len(image_bytes), bytes_after=bytes_after)
+                    add_counter(trace, "image.optimized_bytes_before", len(image_bytes))
+                    add_counter(trace, "image.optimized_bytes_after", bytes_after)
+                    story_pages[image_number]['image'] = optimized_path
+                    story_dict['images'][image_number] = optimized_path
+                except Exception as e:
+                    print(f"Error optimizing image {image_number}: {e}")
+            start_page_render(image_number)
+
+        # A resumed run renders the pages of its checkpointed images from disk and only generates the missing ones
+        pending_prompts = checkpoint.pending_image_prompts() if resumed else image_prompts.get('image_prompts', [])
+        for image_number, checkpointed_path in sorted(checkpoint.done_images().items()) if resumed else []:
+            with open(checkpointed_path, "rb") as f:
+                image_bytes = f.read()
+            if image_store is not None:
+                image_store.put(f"{images_dir}/output_{image_number}.png", image_bytes, write=False)  # Already on disk
+            on_image_ready(image_number, image_bytes)
+
+        try:
+            images = generate_images(image_generator, pending_prompts, on_image_ready=on_image_ready, clear=not resumed)
+        finally:
+            if checkpoint is not None:
+                for image_number, error in image_generator.failed_images.items():
+                    checkpoint.image_failed(image_number, error)
+        print(f"✅ {len(images)} images generated" + (f", {len(image_generator.failed_images)} failed" if image_generator.failed_images else ""))
+        print_image_cache_stats()
+        if image_generator.failed_images:
+            story_dict['failed_images'] = {str(image_number): error for image_number, error in sorted(image_generator.failed_images.items())}
+            for image_number, error in sorted(image_generator.failed_images.items()):
+                on_progress("image_failed", {'image_number': image_number, 'error': error})
+
+        # Pages without an image (no prompt, or failed after its retries) are still rendered, with the no-image fallback
+        for page_number in sorted(story_pages.keys()):
+            if page_number not in render_futures and page_number not in formatter.failed_pages:
+                start_page_render(page_number)
+
+        for page_number, future in sorted(render_futures.items()):
+            try:
+                future.result()
+            except Exception as e:
+                formatter.failed_pages[page_number] = str(e)
+
+    for page_number, error in sorted(formatter.failed_pages.items()):
+        print(f"Error creating PDF for page {page_number}: {error}")
+
+    # Merge individual PDFs into a single storybook
+    formatter.merge_pdfs()
+    if image_store is not None:
+        with span(trace, "image_store_flush"):
+            image_store.flush()
+    formatter.save_manifest({
+        page_number: page_hash for page_number, page_hash in formatter.compute_page_hashes(story_pages).items()
+        if page_number not in formatter.failed_pages
+    })
+    print(f"✅ Storybook PDF generated")
+    on_progress("pdf", {'pdf': f"{pdf_dir}/storybook.pdf", 'failed_pages': sorted(formatter.failed_pages)})
+
+    if CATALOG_ENABLED:
+        try:
+            with span(trace, "catalog"):
+                book_id = get_book_catalog().add_book(
+                    story_dict, {
+                        'user_prompt': user_prompt, 'text_model': text_model, 'image_model': image_model, 'image_size': image_size,
+                        'target_words': target_words, 'target_age': target_age
+                    },
+                    pdf_path=f"{pdf_dir}/storybook.pdf", image_prompts=image_prompts_list, trace=trace, image_store=image_store
+                )
+            story_dict['book_id'] = book_id
+            print(f"🗃️ Storybook catalogued as {book_id}")
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: could not add the storybook to the catalog: {e}")
+
+    return story_dict, formatter
+
+
+def generate_storybook(user_prompt, text_model, target_words, target_age, image_model, image_size, format_options=FORMAT_OPTIONS, render_workers=PDF_RENDER_WORKERS, output_dir=None, planning_mode=STORY_PLANNING_MODE):
+    """
+    Generate the story, its images and the storybook PDF, rendering pages while images are still coming in.
+
+        Args:
+            user_prompt (str): The user's story prompt
+            text_model (str): OpenAI model for text generation
+            target_words (int): Target words for the story
+            target_age (int): Target age group
+            image_model (str): OpenAI model for image generation
+            image_size (str): Size of generated images
+            format_options (dict): Storybook formatting options
+            render_workers (int): 1 renders the pages in this process, otherwise they go to the render pool shared by every book
+            output_dir (str): Root of an isolated book workspace, None for the global images/html/pdf directories
+            planning_mode (str): "two_call" or "single_call" (story and image prompts in one text call)
+
+    Returns:
+        dict: story dictionnary with the image paths, or None if generation failed
+    """
+    try:
+        print(f"📚 Generating storybook for user prompt: {user_prompt}...")
+        story_dict, _ = run_storybook_pipeline(
+            user_prompt, text_model, target_words, target_age, image_model, image_size,
+            format_options=format_options, render_workers=render_workers, output_dir=output_dir, planning_mode=planning_mode
+        )
+        return story_dict
+
+    except (ValueError, OpenAIError) as e:
+        print(f"Error: {e}")
+        return None
+
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return None
@@ -4,6 +4,35 @@ Simple prompt storage for Story Generator
 """
 
 
+# Stand-in story and image breakdown templates, used only when the story_prompts module shipped with
+# a deployment is not installed (e.g. the mock OpenAI benchmark and the tests)
+
+# Base prompt of the story generation, filled with the target age and length
+STORY_BASE_PROMPT = """
+You are an author of children's books. Write an original story for {target_age} year old children, about {target_words} words long.
+Use simple words and short sentences a child of that age can follow, give the story a clear beginning, middle and happy ending, and keep it kind and free of anything frightening.
+Split the story into short paragraphs, and give it a short, catchy title and a one or two sentence summary.
+"""
+
+# The user's idea for the story, appended to the base prompt
+USER_PROMPT_TEMPLATE = """
+The story is about: {user_prompt}
+"""
+
+# Breaks a written story down into the prompts of its illustrations
+IMAGE_PROMPT_BREAKDOWN = """
+The children's story below will be split into {nb_images} pages. Write {total_images} image prompts for its illustrations:
+- Image 1 illustrates the title page
+- Images 2 to {last_page_image} illustrate the story pages, in reading order
+- Image {total_images} illustrates "The End" page
+Each prompt must describe the scene in detail (characters, setting, colors, mood) in the same child-friendly illustration style, suited to {target_age} year old children, and restate what the recurring characters look like so they stay the same on every image. Do not put any text in the images.
+
+Title: {title}
+
+Story:
+{story_content}
+"""
+
 
 # Function schemas
 CREATE_STORY_SCHEMA = {
@@ -65,215 +94,270 @@ CREATE_IMAGE_PROMPTS_SCHEMA = {
 } 
 
 
+CREATE_STORY_PLAN_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": "create_story_plan",
+        "description": "Create a children's story with title, summary and content, together with the image prompts illustrating it",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "title": {
+                    "type": "string",
+                    "description": "A short, catchy title for the story"
+                },
+                "summary": {
+                    "type": "string",
+                    "description": "A brief 1-2 sentence summary of the story"
+                },
+                "story_content": {
+                    "type": "string",
+                    "description": "The full story content with paragraphs and formatting"
+                },
+                "image_prompts": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "image_number": {
+                                "type": "integer",
+                                "description": "The sequential number of the image (1, 2, 3, etc.)"
+                            },
+                            "prompt": {
+                                "type": "string",
+                                "description": "Detailed image generation prompt optimized for ChatGPT"
+                            }
+                        },
+                        "required": ["image_number", "prompt"]
+                    },
+                    "description": "Array of image prompts: the title page, each story page in order, then \"The End\" page"
+                }
+            },
+            "required": ["title", "summary", "story_content", "image_prompts"]
+        }
+    }
+}
+
+# Appended to the story prompt in single-call planning mode, so the story and its image prompts come back together
+STORY_PLAN_PROMPT = """
+Once the story is written, plan its illustrations. The story will be split into {nb_images} pages of about {words_per_image} words each. Write {total_images} image prompts:
+- Image 1 illustrates the title page
+- Images 2 to {last_page_image} illustrate the story pages, in reading order
+- Image {total_images} illustrates "The End" page
+Each prompt must describe the scene in detail (characters, setting, colors, mood) in the same child-friendly illustration style, suited to {target_age} year old children, and restate what the recurring characters look like so they stay the same on every image. Do not put any text in the images.
+"""
+
+
+# Stylesheet shared by every page template, parsed once per process and page size
+STORY_PAGE_CSS = """
+    @page {
+        size: {{ page_width }} {{ page_height }};
+        margin: 0;
+    }
+
+    body {
+        margin: 0;
+        padding: 0;
+        font-family: "Comic Sans MS", "Arial Rounded MT Bold", "Arial", sans-serif;
+    }
+
+    .page {
+        width: {{ page_width }};
+        height: {{ page_height }};
+        box-sizing: border-box;
+        page-break-after: always;
+        position: relative;
+        overflow: hidden;
+    }
+
+    .page:last-child {
+        page-break-after: auto;
+    }
+
+    .page-container {
+        width: 100%;
+        height: 100%;
+        position: relative;
+        background-color: #f0f8ff; /* Light blue background fallback */
+    }
+
+    .background-image {
+        width: 100%;
+        height: 100%;
+        object-fit: cover;
+        position: absolute;
+        top: 0;
+        left: 0;
+        z-index: 1;
+    }
+
+    .text-overlay {
+        position: absolute;
+        bottom: 1.5in;
+        left: 1in;
+        right: 1in;
+        background: rgba(255, 255, 255, 0.95);
+        padding: 0.75in;
+        border-radius: 0.5in;
+        box-shadow: 0 4px 12px rgba(0, 0, 0, 0.2);
+        z-index: 2;
+        border: 3px solid #ff6b6b;
+    }
+
+    .text {
+        font-size: 24px;
+        line-height: 1.4;
+        color: #2c3e50;
+        text-align: center;
+        font-weight: bold;
+        margin: 0;
+        text-shadow: 1px 1px 2px rgba(255, 255, 255, 0.8);
+    }
+
+    .title-overlay {
+        position: absolute;
+        top: 50%;
+        left: 50%;
+        transform: translate(-50%, -50%);
+        background: rgba(255, 255, 255, 0.95);
+        padding: 1.5in;
+        border-radius: 0.75in;
+        box-shadow: 0 8px 24px rgba(0, 0, 0, 0.3);
+        z-index: 2;
+        border: 5px solid #ff6b6b;
+        text-align: center;
+        min-width: 60%;
+    }
+
+    .title-text {
+        font-size: 36px;
+        line-height: 1.2;
+        color: #2c3e50;
+        text-align: center;
+        font-weight: bold;
+        margin: 0;
+        text-shadow: 2px 2px 4px rgba(255, 255, 255, 0.9);
+        letter-spacing: 1px;
+    }
+
+    .title-decoration {
+        position: absolute;
+        top: -10px;
+        left: -10px;
+        right: -10px;
+        bottom: -10px;
+        border: 3px dashed #ffd93d;
+        border-radius: 0.75in;
+        z-index: -1;
+    }
+
+    /* Fallback for when no image is provided */
+    .no-image {
+        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+        width: 100%;
+        height: 100%;
+        display: flex;
+        align-items: center;
+        justify-content: center;
+        color: white;
+        font-size: 18px;
+        text-align: center;
+    }
+    """
+
 # Standard page HTML template
 STORY_STANDARD_TEMPLATE = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
         <meta charset="UTF-8">
-        <style>
-            @page {
-                size: {{ page_width }} {{ page_height }};
-                margin: 0;
-            }
-            
-            body {
-                width: {{ page_width }};
-                height: {{ page_height }};
-                margin: 0;
-                padding: 0;
-                font-family: "Comic Sans MS", "Arial Rounded MT Bold", "Arial", sans-serif;
-                box-sizing: border-box;
-                page-break-after: always;
-                position: relative;
-                overflow: hidden;
-            }
-
-            .page-container {
-                width: 100%;
-                height: 100%;
-                position: relative;
-                background-color: #f0f8ff; /* Light blue background fallback */
-            }
-
-            .background-image {
-                width: 100%;
-                height: 100%;
-                object-fit: cover;
-                position: absolute;
-                top: 0;
-                left: 0;
-                z-index: 1;
-            }
-
-            .text-overlay {
-                position: absolute;
-                bottom: 1.5in;
-                left: 1in;
-                right: 1in;
-                background: rgba(255, 255, 255, 0.95);
-                padding: 0.75in;
-                border-radius: 0.5in;
-                box-shadow: 0 4px 12px rgba(0, 0, 0, 0.2);
-                z-index: 2;
-                border: 3px solid #ff6b6b;
-            }
-
-            .text {
-                font-size: 24px;
-                line-height: 1.4;
-                color: #2c3e50;
-                text-align: center;
-                font-weight: bold;
-                margin: 0;
-                text-shadow: 1px 1px 2px rgba(255, 255, 255, 0.8);
-            }
-
-            /* Fallback for when no image is provided */
-            .no-image {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                width: 100%;
-                height: 100%;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                color: white;
-                font-size: 18px;
-                text-align: center;
-            }
-        </style>
     </head>
     <body>
-        <div class="page-container">
-            {% if image %}
-            <img src="{{ image }}" class="background-image" alt="Story illustration" />
-            {% else %}
-            <div class="no-image">
-                <div>No image available</div>
-            </div>
-            {% endif %}
-            
-            {% if text %}
-            <div class="text-overlay">
-                <div class="text">{{ text }}</div>
+        <section class="page">
+            <div class="page-container">
+                {% if image %}
+                <img src="{{ image }}" class="background-image" alt="Story illustration" />
+                {% else %}
+                <div class="no-image">
+                    <div>No image available</div>
+                </div>
+                {% endif %}
+
+                {% if text %}
+                <div class="text-overlay">
+                    <div class="text">{{ text }}</div>
+                </div>
+                {% endif %}
             </div>
-            {% endif %}
-        </div>
+        </section>
     </body>
     </html>
     """
 
 # Title page HTML template for kid's book cover
 STORY_TITLE_TEMPLATE = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+    </head>
+    <body>
+        <section class="page">
+            <div class="page-container">
+                {% if image %}
+                <img src="{{ image }}" class="background-image" alt="Story illustration" />
+                {% else %}
+                <div class="no-image">
+                    <div>No image available</div>
+                </div>
+                {% endif %}
 
+                {% if text %}
+                <div class="title-overlay">
+                    <div class="title-decoration"></div>
+                    <div class="title-text">{{ text }}</div>
+                </div>
+                {% endif %}
+            </div>
+        </section>
+    </body>
+    </html>
+    """
 
+# Whole book HTML template, used to render every page in a single WeasyPrint pass
+STORY_BOOK_TEMPLATE = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
         <meta charset="UTF-8">
-        <style>
-            @page {
-                size: {{ page_width }} {{ page_height }};
-                margin: 0;
-            }
-            
-            body {
-                width: {{ page_width }};
-                height: {{ page_height }};
-                margin: 0;
-                padding: 0;
-                font-family: "Comic Sans MS", "Arial Rounded MT Bold", "Arial", sans-serif;
-                box-sizing: border-box;
-                page-break-after: always;
-                position: relative;
-                overflow: hidden;
-            }
-
-            .page-container {
-                width: 100%;
-                height: 100%;
-                position: relative;
-                background-color: #f0f8ff; /* Light blue background fallback */
-            }
-
-            .background-image {
-                width: 100%;
-                height: 100%;
-                object-fit: cover;
-                position: absolute;
-                top: 0;
-                left: 0;
-                z-index: 1;
-            }
-
-            .title-overlay {
-                position: absolute;
-                top: 50%;
-                left: 50%;
-                transform: translate(-50%, -50%);
-                background: rgba(255, 255, 255, 0.95);
-                padding: 1.5in;
-                border-radius: 0.75in;
-                box-shadow: 0 8px 24px rgba(0, 0, 0, 0.3);
-                z-index: 2;
-                border: 5px solid #ff6b6b;
-                text-align: center;
-                min-width: 60%;
-            }
-
-            .title-text {
-                font-size: 36px;
-                line-height: 1.2;
-                color: #2c3e50;
-                text-align: center;
-                font-weight: bold;
-                margin: 0;
-                text-shadow: 2px 2px 4px rgba(255, 255, 255, 0.9);
-                letter-spacing: 1px;
-            }
-
-            .title-decoration {
-                position: absolute;
-                top: -10px;
-                left: -10px;
-                right: -10px;
-                bottom: -10px;
-                border: 3px dashed #ffd93d;
-                border-radius: 0.75in;
-                z-index: -1;
-            }
-
-            /* Fallback for when no image is provided */
-            .no-image {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                width: 100%;
-                height: 100%;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                color: white;
-                font-size: 18px;
-                text-align: center;
-            }
-        </style>
     </head>
     <body>
-        <div class="page-container">
-            {% if image %}
-            <img src="{{ image }}" class="background-image" alt="Story illustration" />
-            {% else %}
-            <div class="no-image">
-                <div>No image available</div>
-            </div>
-            {% endif %}
-            
-            {% if text %}
-            <div class="title-overlay">
-                <div class="title-decoration"></div>
-                <div class="title-text">{{ text }}</div>
+        {% for page in pages %}
+        <section class="page">
+            <div class="page-container">
+                {% if page.image %}
+                <img src="{{ page.image }}" class="background-image" alt="Story illustration" />
+                {% else %}
+                <div class="no-image">
+                    <div>No image available</div>
+                </div>
+                {% endif %}
+
+                {% if page.text %}
+                {% if page.is_title %}
+                <div class="title-overlay">
+                    <div class="title-decoration"></div>
+                    <div class="title-text">{{ page.text }}</div>
+                </div>
+                {% else %}
+                <div class="text-overlay">
+                    <div class="text">{{ page.text }}</div>
+                </div>
+                {% endif %}
+                {% endif %}
             </div>
-            {% endif %}
-        </div>
+        </section>
+        {% endfor %}
     </body>
     </html>
     """
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Adaptive Concurrency for Story Generator
+
+This module limits the API calls in flight with an AIMD controller fed by the API responses: the limit
+grows by about one call per round of successful calls that were held back by it (a limit that is never
+reached is never tested against the quota, so it does not grow), and is cut by a factor when a call is answered
+429 or when the x-ratelimit-remaining-* headers show the account quota is nearly used up. A retry-after
+(or an exhausted quota's x-ratelimit-reset-*) pauses new calls, so the concurrency tracks the real quota
+instead of a fixed delay between calls.
+"""
+
+import re
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Mapping, Optional
+from config import CONCURRENCY_MIN, CONCURRENCY_DECREASE_FACTOR, CONCURRENCY_DECREASE_INTERVAL, RATE_LIMIT_HEADROOM
+
+RATE_LIMIT_KINDS = ("requests", "tokens")
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Return the seconds of a rate-limit header duration such as "1s", "6m0s", "20ms" or "0.5", None if unreadable."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_SECONDS[unit] for number, unit in parts)
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveConcurrencyLimiter:
+    """Thread-safe AIMD limit on the calls in flight to one API, shared by every caller of the process.
+
+    Args:
+        name: name of the API, used in the messages
+        initial: starting limit
+        min_limit: the limit is never cut below this
+        max_limit: the limit never grows above this
+        decrease_factor: the limit is multiplied by this on a 429 or a nearly exhausted quota
+        decrease_interval: seconds after a cut during which other throttled calls do not cut again
+            (calls sent before the cut were answered with the old limit)
+        headroom: fraction of the quota under which x-ratelimit-remaining-* counts as a throttling signal
+    """
+
+    def __init__(self, name: str, initial: float, max_limit: float, min_limit: float = CONCURRENCY_MIN, decrease_factor: float = CONCURRENCY_DECREASE_FACTOR, decrease_interval: float = CONCURRENCY_DECREASE_INTERVAL, headroom: float = RATE_LIMIT_HEADROOM):
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1")
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.headroom = headroom
+        self.in_flight = 0
+        self.counters = {"calls": 0, "throttled": 0, "decreases": 0, "paused_seconds": 0.0}
+        self._paused_until = 0.0
+        self._last_decrease = float("-inf")
+        self._changed = threading.Condition()
+
+    def acquire(self) -> bool:
+        """
+        Block until a call is allowed by the current limit and by any retry-after pause, then count it in flight.
+
+        Returns:
+            True if the call took the last slot of the limit, i.e. the limit was binding (to pass to on_response)
+        """
+        with self._changed:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < int(self.limit):
+                    break
+                self._changed.wait(pause if pause > 0 else None)
+            self.in_flight += 1
+            self.counters["calls"] += 1
+            return self.in_flight >= int(self.limit)
+
+    def release(self):
+        with self._changed:
+            self.in_flight -= 1
+            self._changed.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold one in-flight call for the enclosed block, yielding whether the limit was binding when it was acquired."""
+        limit_bound = self.acquire()
+        try:
+            yield limit_bound
+        finally:
+            self.release()
+
+    def on_response(self, status_code: int, headers: Mapping[str, str], limit_bound: bool = False):
+        """
+        Adjust the limit from the status and rate-limit headers of an API response.
+
+        Args:
+            status_code: HTTP status of the response
+            headers: response headers, read for retry-after and x-ratelimit-*
+            limit_bound: the call took the last slot of the limit (as returned by acquire), only such a
+                successful call grows the limit
+        """
+        retry_after = parse_duration(headers.get("retry-after"))
+        if status_code == 429:
+            self._decrease(retry_after if retry_after is not None else 0)
+            return
+        if status_code >= 400:
+            return  # Not a capacity signal, leave the limit alone
+
+        # Quota left in the current window, as a fraction of the account limit (requests and tokens)
+        pause = 0.0
+        throttled = False
+        for kind in RATE_LIMIT_KINDS:
+            remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+            quota = _header_number(headers, f"x-ratelimit-limit-{kind}")
+            if remaining is None or not quota:
+                continue
+            if remaining / quota < self.headroom:
+                throttled = True
+                if remaining <= 0:
+                    pause = max(pause, parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 0)
+        if throttled:
+            self._decrease(pause)
+        elif limit_bound:
+            self._increase()
+
+    def _increase(self):
+        with self._changed:
+            # One call per limit of successful calls, i.e. about +1 per round trip of the whole window
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._changed.notify_all()
+
+    def _decrease(self, pause: float):
+        now = time.monotonic()
+        with self._changed:
+            self.counters["throttled"] += 1
+            if pause > 0 and now + pause > self._paused_until:
+                self.counters["paused_seconds"] += now + pause - max(now, self._paused_until)
+                self._paused_until = now + pause
+            if now - self._last_decrease < self.decrease_interval:
+                return
+            self._last_decrease = now
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            self.counters["decreases"] += 1
+        print(f"⚠️ {self.name} API throttled, concurrency limit cut to {int(self.limit)}" + (f", pausing {pause:.1f}s" if pause > 0 else ""))
+
+    def stats(self) -> Dict[str, float]:
+        """Return the current limit, the calls in flight and the throttling counters."""
+        with self._changed:
+            return {"limit": int(self.limit), "in_flight": self.in_flight, **self.counters}
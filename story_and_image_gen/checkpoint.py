@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Run Checkpoints for Story Generator
+
+This module keeps a checkpoint manifest of every generation run: the request, the story JSON, the
+image prompts and the status and path of each image, rewritten as the run progresses. A failed or
+interrupted run can then be resumed from its run id, redoing only the failed or missing work.
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from typing import Dict, List, Optional
+from config import RUNS_DIR, RUNS_MAX_AGE
+
+
+def cleanup_checkpoints(max_age: float, runs_dir: str = RUNS_DIR, keep_max_age: float = RUNS_MAX_AGE) -> int:
+    """
+    Delete the manifests that can no longer be resumed: the runs whose images directory is gone (their
+    workspace was deleted) and that were not updated for max_age seconds, and every run not updated for
+    keep_max_age seconds.
+
+    Args:
+        max_age: seconds after which a manifest whose images directory is gone is deleted
+        runs_dir: directory of the checkpoint manifests
+        keep_max_age: seconds after which any manifest is deleted
+
+    Returns:
+        number of manifests deleted
+    """
+    if not os.path.exists(runs_dir):
+        return 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(runs_dir):
+        path = os.path.join(runs_dir, name)
+        if not name.endswith(".json"):
+            continue
+        try:
+            age = now - os.path.getmtime(path)
+            if age < max_age:
+                continue
+            if age < keep_max_age:
+                with open(path, 'r', encoding='utf-8') as f:
+                    images_dir = json.load(f).get('images_dir')
+                if images_dir and os.path.exists(images_dir):
+                    continue
+            os.remove(path)
+            removed += 1
+        except (OSError, ValueError):
+            continue  # Removed or rewritten concurrently
+    return removed
+
+
+class RunCheckpoint:
+    """Thread-safe checkpoint manifest of one run, stored as {runs_dir}/{run_id}.json.
+
+    Every change is written to disk atomically, so the manifest always describes a consistent state
+    even if the process dies in the middle of the run.
+
+    Args:
+        run_id: identifier of the run
+        runs_dir: directory of the checkpoint manifests
+    """
+
+    def __init__(self, run_id: str, runs_dir: str = RUNS_DIR):
+        self.run_id = run_id
+        self.path = os.path.join(runs_dir, f"{run_id}.json")
+        self.data = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_run_id() -> str:
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    @classmethod
+    def create(cls, request: Dict, images_dir: str, run_id: Optional[str] = None, runs_dir: str = RUNS_DIR) -> "RunCheckpoint":
+        """Start the checkpoint of a new run of request, whose images are written to images_dir."""
+        checkpoint = cls(run_id or cls.new_run_id(), runs_dir)
+        checkpoint.data = {
+            'run_id': checkpoint.run_id,
+            'status': 'running',
+            'created_at': time.time(),
+            'updated_at': time.time(),
+            'attempts': 1,
+            'request': request,
+            'images_dir': os.path.abspath(images_dir),
+            'story': None,
+            'nb_images': None,
+            'image_prompts': None,
+            'images': {}
+        }
+        checkpoint.save()
+        return checkpoint
+
+    @classmethod
+    def load(cls, run_id: str, runs_dir: str = RUNS_DIR) -> "RunCheckpoint":
+        """Load the checkpoint of an existing run.
+
+        Raises:
+            ValueError: If there is no checkpoint for run_id.
+        """
+        checkpoint = cls(run_id, runs_dir)
+        try:
+            with open(checkpoint.path, 'r', encoding='utf-8') as f:
+                checkpoint.data = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f"No checkpoint found for run {run_id} in {runs_dir}")
+        return checkpoint
+
+    @property
+    def request(self) -> Dict:
+        return self.data['request']
+
+    @property
+    def images_dir(self) -> str:
+        return self.data['images_dir']
+
+    @property
+    def has_plan(self) -> bool:
+        """True once the story and its image prompts are checkpointed."""
+        return self.data.get('story') is not None and self.data.get('image_prompts') is not None
+
+    def save(self):
+        """Atomically rewrite the manifest."""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self.data['updated_at'] = time.time()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _update(self, **fields):
+        with self._lock:
+            self.data.update(fields)
+            self._save()
+
+    def start_attempt(self):
+        """Mark the run as running again, when it is resumed."""
+        with self._lock:
+            self.data['attempts'] = self.data.get('attempts', 1) + 1
+            self.data['status'] = 'running'
+            self.data.pop('error', None)
+            self._save()
+
+    def set_plan(self, story: Dict, nb_images: int, image_prompts: Dict):
+        """Checkpoint the story and its image prompts, and mark every image as pending."""
+        with self._lock:
+            self.data.update(story=story, nb_images=nb_images, image_prompts=image_prompts)
+            self.data['images'] = {
+                str(prompt_data.get('image_number', 1) - 1): {'status': 'pending', 'path': None}
+                for prompt_data in image_prompts.get('image_prompts', [])
+            }
+            self._save()
+
+    def image_done(self, image_number: int, path: str):
+        with self._lock:
+            self.data['images'][str(image_number)] = {'status': 'done', 'path': os.path.abspath(path)}
+            self._save()
+
+    def image_failed(self, image_number: int, error: str):
+        with self._lock:
+            self.data['images'][str(image_number)] = {'status': 'failed', 'path': None, 'error': error}
+            self._save()
+
+    def pending_image_prompts(self) -> List[Dict]:
+        """Return the image prompts whose image is not done, or whose file has disappeared since."""
+        with self._lock:
+            images = dict(self.data['images'])
+            prompts = list((self.data.get('image_prompts') or {}).get('image_prompts', []))
+        pending = []
+        for prompt_data in prompts:
+            image = images.get(str(prompt_data.get('image_number', 1) - 1)) or {}
+            if image.get('status') != 'done' or not image.get('path') or not os.path.exists(image['path']):
+                pending.append(prompt_data)
+        return pending
+
+    def done_images(self) -> Dict[int, str]:
+        """Return image_number -> path of the images that are done and whose file is still there."""
+        with self._lock:
+            images = dict(self.data['images'])
+        return {
+            int(image_number): image['path'] for image_number, image in images.items()
+            if image.get('status') == 'done' and image.get('path') and os.path.exists(image['path'])
+        }
+
+    def failed_images(self) -> Dict[int, str]:
+        """Return image_number -> error of the images that failed."""
+        with self._lock:
+            return {int(image_number): image.get('error', '') for image_number, image in self.data['images'].items() if image['status'] == 'failed'}
+
+    def finish(self, status: str, error: Optional[Exception] = None):
+        """Mark the run as "complete", "partial" (some images failed) or "failed"."""
+        fields = {'status': status}
+        if error is not None:
+            fields['error'] = str(error)
+        self._update(**fields)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Image Cache for Story Generator
+
+This module stores generated images on disk, keyed by a hash of the request that produced them,
+so that re-running a book does not pay for the same image twice.
+"""
+
+import os
+import shutil
+import hashlib
+import threading
+from typing import Dict, Optional
+from config import IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES
+
+
+class ImageCache:
+    """Content-addressed on-disk image cache with a size cap and LRU eviction.
+
+    Entries are stored as {cache_dir}/{key}.png where key is a SHA-256 of the request fields.
+    The modification time of each entry is bumped on every hit and is used as the LRU order.
+    The cache directory may be shared by several processes: the size cap is checked against the
+    entries on disk, not only those written by this process.
+
+    Args:
+        cache_dir: directory where cached images are stored
+        max_bytes: maximum total size of the cache before least recently used entries are evicted
+    """
+
+    def __init__(self, cache_dir: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(os.path.getsize(path) for path in self._entries())
+
+    @staticmethod
+    def make_key(image_model: str, size: str, quality: str, prompt: str) -> str:
+        """Build the cache key from the fields that define an image request."""
+        payload = "\x1f".join([image_model, size, quality, prompt])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def _entries(self):
+        return [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.endswith(".png")
+        ]
+
+    def fetch(self, key: str, destination: str) -> bool:
+        """
+        Materialise the cached image of key at destination (see link) and count a hit.
+
+        Returns:
+            bool: True on a hit, False (counted as a miss) if key is not cached or was evicted meanwhile
+        """
+        path = self._path(key)
+        try:
+            os.utime(path)  # mark as most recently used
+            self.link(key, destination)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached image path for key, or None on a miss."""
+        path = self._path(key)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)  # mark as most recently used
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+
+    def put(self, key: str, image_bytes: bytes) -> str:
+        """Store image bytes under key and evict old entries if the cache is over its size cap."""
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image_bytes)
+
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._evict(keep=path)
+        return path
+
+    def _evict(self, keep: str):
+        """Remove least recently used entries until the cache fits in max_bytes. Caller holds the lock.
+
+        The size is measured on disk, so entries written by other processes sharing the directory count too.
+        """
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Evicted by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # Evicted by another process
+            self._total_bytes -= size
+
+    def link(self, key: str, destination: str):
+        """Materialise a cached image at destination, as a hard link when possible or a copy otherwise."""
+        source = self._path(key)
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the size of the cache when it was last written by this process."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self._total_bytes,
+            }
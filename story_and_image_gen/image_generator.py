@@ -9,11 +9,26 @@ import os
 import json
 import base64
 from typing import Dict, Optional
-from dotenv import load_dotenv
-from openai import OpenAI
-from story_prompts import IMAGE_PROMPT_BREAKDOWN
+from openai import OpenAI, RateLimitError, APIConnectionError, InternalServerError
+try:
+    from story_prompts import IMAGE_PROMPT_BREAKDOWN
+except ImportError:
+    # Deployments ship story_prompts, the stand-in template only serves the benchmark and tests without it
+    from prompts import IMAGE_PROMPT_BREAKDOWN
 from prompts import CREATE_IMAGE_PROMPTS_SCHEMA
-from config import API_KEY_ENV_VAR, IMAGES_DIR
+from config import IMAGES_DIR, IMAGE_QUALITY, IMAGE_MAX_ATTEMPTS
+from image_cache import ImageCache
+from utils import RateLimiter
+from response_cache import ResponseCache, create_tool_call
+from openai_client import get_openai_client
+from image_store import ImageStore
+from tracing import Trace, span, add_counter
+from retries import HedgingPolicy, call_with_retries, hedged_call
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Return True for the transient API errors worth another attempt (rate limit, connection, timeout, 5xx)."""
+    return isinstance(error, (RateLimitError, APIConnectionError, InternalServerError))
 
 
 class ImageGenerator:
@@ -25,9 +40,20 @@ class ImageGenerator:
         size: size of the images
         target_age: target age group for the story
         api_key: OpenAI API key. If not provided, will look for OPENAI_API_KEY env var.
+        quality: quality of the images
+        image_cache: optional ImageCache serving repeated image requests without an API call
+        rate_limiter: optional RateLimiter acquired before each image API call (cache hits are free)
+        response_cache: optional ResponseCache memoizing the image prompts breakdown
+        images_dir: directory where the output_{n}.png files are written
+        text_rate_limiter: optional RateLimiter acquired before the image prompts breakdown call
+        image_store: optional ImageStore receiving the image bytes for in-memory handoff to the renderer
+        trace: optional Trace recording the prompts breakdown, each image call, its rate-limit wait and bytes
+        client: OpenAI client to use, the process-wide pooled client if not provided
+        max_attempts: attempts of each image request on transient errors, with jittered exponential backoff
+        hedging: optional HedgingPolicy sending a duplicate request when an image call is unusually slow
     """
 
-    def __init__(self, image_model: str = "gpt-image-1", text_model: str = "gpt-4.1", nb_images: int = 1, size: str = "1024x1024", target_age: int = 3, title: str = "", story_content: str = "", api_key: Optional[str] = None):
+    def __init__(self, image_model: str = "gpt-image-1", text_model: str = "gpt-4.1", nb_images: int = 1, size: str = "1024x1024", target_age: int = 3, title: str = "", story_content: str = "", api_key: Optional[str] = None, quality: str = IMAGE_QUALITY, image_cache: Optional[ImageCache] = None, rate_limiter: Optional[RateLimiter] = None, response_cache: Optional[ResponseCache] = None, images_dir: str = IMAGES_DIR, text_rate_limiter: Optional[RateLimiter] = None, image_store: Optional[ImageStore] = None, trace: Optional[Trace] = None, client: Optional[OpenAI] = None, max_attempts: int = IMAGE_MAX_ATTEMPTS, hedging: Optional[HedgingPolicy] = None):
         self.image_model = image_model
         self.text_model = text_model
         self.nb_images = nb_images
@@ -35,12 +61,20 @@ class ImageGenerator:
         self.target_age = target_age
         self.title = title
         self.story_content = story_content
+        self.quality = quality
+        self.image_cache = image_cache
+        self.rate_limiter = rate_limiter
+        self.response_cache = response_cache
+        self.images_dir = images_dir
+        self.text_rate_limiter = text_rate_limiter
+        self.image_store = image_store
+        self.trace = trace
+        self.max_attempts = max_attempts
+        self.hedging = hedging
+        self.failed_images = {}  # image_number -> error of the images that failed after their retries
         
-        load_dotenv()
-        self.api_key = os.getenv(API_KEY_ENV_VAR)
-        if not self.api_key:
-            raise ValueError(f"OpenAI API key is required. Set {API_KEY_ENV_VAR} environment variable.")
-        self.client = OpenAI(api_key=self.api_key)
+        # Share the pooled client (and its open connections) with the other generators
+        self.client = client if client is not None else get_openai_client(api_key)
 
     def get_image_prompts(self):
         """Get the image prompts for the nb_images selected for the story by calling OpenAI text API to break down the story content into nb_images prompts"""
@@ -48,6 +82,7 @@ class ImageGenerator:
         prompt = IMAGE_PROMPT_BREAKDOWN.format(
             total_images=self.nb_images + 2,  # +1 for title page + 1 for "The End" page
             nb_images=self.nb_images,
+            last_page_image=self.nb_images + 1,
             target_age=self.target_age,
             title=self.title,
             story_content=self.story_content
@@ -57,36 +92,121 @@ class ImageGenerator:
         # Use function schema from prompts module
         function_schema = CREATE_IMAGE_PROMPTS_SCHEMA
         
-        response = self.client.chat.completions.create(
-            model=self.text_model,
-            messages=[{"role": "user", "content": prompt}],
-            tools=[function_schema],
-            tool_choice={"type": "function", "function": {"name": "create_image_prompts_table"}},
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        # Extract the function call response
-        tool_call = response.choices[0].message.tool_calls[0]
-        image_prompts_data = json.loads(tool_call.function.arguments)
+        with span(self.trace, "prompt_breakdown", model=self.text_model, nb_images=self.nb_images):
+            image_prompts_data = create_tool_call(
+                self.client,
+                self.response_cache,
+                self.text_rate_limiter,
+                self.trace,
+                model=self.text_model,
+                messages=[{"role": "user", "content": prompt}],
+                tools=[function_schema],
+                tool_choice={"type": "function", "function": {"name": "create_image_prompts_table"}},
+                temperature=0.7,
+                max_tokens=1000
+            )
         
         return image_prompts_data
             
     def generate_image(self, image_number: int, prompt: str):
-        """Generate an image based on the prompt."""
-        image = self.client.images.generate(
-            model = self.image_model,
-            prompt = prompt,
-            n = self.nb_images, 
-            size = self.size,
-            quality = "low"
-        )
+        """Generate an image based on the prompt, serving it from the image cache when possible."""
+        with span(self.trace, "image", image_number=image_number) as attributes:
+            image_bytes, attributes['cache_hit'] = self._generate_image(image_number, prompt)
+            attributes['bytes'] = len(image_bytes)
+        add_counter(self.trace, "image.count")
+        add_counter(self.trace, "image.bytes", len(image_bytes))
+        return image_bytes
+
+    def _acquire_rate_limit(self):
+        if self.rate_limiter is not None:
+            with span(self.trace, "rate_limit_wait", api="image"):
+                self.rate_limiter.acquire()
+
+    def _request_image(self, image_number: int, prompt: str, attributes: Dict):
+        """Call the image API, retrying transient errors with jittered backoff and hedging slow calls."""
+        attributes.update(attempts=0, hedged=False, hedge_won=False)
+
+        def _call():
+            # Retries are done here with the hedging, the client must not retry each attempt on its own too
+            return self.client.with_options(max_retries=0).images.generate(
+                model = self.image_model,
+                prompt = prompt,
+                n = 1, 
+                size = self.size,
+                quality = self.quality
+            )
+
+        def _hedge():
+            # The duplicate request is paid for, so it goes through the rate limiter too
+            self._acquire_rate_limit()
+            return _call()
+
+        def _attempt():
+            attributes['attempts'] += 1
+            self._acquire_rate_limit()
+            if self.hedging is None:
+                return _call()
+            image, hedged, hedge_won = hedged_call(_call, self.hedging, hedge_call=_hedge)
+            if hedged:
+                attributes['hedged'] = True
+                attributes['hedge_won'] = attributes['hedge_won'] or hedge_won
+                add_counter(self.trace, "image.hedges")
+                add_counter(self.trace, "image.hedge_wins", int(hedge_won))
+            return image
+
+        def _on_retry(attempt, error, delay):
+            add_counter(self.trace, "image.retries")
+            print(f"⚠️ Image {image_number} attempt {attempt} failed ({error}), retrying in {delay:.1f}s")
+
+        return call_with_retries(_attempt, is_retryable_error, self.max_attempts, on_retry=_on_retry)
+
+    def _generate_image(self, image_number: int, prompt: str):
+        """Return (image bytes, True if served from the image cache)."""
+        output_path = f"{self.images_dir}/output_{image_number}.png"
+        cache_key = None
+
+        if self.image_cache is not None:
+            cache_key = ImageCache.make_key(self.image_model, self.size, self.quality, prompt)
+            # A hit is only counted once the image is linked, an entry evicted meanwhile is a miss
+            if self.image_cache.fetch(cache_key, output_path):
+                with open(output_path, "rb") as f:
+                    image_bytes = f.read()
+                if self.image_store is not None:
+                    self.image_store.put(output_path, image_bytes, write=False)  # Already linked on disk
+                add_counter(self.trace, "image_cache.hits")
+                return image_bytes, True
+            add_counter(self.trace, "image_cache.misses")
+
+        with span(self.trace, "openai.images", model=self.image_model, image_number=image_number) as attributes:
+            image = self._request_image(image_number, prompt, attributes)
+            usage = getattr(image, "usage", None)
+            attributes['input_tokens'] = getattr(usage, "input_tokens", None) or 0
+            attributes['output_tokens'] = getattr(usage, "output_tokens", None) or 0
+        add_counter(self.trace, "openai.images.requests")
+        add_counter(self.trace, "openai.images.input_tokens", attributes['input_tokens'])
+        add_counter(self.trace, "openai.images.output_tokens", attributes['output_tokens'])
 
         # Decode the base64 image data
         image_bytes = base64.b64decode(image.data[0].b64_json)
 
-        # Save the image as output.png
-        with open(f"{IMAGES_DIR}/output_{image_number}.png", "wb") as f:
-            f.write(image_bytes)
+        linked = False
+        if cache_key is not None:
+            # Store in the cache and link the run output to the cached file
+            self.image_cache.put(cache_key, image_bytes)
+            try:
+                self.image_cache.link(cache_key, output_path)
+                linked = True
+            except FileNotFoundError:
+                pass
+
+        if self.image_store is not None:
+            # Hand the bytes to the renderer in memory, writing to disk is a write-behind
+            self.image_store.put(output_path, image_bytes, write=not linked)
+            return image_bytes, False
+
+        if not linked:
+            # Save the image as output.png
+            with open(output_path, "wb") as f:
+                f.write(image_bytes)
 
-        return image_bytes 
\ No newline at end of file
+        return image_bytes, False
\ No newline at end of file
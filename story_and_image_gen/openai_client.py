@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+OpenAI Client for Story Generator
+
+This module builds one process-wide OpenAI client on top of a tuned httpx connection pool, shared by
+the story and image generators of every book, so that connections and TLS sessions are reused across
+calls and across concurrent runs instead of being opened again for every generator. Every image and
+text call also goes through the process-wide adaptive concurrency limit of its API, fed with the status
+and rate-limit headers of its response.
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI, DefaultHttpxClient
+from config import (
+    API_KEY_ENV_VAR, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_KEEPALIVE_EXPIRY,
+    OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT, OPENAI_POOL_TIMEOUT, OPENAI_MAX_RETRIES, ADAPTIVE_CONCURRENCY_ENABLED,
+    IMAGE_CONCURRENCY_INITIAL, IMAGE_CONCURRENCY_MAX, TEXT_CONCURRENCY_INITIAL, TEXT_CONCURRENCY_MAX
+)
+from tracing import METRICS
+from adaptive_concurrency import AdaptiveConcurrencyLimiter
+
+# Process-wide in-flight limits of the image and text APIs, shared by every client and book
+IMAGE_CONCURRENCY = AdaptiveConcurrencyLimiter("Image", IMAGE_CONCURRENCY_INITIAL, IMAGE_CONCURRENCY_MAX) if ADAPTIVE_CONCURRENCY_ENABLED else None
+TEXT_CONCURRENCY = AdaptiveConcurrencyLimiter("Text", TEXT_CONCURRENCY_INITIAL, TEXT_CONCURRENCY_MAX) if ADAPTIVE_CONCURRENCY_ENABLED else None
+
+
+def concurrency_limiter(path: str) -> Optional[AdaptiveConcurrencyLimiter]:
+    """Return the adaptive concurrency limiter of the API called at path, if any."""
+    if "/images/" in path:
+        return IMAGE_CONCURRENCY
+    if path.endswith(("/chat/completions", "/responses")):
+        return TEXT_CONCURRENCY
+    return None
+
+
+class _ClosingStream(httpx.SyncByteStream):
+    """Response body stream calling on_close once, when the body has been read and closed."""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """httpx transport counting requests, requests in flight, new connections and TLS handshakes.
+
+    Image and text calls wait for a slot of their adaptive concurrency limiter, which is then adjusted
+    from the response (every attempt of the OpenAI client retries included). The slot is held until the
+    response is closed, so a large image body still downloading counts as in flight.
+
+    Args:
+        **kwargs: keyword arguments of httpx.HTTPTransport (limits, retries...)
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = {"requests": 0, "errors": 0, "in_flight": 0, "connections_opened": 0, "tls_handshakes": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def _trace(self, event, info):
+        # httpcore trace extension, called for every connection event of a request
+        if event == "connection.connect_tcp.complete":
+            self._count("connections_opened")
+        elif event == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+
+    def handle_request(self, request):
+        request.extensions["trace"] = self._trace
+        limiter = concurrency_limiter(request.url.path)
+        limit_bound = limiter.acquire() if limiter is not None else False
+        self._count("requests")
+        self._count("in_flight")
+
+        def done():
+            self._count("in_flight", -1)
+            if limiter is not None:
+                limiter.release()
+
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            self._count("errors")
+            done()
+            raise
+        if limiter is not None:
+            limiter.on_response(response.status_code, response.headers, limit_bound)
+        response.stream = _ClosingStream(response.stream, done)
+        return response
+
+    def _pool_connections(self) -> Optional[List]:
+        # httpx keeps its httpcore pool private, read it defensively so an upgrade drops the gauges instead of failing
+        connections = getattr(getattr(self, "_pool", None), "connections", None)
+        try:
+            return list(connections) if connections is not None else None
+        except TypeError:
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        """Return the request counters and, when httpx exposes it, the current state of the connection pool."""
+        connections = self._pool_connections()
+        with self._lock:
+            stats = dict(self.counters)
+        if connections is not None:
+            stats["pool_connections"] = len(connections)
+            stats["pool_idle_connections"] = sum(1 for connection in connections if getattr(connection, "is_idle", lambda: False)())
+        stats["connection_reuse_ratio"] = round(1 - stats["connections_opened"] / stats["requests"], 3) if stats["requests"] else 0.0
+        return stats
+
+
+_clients = {}  # API key -> (OpenAI client, InstrumentedTransport)
+_clients_lock = threading.Lock()
+
+
+def create_openai_client(api_key: str, max_connections: int = OPENAI_MAX_CONNECTIONS, max_keepalive_connections: int = OPENAI_MAX_KEEPALIVE_CONNECTIONS, keepalive_expiry: float = OPENAI_KEEPALIVE_EXPIRY):
+    """
+    Build an OpenAI client on a tuned, instrumented httpx connection pool.
+
+    Args:
+        api_key: OpenAI API key
+        max_connections: maximum number of connections open at the same time
+        max_keepalive_connections: idle connections kept alive for reuse
+        keepalive_expiry: seconds an idle connection is kept alive
+
+    Returns:
+        tuple: (OpenAI client, InstrumentedTransport exposing the pool metrics)
+    """
+    transport = InstrumentedTransport(limits=httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry
+    ))
+    timeout = httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT, pool=OPENAI_POOL_TIMEOUT)
+    client = OpenAI(
+        api_key=api_key,
+        http_client=DefaultHttpxClient(transport=transport, timeout=timeout),
+        timeout=timeout,
+        max_retries=OPENAI_MAX_RETRIES
+    )
+    return client, transport
+
+
+def get_openai_client(api_key: Optional[str] = None) -> OpenAI:
+    """
+    Return the process-wide OpenAI client, built on first use.
+
+    Args:
+        api_key: OpenAI API key. If not provided, will look for the OPENAI_API_KEY env var (and .env file).
+
+    Returns:
+        Shared OpenAI client
+
+    Raises:
+        ValueError: If no API key is available.
+    """
+    if api_key is None:
+        load_dotenv()
+        api_key = os.getenv(API_KEY_ENV_VAR)
+    if not api_key:
+        raise ValueError(f"OpenAI API key is required. Set {API_KEY_ENV_VAR} environment variable.")
+
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = create_openai_client(api_key)
+        return _clients[api_key][0]
+
+
+def pool_stats() -> Dict[str, float]:
+    """Return the request and connection pool metrics summed over the shared clients."""
+    with _clients_lock:
+        transports = [transport for _, transport in _clients.values()]
+    totals = {}
+    for transport in transports:
+        for name, value in transport.stats().items():
+            if name != "connection_reuse_ratio":
+                totals[name] = totals.get(name, 0) + value
+    if totals.get("requests"):
+        totals["connection_reuse_ratio"] = round(1 - totals["connections_opened"] / totals["requests"], 3)
+    return totals
+
+
+# Exported with the process-wide metrics, e.g. storybook_openai_http_pool_connections
+METRICS.register_gauges("openai_http", pool_stats)
+if ADAPTIVE_CONCURRENCY_ENABLED:
+    # e.g. storybook_image_concurrency_limit, the current number of image calls allowed in flight
+    METRICS.register_gauges("image_concurrency", IMAGE_CONCURRENCY.stats)
+    METRICS.register_gauges("text_concurrency", TEXT_CONCURRENCY.stats)
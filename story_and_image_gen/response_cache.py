@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Response Cache for Story Generator
+
+This module memoizes the function-calling responses of OpenAI chat completions, so that
+re-running a book with the same request skips the text API round trip.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+from config import RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES
+from tracing import Trace, span, add_counter
+
+
+class ResponseCache(ABC):
+    """Base class for response caches.
+
+    Subclasses implement get/set on string keys and JSON-serializable values, and are
+    responsible for expiring entries older than ttl and evicting beyond max_entries.
+
+    Args:
+        ttl: time to live of an entry in seconds, None to never expire
+        max_entries: maximum number of entries before least recently used entries are evicted
+    """
+
+    def __init__(self, ttl: Optional[float] = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(**request) -> str:
+        """Build the cache key from the chat completion request fields (model, messages, tools, temperature...)."""
+        payload = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    @abstractmethod
+    def get(self, key: str):
+        """Return the value cached under key, or None if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value):
+        """Cache value under key, evicting expired and least recently used entries."""
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters."""
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class MemoryResponseCache(ResponseCache):
+    """In-process LRU response cache."""
+
+    def __init__(self, ttl: Optional[float] = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self._entries = OrderedDict()  # key -> (created_at, value)
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry[0]):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """On-disk response cache backed by SQLite, shared across processes and runs.
+
+    Args:
+        path: path of the SQLite database file
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl: Optional[float] = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        # Committed on success, rolled back on error, and always closed
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str):
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or self._is_expired(row[1]):
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            if self.ttl is not None:
+                conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+
+def create_response_cache(backend: Optional[str] = RESPONSE_CACHE_BACKEND) -> Optional[ResponseCache]:
+    """Create the response cache for the configured backend ("memory", "sqlite" or None to disable)."""
+    if backend is None:
+        return None
+    if backend == "memory":
+        return MemoryResponseCache()
+    if backend == "sqlite":
+        return SQLiteResponseCache()
+    raise ValueError(f"Unknown response cache backend: {backend}")
+
+
+def _is_valid(arguments, validate: Optional[Callable[[Dict], None]]) -> bool:
+    if validate is None:
+        return True
+    try:
+        validate(arguments)
+        return True
+    except ValueError:
+        return False
+
+
+def create_tool_call(client, response_cache: Optional[ResponseCache] = None, rate_limiter=None, trace: Optional[Trace] = None, validate: Optional[Callable[[Dict], None]] = None, **request) -> Dict:
+    """
+    Call chat.completions.create with a forced function call and return the parsed function arguments.
+
+    When a response cache is given, the arguments are memoized under a key built from the request fields.
+    Only arguments accepted by validate are cached, and a cached value it rejects is fetched again, so an
+    invalid response is not replayed to every retry of the same request.
+
+    Args:
+        client: OpenAI client
+        response_cache: optional cache for the parsed function arguments
+        rate_limiter: optional RateLimiter acquired before the API call (cache hits are free)
+        trace: optional Trace recording the rate-limit wait, the API call and its token usage
+        validate: optional callable raising ValueError when the function arguments are invalid
+        **request: keyword arguments of chat.completions.create (model, messages, tools, tool_choice, temperature...)
+
+    Returns:
+        Dictionary of the function call arguments
+
+    Raises:
+        ValueError: If validate rejects the function arguments returned by the API.
+    """
+    cache_key = None
+    if response_cache is not None:
+        cache_key = ResponseCache.make_key(**request)
+        cached = response_cache.get(cache_key)
+        if cached is not None and _is_valid(cached, validate):
+            add_counter(trace, "response_cache.hits")
+            return cached
+        add_counter(trace, "response_cache.misses")
+
+    if rate_limiter is not None:
+        with span(trace, "rate_limit_wait", api="text"):
+            rate_limiter.acquire()
+    with span(trace, "openai.chat", model=request.get("model")) as attributes:
+        response = client.chat.completions.create(**request)
+        usage = getattr(response, "usage", None)
+        attributes['prompt_tokens'] = getattr(usage, "prompt_tokens", None) or 0
+        attributes['completion_tokens'] = getattr(usage, "completion_tokens", None) or 0
+    add_counter(trace, "openai.chat.requests")
+    add_counter(trace, "openai.chat.prompt_tokens", attributes['prompt_tokens'])
+    add_counter(trace, "openai.chat.completion_tokens", attributes['completion_tokens'])
+
+    # Extract the function call response
+    tool_call = response.choices[0].message.tool_calls[0]
+    arguments = json.loads(tool_call.function.arguments)
+    if validate is not None:
+        validate(arguments)
+
+    if cache_key is not None:
+        response_cache.set(cache_key, arguments)
+    return arguments
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Retries and Hedging for Story Generator
+
+This module retries API calls with jittered exponential backoff, and hedges slow calls: when a call
+runs past a percentile of the recently observed latencies, a duplicate request is sent and the first
+result wins. Hedges are counted against a budget so they stay a small fraction of the requests.
+"""
+
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Optional, Tuple
+from config import (
+    IMAGE_MAX_ATTEMPTS, IMAGE_RETRY_BASE_DELAY, IMAGE_RETRY_MAX_DELAY, IMAGE_HEDGE_PERCENTILE,
+    IMAGE_HEDGE_MIN_SAMPLES, IMAGE_HEDGE_MIN_DELAY, IMAGE_HEDGE_MAX_RATIO, IMAGE_HEDGE_WINDOW
+)
+
+
+def backoff_delay(attempt: int, base_delay: float = IMAGE_RETRY_BASE_DELAY, max_delay: float = IMAGE_RETRY_MAX_DELAY) -> float:
+    """Return the full-jitter backoff before retry number attempt (1 for the first retry)."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Return the delay in seconds asked by the retry-after header of an API error, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retries(call: Callable, is_retryable: Callable[[Exception], bool], max_attempts: int = IMAGE_MAX_ATTEMPTS, base_delay: float = IMAGE_RETRY_BASE_DELAY, max_delay: float = IMAGE_RETRY_MAX_DELAY, on_retry: Optional[Callable[[int, Exception, float], None]] = None):
+    """
+    Call call() until it succeeds, sleeping a jittered exponential backoff between attempts.
+
+    Args:
+        call: function making one attempt
+        is_retryable: returns True for the errors worth another attempt, the others are raised at once
+        max_attempts: attempts before the last error is raised
+        base_delay: backoff cap of the first retry, doubled at each retry
+        max_delay: maximum backoff cap
+        on_retry: optional callback(attempt, error, delay) called before sleeping
+
+    Returns:
+        The result of the first successful attempt
+    """
+    attempt = 1
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            if attempt >= max_attempts or not is_retryable(e):
+                raise
+            delay = max(backoff_delay(attempt, base_delay, max_delay), retry_after(e) or 0)
+            if on_retry is not None:
+                on_retry(attempt, e, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+class HedgingPolicy:
+    """Thread-safe hedging threshold and budget shared by every image request of the process.
+
+    The threshold is a percentile of the latencies of the last window successful calls, and a hedge is
+    only allowed while hedges stay under max_ratio of the requests.
+
+    Args:
+        percentile: latency percentile (0-100) past which a call is hedged
+        min_samples: latencies observed before hedging starts
+        min_delay: calls are never hedged before this many seconds
+        max_ratio: maximum hedges per request
+        window: number of recent latencies the percentile is computed on
+    """
+
+    def __init__(self, percentile: float = IMAGE_HEDGE_PERCENTILE, min_samples: int = IMAGE_HEDGE_MIN_SAMPLES, min_delay: float = IMAGE_HEDGE_MIN_DELAY, max_ratio: float = IMAGE_HEDGE_MAX_RATIO, window: int = IMAGE_HEDGE_WINDOW):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_denied = 0
+
+    def observe(self, seconds: float):
+        """Record the latency of a successful call."""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self) -> Optional[float]:
+        """Return the seconds after which a call is hedged, None until enough latencies are observed."""
+        with self._lock:
+            if len(self._latencies) < max(1, self.min_samples):
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        return max(self.min_delay, latencies[index])
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self) -> bool:
+        """Take a hedge from the budget, False if hedging would exceed max_ratio of the requests."""
+        with self._lock:
+            if self.hedges + 1 > self.max_ratio * self.requests:
+                self.hedges_denied += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def count_hedge_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "hedges": self.hedges, "hedge_wins": self.hedge_wins, "hedges_denied": self.hedges_denied}
+
+
+def _start(call: Callable) -> Tuple[Future, float]:
+    """Run call() in a new daemon thread and return its future and start time."""
+    future = Future()
+    started = time.perf_counter()
+
+    def _run():
+        try:
+            future.set_result(call())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=_run, name="hedged-call", daemon=True).start()
+    return future, started
+
+
+def hedged_call(call: Callable, policy: HedgingPolicy, hedge_call: Optional[Callable] = None):
+    """
+    Call call(), and send hedge_call() too if the first one runs past the policy's threshold.
+
+    The first successful result wins and the other call is abandoned (it cannot be cancelled, its
+    result is discarded). If one call fails, the other one is still waited for.
+
+    Args:
+        call: function making the request
+        policy: HedgingPolicy giving the threshold and budget
+        hedge_call: function making the duplicate request (e.g. acquiring the rate limiter first), call by default
+
+    Returns:
+        tuple: (result, True if a hedge was sent, True if the hedge won)
+    """
+    policy.count_request()
+    threshold = policy.delay()
+    if threshold is None:
+        # Not enough latencies observed yet, call in this thread
+        started = time.perf_counter()
+        result = call()
+        policy.observe(time.perf_counter() - started)
+        return result, False, False
+
+    primary, primary_started = _start(call)
+    done, _ = wait([primary], timeout=threshold)
+    if done or not policy.try_hedge():
+        result = primary.result()
+        policy.observe(time.perf_counter() - primary_started)
+        return result, False, False
+
+    hedge, hedge_started = _start(hedge_call or call)
+    started = {primary: primary_started, hedge: hedge_started}
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            policy.observe(time.perf_counter() - started[future])
+            if future is hedge:
+                policy.count_hedge_win()
+            return future.result(), True, future is hedge
+    raise error
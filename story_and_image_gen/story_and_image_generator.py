@@ -5,96 +5,395 @@ Story and Image Generator - Orchestrates story and image generation
 
 from story_generator import StoryGenerator
 from image_generator import ImageGenerator
-from utils import add_rate_limiting_delay, create_error_output, create_success_output, create_success_output_dictionnary
-from config import IMAGE_GENERATION_DELAY, IMAGES_DIR, WORDS_PER_IMAGE_AGES_3_4, WORDS_PER_IMAGE_AGES_5_6, WORDS_PER_IMAGE_AGES_7_PLUS
+from image_cache import ImageCache
+from response_cache import create_response_cache
+from retries import HedgingPolicy
+from checkpoint import RunCheckpoint
+from openai_client import get_openai_client, pool_stats
+from utils import RateLimiter, create_error_output, create_success_output, create_success_output_dictionnary
+from tracing import METRICS, Trace, mark, finish_trace
+from config import IMAGES_DIR, TRACE_FILE, STORY_PLANNING_MODE, CHECKPOINTS_ENABLED, TRACING_ENABLED, IMAGE_BOOK_WORKERS, IMAGE_REQUESTS_BURST, IMAGE_REQUESTS_PER_MINUTE_CEILING, ADAPTIVE_CONCURRENCY_ENABLED, TEXT_REQUESTS_PER_MINUTE, TEXT_REQUESTS_BURST, IMAGE_CACHE_ENABLED, IMAGE_HEDGING_ENABLED, WORDS_PER_IMAGE_AGES_3_4, WORDS_PER_IMAGE_AGES_5_6, WORDS_PER_IMAGE_AGES_7_PLUS
 from openai import OpenAIError
+from concurrent.futures import ThreadPoolExecutor
 import os
+import queue
+import shutil
+import threading
 
-def generate_story_and_images(user_prompt, text_model, target_words, target_age, image_model, image_size, output_format="gradio"):
+# Process-wide limiters so that concurrent runs share the same API budgets. With adaptive concurrency the
+# image calls follow the account quota, and the fixed image budget only applies as an optional ceiling
+if not ADAPTIVE_CONCURRENCY_ENABLED:
+    IMAGE_RATE_LIMITER = RateLimiter()
+elif IMAGE_REQUESTS_PER_MINUTE_CEILING is not None:
+    IMAGE_RATE_LIMITER = RateLimiter(IMAGE_REQUESTS_PER_MINUTE_CEILING, IMAGE_REQUESTS_BURST)
+else:
+    IMAGE_RATE_LIMITER = None
+TEXT_RATE_LIMITER = RateLimiter(TEXT_REQUESTS_PER_MINUTE, TEXT_REQUESTS_BURST)
+
+# Process-wide image cache, shared by every run so repeated prompts are never paid for twice
+IMAGE_CACHE = ImageCache() if IMAGE_CACHE_ENABLED else None
+
+# Process-wide cache of text API responses (story and image prompts breakdown)
+RESPONSE_CACHE = create_response_cache()
+
+# Process-wide hedging threshold and budget, learned from the latencies of every image call
+IMAGE_HEDGING = HedgingPolicy() if IMAGE_HEDGING_ENABLED else None
+if IMAGE_HEDGING is not None:
+    METRICS.register_gauges("image_hedging", IMAGE_HEDGING.stats)
+
+
+def words_per_image_for_age(target_age):
+    """Return the story words illustrated by each image for the target age."""
+    if target_age <= 4:
+        return WORDS_PER_IMAGE_AGES_3_4  # More images for younger children
+    elif target_age <= 6:
+        return WORDS_PER_IMAGE_AGES_5_6  # Medium images for 5-6 year olds
+    else:
+        return WORDS_PER_IMAGE_AGES_7_PLUS  # Fewer images for older children (7+)
+
+
+def count_content_images(word_count, target_age):
+    """Return the number of content images (story pages) of a story of word_count words."""
+    return max(1, word_count // words_per_image_for_age(target_age)) + 1  # +1 for remaining words
+
+
+def generate_images(image_generator, image_prompts, max_workers=IMAGE_BOOK_WORKERS, on_image_ready=None, clear=True):
     """
-    Main function to generate story and images.
+    Generate all images concurrently on a bounded thread pool.
+
+    Workers are throttled by the process-wide image concurrency limit (and the generator's rate limiter, if any), and
+    each image is written to the output_{n}.png slot of the generator's images_dir given by its image_number.
+    An image that still fails after its retries is recorded in image_generator.failed_images and the
+    other images are kept; an error is only raised if every image failed.
+
+        Args:
+            image_generator (ImageGenerator): Generator used for the image API calls
+            image_prompts (list): List of {"image_number", "prompt"} dictionaries
+            max_workers (int): Maximum number of image API calls in flight
+            on_image_ready (callable): Optional callback(image_number, image_bytes) called from the
+                worker thread as soon as an image file has landed
+            clear (bool): Start from an empty images_dir, False to keep the images already generated by a resumed run
+
+    Returns:
+        dict: image_number (0-based) -> image bytes of the generated images
+    """
+    # Store all images in a new image directory
+    if clear and os.path.exists(image_generator.images_dir):
+        shutil.rmtree(image_generator.images_dir)
     
-            Args:
+    os.makedirs(image_generator.images_dir, exist_ok=True)
+
+    def _generate(image_prompt):
+        image_number = image_prompt.get('image_number', 1) - 1
+        image = image_generator.generate_image(
+            image_number=image_number,
+            prompt=image_prompt.get('prompt', 'No prompt available')
+        )
+        mark(image_generator.trace, "time_to_first_image")
+        if on_image_ready is not None:
+            on_image_ready(image_number, image)
+        return image_number, image
+
+    images, first_error = {}, None
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(_generate, image_prompt): image_prompt.get('image_number', 1) - 1 for image_prompt in image_prompts}
+        for future, image_number in futures.items():
+            try:
+                image_number, image = future.result()
+                images[image_number] = image
+            except Exception as e:
+                print(f"Error generating image {image_number}: {e}")
+                image_generator.failed_images[image_number] = str(e)
+                first_error = first_error or e
+
+    if first_error is not None and not images:
+        raise first_error
+    return images
+
+
+def generate_story_and_image_prompts(user_prompt, text_model, target_words, target_age, image_model, image_size, images_dir=IMAGES_DIR, image_store=None, trace=None, planning_mode=STORY_PLANNING_MODE, checkpoint=None):
+    """
+    Generate the story and break it down into image prompts, without generating the images.
+
+    In "two_call" planning mode the story is generated first and the number of images is derived from
+    its actual length, then a second call breaks it down into image prompts. In "single_call" mode the
+    number of images is derived from target_words and one call returns the story with its image prompts.
+
+        Args:
             user_prompt (str): The user's story prompt
             text_model (str): OpenAI model for text generation
             target_words (int): Target words for the story
             target_age (int): Target age group
             image_model (str): OpenAI model for image generation
             image_size (str): Size of generated images
-    
+            images_dir (str): Directory where the images will be written
+            image_store (ImageStore): Optional in-memory store receiving the image bytes
+            trace (Trace): Optional trace recording the API calls, their tokens and the image bytes
+            planning_mode (str): "two_call" or "single_call"
+            checkpoint (RunCheckpoint): Optional checkpoint of the run. The story and image prompts it already
+                holds are reused without any text call, otherwise the generated ones are saved to it
+
     Returns:
-        tuple: Formatted output for Gradio interface or dictionnary for PDF generation
+        tuple: (story, nb_images, image_generator, image_prompts)
     """
-    try:
-        print(f"📚 Generating story and images for user prompt: {user_prompt}...")
-        
-        # Generate a story
-        story_generator = StoryGenerator(
-            model=text_model, 
-            target_words=target_words, 
-            target_age=target_age
-        )
+    if planning_mode not in ("two_call", "single_call"):
+        raise ValueError(f"Unknown planning mode: {planning_mode}")
+
+    if checkpoint is not None and checkpoint.has_plan:
+        story, nb_images, image_prompts = checkpoint.data['story'], checkpoint.data['nb_images'], checkpoint.data['image_prompts']
+        print(f"♻️ Story and {len(image_prompts.get('image_prompts', []))} image prompts restored from run {checkpoint.run_id}: '{story.get('title', 'Untitled')}'")
+        image_generator = create_image_generator(story, nb_images, text_model, target_age, image_model, image_size, images_dir, image_store, trace)
+        return story, nb_images, image_generator, image_prompts
+
+    # Generate a story
+    story_generator = StoryGenerator(
+        model=text_model, 
+        target_words=target_words, 
+        target_age=target_age,
+        response_cache=RESPONSE_CACHE,
+        rate_limiter=TEXT_RATE_LIMITER,
+        trace=trace,
+        client=get_openai_client()
+    )
+    words_per_image = words_per_image_for_age(target_age)
+
+    if planning_mode == "single_call":
+        nb_images = count_content_images(target_words, target_age)
+        print(f"📊 Planning {nb_images} content images with {words_per_image} words per image for a {target_words} words story, target age {target_age}")
+        story_plan = story_generator.generate_story_plan(user_prompt=user_prompt, nb_images=nb_images, words_per_image=words_per_image)
+        story = {key: story_plan.get(key) for key in ('title', 'summary', 'story_content')}
+        image_prompts = {'image_prompts': story_plan['image_prompts']}
+        print(f"✅ Story and {len(image_prompts['image_prompts'])} image prompts generated: '{story.get('title', 'Untitled')}'")
+    else:
         story = story_generator.generate_story(user_prompt=user_prompt)
         print(f"✅ Story generated: '{story.get('title', 'Untitled')}'")
-        
+
         # Calculate number of images based on story length and target age
-        story_content = story.get('story_content', '')
-        word_count = len(story_content.split())
-        
-        # Adjust words per image based on target age
-        if target_age <= 4:
-            words_per_image = WORDS_PER_IMAGE_AGES_3_4  # More images for younger children
-        elif target_age <= 6:
-            words_per_image = WORDS_PER_IMAGE_AGES_5_6  # Medium images for 5-6 year olds
-        else:
-            words_per_image = WORDS_PER_IMAGE_AGES_7_PLUS  # Fewer images for older children (7+)
-        
-        nb_images = max(1, word_count // words_per_image) + 1  # +1 for remaining words
+        word_count = len(story.get('story_content', '').split())
+        nb_images = count_content_images(word_count, target_age)
         print(f"📊 Story has {word_count} words. Generating {nb_images} content images with {words_per_image} words per image for target age {target_age}")
-    
-        # Generate images prompts
-        image_generator = ImageGenerator(
-            image_model=image_model, 
-            text_model=text_model, 
-            nb_images=nb_images, 
-            size=image_size, 
-            target_age=target_age, 
-            title=story.get('title', 'Untitled'),
-            story_content=story.get('story_content', 'No story content available')
-        )
+
+    # Image generator, also breaking the story down into image prompts in two-call mode
+    image_generator = create_image_generator(story, nb_images, text_model, target_age, image_model, image_size, images_dir, image_store, trace)
+    if planning_mode == "two_call":
         image_prompts = image_generator.get_image_prompts()
-        image_prompts_list = [prompt_data.get('prompt', '') for prompt_data in image_prompts.get('image_prompts', [])]
+
+    if checkpoint is not None:
+        checkpoint.set_plan(story, nb_images, image_prompts)
+    return story, nb_images, image_generator, image_prompts
 
 
-        # Store all images in a new image directory
-        if os.path.exists(IMAGES_DIR):
-            os.system(f"rm -rf {IMAGES_DIR}")
-        
-        os.makedirs(IMAGES_DIR, exist_ok=True)
+def create_image_generator(story, nb_images, text_model, target_age, image_model, image_size, images_dir=IMAGES_DIR, image_store=None, trace=None):
+    """Return an ImageGenerator for a story, using the process-wide caches, rate limiters, client and hedging policy."""
+    return ImageGenerator(
+        image_model=image_model, 
+        text_model=text_model, 
+        nb_images=nb_images, 
+        size=image_size, 
+        target_age=target_age, 
+        title=story.get('title', 'Untitled'),
+        story_content=story.get('story_content', 'No story content available'),
+        image_cache=IMAGE_CACHE,
+        rate_limiter=IMAGE_RATE_LIMITER,
+        response_cache=RESPONSE_CACHE,
+        images_dir=images_dir,
+        text_rate_limiter=TEXT_RATE_LIMITER,
+        image_store=image_store,
+        trace=trace,
+        client=get_openai_client(),
+        hedging=IMAGE_HEDGING
+    )
 
 
-        # Generate images
-        for image_prompt in image_prompts.get('image_prompts', []):
-            add_rate_limiting_delay(IMAGE_GENERATION_DELAY)  # Use configurable delay
-            image_number = image_prompt.get('image_number', 1) - 1
-            image = image_generator.generate_image(
-                image_number=image_number, 
-                prompt=image_prompt.get('prompt', 'No prompt available')
-            )
-        print(f"✅ {len(image_prompts_list)} images generated")
+def print_image_cache_stats():
+    """Print the hit/miss counters of the shared image cache and the state of the shared OpenAI connection pool."""
+    if IMAGE_CACHE is not None:
+        cache_stats = IMAGE_CACHE.stats()
+        print(f"🗂️ Image cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['evictions']} evictions")
+    http_stats = pool_stats()
+    if http_stats.get('requests'):
+        print(f"🔌 OpenAI pool: {http_stats['requests']} requests over {http_stats['connections_opened']} new connections "
+              f"({http_stats['pool_connections']} open, {http_stats['pool_idle_connections']} idle)")
 
-        if output_format == "gradio":
-            # Return tuple useful for Gradio interface
-            return create_success_output(story, nb_images, image_prompts_list)
-        elif output_format == "dictionnary":
-            # Return a dictionnary with the story, the images and the image prompts more useful for formatting purposes
-            return create_success_output_dictionnary(story, nb_images, image_prompts_list)
 
+def generate_story_and_images(user_prompt, text_model, target_words, target_age, image_model, image_size, output_format="gradio", images_dir=IMAGES_DIR, planning_mode=STORY_PLANNING_MODE, run_id=None):
+    """
+    Main function to generate story and images.
 
-    except (ValueError, OpenAIError) as e:
-        print(f"Error: {e}")
-        return create_error_output(1, str(e))  # Default to 1 image for error case
+    When checkpoints are enabled, the story, image prompts and status of each image are saved to the
+    checkpoint of the run as they are produced, so a failed run can be finished with resume(run_id).
+    
+            Args:
+            user_prompt (str): The user's story prompt
+            text_model (str): OpenAI model for text generation
+            target_words (int): Target words for the story
+            target_age (int): Target age group
+            image_model (str): OpenAI model for image generation
+            image_size (str): Size of generated images
+            images_dir (str): Directory where the images are written
+            planning_mode (str): "two_call" or "single_call" (story and image prompts in one text call)
+            run_id (str): Id of the run checkpoint, a new one by default
     
+    Returns:
+        tuple: Formatted output for Gradio interface or dictionnary for PDF generation
+    """
+    request = _make_request(user_prompt, text_model, target_words, target_age, image_model, image_size, planning_mode)
+    checkpoint = _create_checkpoint(request, images_dir, run_id)
+    return _generate_story_and_images(request, output_format, images_dir, checkpoint)
+
+
+def resume(run_id, output_format="gradio"):
+    """
+    Finish a checkpointed run: the checkpointed story and image prompts are reused, and only the images
+    that failed or are missing are generated again.
+
+        Args:
+            run_id (str): Id of the run, printed when it started
+            output_format (str): "gradio" or "dictionnary", as for generate_story_and_images
+
+    Returns:
+        tuple: Formatted output for Gradio interface or dictionnary for PDF generation
+
+    Raises:
+        ValueError: If there is no checkpoint for run_id.
+    """
+    checkpoint = RunCheckpoint.load(run_id)
+    checkpoint.start_attempt()
+    print(f"📌 Resuming run {run_id} ({len(checkpoint.pending_image_prompts()) if checkpoint.has_plan else 'all'} images to generate)")
+    return _generate_story_and_images(checkpoint.request, output_format, checkpoint.images_dir, checkpoint, resumed=True)
+
+
+def _make_request(user_prompt, text_model, target_words, target_age, image_model, image_size, planning_mode):
+    """Return the request of a run, as saved in its checkpoint."""
+    return {
+        'user_prompt': user_prompt, 'text_model': text_model, 'target_words': target_words, 'target_age': target_age,
+        'image_model': image_model, 'image_size': image_size, 'planning_mode': planning_mode
+    }
+
+
+def _create_checkpoint(request, images_dir, run_id=None):
+    """Return a new checkpoint for the run of request, or None when checkpoints are disabled."""
+    if not CHECKPOINTS_ENABLED:
+        return None
+    checkpoint = RunCheckpoint.create(request, images_dir, run_id)
+    print(f"📌 Run {checkpoint.run_id} (resume it with resume('{checkpoint.run_id}') if it fails)")
+    return checkpoint
+
+
+def _generate_story_and_images(request, output_format, images_dir, checkpoint, resumed=False):
+    """Body of generate_story_and_images and resume: runs _run_story_and_images to the end and formats its outcome."""
+    for progress in _run_story_and_images(request, images_dir, checkpoint, resumed):
+        pass
+    if 'error' in progress:
+        return create_error_output(1, progress['error'])  # Default to 1 image for error case
+
+    if output_format == "gradio":
+        # Return tuple useful for Gradio interface
+        return create_success_output(progress['story'], progress['nb_images'], progress['image_prompts_list'], images_dir, progress['failed_images'])
+    elif output_format == "dictionnary":
+        # Return a dictionnary with the story, the images and the image prompts more useful for formatting purposes
+        return create_success_output_dictionnary(progress['story'], progress['nb_images'], progress['image_prompts_list'], images_dir, progress['failed_images'])
+
+
+def _run_story_and_images(request, images_dir, checkpoint, resumed=False, streaming=False):
+    """
+    Generate the story and images of request, yielding the progress of the run as it goes.
+
+    Shared by the blocking and streaming entry points: it records the trace of the run and its progress
+    in checkpoint (if any), and turns any error into a last {'error': message} progress. Otherwise it yields
+    a dictionary with the story, nb_images, image_prompts_list, ready_images (image numbers on disk) and
+    failed_images once the text calls return, again each time an image lands, and a last time with done=True.
+    A resumed run starts from the images of its checkpoint and only generates the missing ones.
+    """
+    user_prompt = request['user_prompt']
+    trace = Trace("story_and_images", user_prompt=user_prompt, text_model=request['text_model'], image_model=request['image_model'], images_dir=images_dir,
+                  planning_mode=request['planning_mode'], streaming=streaming, run_id=checkpoint.run_id if checkpoint else None, resumed=resumed) if TRACING_ENABLED else None
+    try:
+        print(f"📚 Generating story and images for user prompt: {user_prompt}...")
+
+        story, nb_images, image_generator, image_prompts = generate_story_and_image_prompts(
+            user_prompt, request['text_model'], request['target_words'], request['target_age'], request['image_model'], request['image_size'],
+            images_dir, trace=trace, planning_mode=request['planning_mode'], checkpoint=checkpoint
+        )
+        progress = {
+            'story': story, 'nb_images': nb_images,
+            'image_prompts_list': [prompt_data.get('prompt', '') for prompt_data in image_prompts.get('image_prompts', [])],
+            'ready_images': set(checkpoint.done_images()) if resumed else set(),
+            'failed_images': image_generator.failed_images, 'done': False
+        }
+        yield progress
+
+        # Images are generated concurrently in the background, throttled by the shared limiters, and each
+        # landed image number is handed over through the queue. A resumed run only redoes the missing ones
+        pending_prompts = checkpoint.pending_image_prompts() if resumed else image_prompts.get('image_prompts', [])
+        landed = queue.Queue()
+
+        def _on_image_ready(image_number, _):
+            if checkpoint is not None:
+                checkpoint.image_done(image_number, f"{images_dir}/output_{image_number}.png")
+            landed.put(("image", image_number))
+
+        def _generate():
+            try:
+                generate_images(image_generator, pending_prompts, on_image_ready=_on_image_ready, clear=not resumed)
+                event = ("done", None)
+            except Exception as e:
+                event = ("error", e)
+            if checkpoint is not None:
+                for image_number, error in image_generator.failed_images.items():
+                    checkpoint.image_failed(image_number, error)
+            landed.put(event)
+
+        threading.Thread(target=_generate, name="story-images", daemon=True).start()
+        while True:
+            event, value = landed.get()
+            if event == "error":
+                raise value
+            if event == "done":
+                break
+            progress['ready_images'].add(value)
+            yield progress
+
+        print(f"✅ {len(progress['ready_images'])} images generated" + (f", {len(image_generator.failed_images)} failed" if image_generator.failed_images else ""))
+        print_image_cache_stats()
+        finish_trace(trace, f"{images_dir}/{TRACE_FILE}")
+        if checkpoint is not None:
+            checkpoint.finish("partial" if image_generator.failed_images else "complete")
+        progress['done'] = True
+        yield progress
+
     except Exception as e:
-        print(f"Unexpected error: {e}")
-        return create_error_output(1, str(e))  # Default to 1 image for error case 
\ No newline at end of file
+        print(f"Error: {e}" if isinstance(e, (ValueError, OpenAIError)) else f"Unexpected error: {e}")
+        finish_trace(trace, f"{images_dir}/{TRACE_FILE}", error=e)
+        if checkpoint is not None:
+            checkpoint.finish("failed", error=e)
+        yield {'error': str(e)}
+
+
+def stream_story_and_images(user_prompt, text_model, target_words, target_age, image_model, image_size, images_dir=IMAGES_DIR, planning_mode=STORY_PLANNING_MODE):
+    """
+    Generate story and images for the Gradio interface, yielding the outputs as they become available.
+
+    The story and image prompts are yielded as soon as the text calls return, with no image, then the
+    outputs are yielded again each time an image lands, and a last time once every image is done.
+
+            Args:
+            user_prompt (str): The user's story prompt
+            text_model (str): OpenAI model for text generation
+            target_words (int): Target words for the story
+            target_age (int): Target age group
+            image_model (str): OpenAI model for image generation
+            image_size (str): Size of generated images
+            images_dir (str): Directory where the images are written
+            planning_mode (str): "two_call" or "single_call" (story and image prompts in one text call)
+
+    Yields:
+        tuple: Formatted output for Gradio interface
+    """
+    request = _make_request(user_prompt, text_model, target_words, target_age, image_model, image_size, planning_mode)
+    checkpoint = _create_checkpoint(request, images_dir)
+    for progress in _run_story_and_images(request, images_dir, checkpoint, streaming=True):
+        if 'error' in progress:
+            yield create_error_output(1, progress['error'])  # Default to 1 image for error case
+        else:
+            yield create_success_output(progress['story'], progress['nb_images'], progress['image_prompts_list'], images_dir, progress['failed_images'], progress['ready_images'])
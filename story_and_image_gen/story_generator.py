@@ -8,7 +8,6 @@ This module generates age-appropriate children's stories using OpenAI's GPT-4 mo
 import os
 import json
 from typing import Dict, Optional
-from dotenv import load_dotenv
 from openai import OpenAI, OpenAIError
 
 import sys
@@ -19,15 +18,23 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
-from story_prompts import STORY_BASE_PROMPT, USER_PROMPT_TEMPLATE, CREATE_STORY_SCHEMA
+try:
+    from story_prompts import STORY_BASE_PROMPT, USER_PROMPT_TEMPLATE, CREATE_STORY_SCHEMA
+except ImportError:
+    # Deployments ship story_prompts, the stand-in templates only serve the benchmark and tests without it
+    from prompts import STORY_BASE_PROMPT, USER_PROMPT_TEMPLATE, CREATE_STORY_SCHEMA
+from prompts import CREATE_STORY_PLAN_SCHEMA, STORY_PLAN_PROMPT
 from config import API_KEY_ENV_VAR
-from utils import add_rate_limiting_delay, create_error_output, create_success_output
+from utils import RateLimiter, add_rate_limiting_delay, create_error_output, create_success_output
+from response_cache import ResponseCache, create_tool_call
+from openai_client import get_openai_client
+from tracing import Trace, span
 
 
 class StoryGenerator:
     """Handles the generation of children's stories using OpenAI API."""
     
-    def __init__(self, model: str = "gpt-4.1", target_words: int = 150, target_age: int = 3, api_key: Optional[str] = None):
+    def __init__(self, model: str = "gpt-4.1", target_words: int = 150, target_age: int = 3, api_key: Optional[str] = None, response_cache: Optional[ResponseCache] = None, rate_limiter: Optional[RateLimiter] = None, trace: Optional[Trace] = None, client: Optional[OpenAI] = None):
         """
         Initialize the story generator.
         
@@ -36,19 +43,23 @@ class StoryGenerator:
             model: OpenAI model to be used
             target_words: target number of words in the story
             target_age: target age group for the story
+            response_cache: optional ResponseCache memoizing story responses
+            rate_limiter: optional RateLimiter acquired before each text API call
+            trace: optional Trace recording the story generation span and its token usage
+            client: OpenAI client to use, the process-wide pooled client if not provided
         """
 
         self.model = model
         self.target_words = target_words
         self.target_age = target_age
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        self.trace = trace
         
         # No prompt manager needed - using simple imports
 
-        load_dotenv()
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable.")
-        self.client = OpenAI(api_key=self.api_key)
+        # Share the pooled client (and its open connections) with the other generators
+        self.client = client if client is not None else get_openai_client(api_key)
 
     def _get_base_prompt(self) -> str:
         """Generate the base prompt for story creation."""
@@ -79,20 +90,21 @@ class StoryGenerator:
             # Use function schema from prompts module
             function_schema = CREATE_STORY_SCHEMA
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "user", "content": consolidated_prompt}
-                ],
-                tools=[function_schema],
-                tool_choice={"type": "function", "function": {"name": "create_story"}},
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            # Extract the function call response
-            tool_call = response.choices[0].message.tool_calls[0]
-            story_data = json.loads(tool_call.function.arguments)
+            with span(self.trace, "story_generation", model=self.model):
+                story_data = create_tool_call(
+                    self.client,
+                    self.response_cache,
+                    self.rate_limiter,
+                    self.trace,
+                    model=self.model,
+                    messages=[
+                        {"role": "user", "content": consolidated_prompt}
+                    ],
+                    tools=[function_schema],
+                    tool_choice={"type": "function", "function": {"name": "create_story"}},
+                    temperature=0.7,
+                    max_tokens=1000
+                )
             
             return story_data
         
@@ -101,6 +113,77 @@ class StoryGenerator:
         except Exception as e:
             raise ValueError(f"Unexpected error during story generation: {e}")
 
+    def generate_story_plan(self, user_prompt: str, nb_images: int, words_per_image: int) -> Dict:
+        """
+        Generate the story and the prompts of its images in a single call.
+
+        Saves the image prompts breakdown round trip, which resends the whole story, at the cost of
+        deciding the number of pages from target_words before the story is written.
+
+        Args:
+            user_prompt: the user's story prompt
+            nb_images: number of story pages (and content images)
+            words_per_image: words per page the story will be split into
+
+        Returns:
+            Dictionary containing the title, summary, story content and the image_prompts list
+            ({"image_number", "prompt"}, title page first and "The End" page last).
+
+        Raises:
+            OpenAIError: If there's an error with the OpenAI API call.
+            ValueError: If the response format is invalid.
+        """
+        total_images = nb_images + 2  # +1 for title page + 1 for "The End" page
+        try:
+            consolidated_prompt = (
+                self._get_base_prompt() +
+                "\n" + STORY_PLAN_PROMPT.format(
+                    nb_images=nb_images,
+                    words_per_image=words_per_image,
+                    total_images=total_images,
+                    last_page_image=nb_images + 1,
+                    target_age=self.target_age
+                ) +
+                "\n" + USER_PROMPT_TEMPLATE.format(user_prompt=user_prompt)
+            )
+
+            with span(self.trace, "story_planning", model=self.model, nb_images=nb_images):
+                story_plan = create_tool_call(
+                    self.client,
+                    self.response_cache,
+                    self.rate_limiter,
+                    self.trace,
+                    model=self.model,
+                    messages=[
+                        {"role": "user", "content": consolidated_prompt}
+                    ],
+                    tools=[CREATE_STORY_PLAN_SCHEMA],
+                    tool_choice={"type": "function", "function": {"name": "create_story_plan"}},
+                    temperature=0.7,
+                    max_tokens=1000 + 150 * total_images,  # Story plus about 150 tokens per image prompt
+                    validate=lambda story_plan: _validate_story_plan(story_plan, total_images)
+                )
+
+            story_plan['image_prompts'] = sorted(story_plan['image_prompts'], key=lambda prompt_data: prompt_data['image_number'])
+            return story_plan
+
+        except OpenAIError as e:
+            raise OpenAIError(f"Error generating story plan: {e}")
+        except Exception as e:
+            raise ValueError(f"Unexpected error during story planning: {e}")
+
+
+def _validate_story_plan(story_plan: Dict, total_images: int):
+    """Raise ValueError unless the plan has exactly total_images image prompts numbered 1 to total_images."""
+    image_prompts = story_plan.get('image_prompts')
+    if not isinstance(image_prompts, list):
+        raise ValueError("the story plan has no image_prompts list")
+    # Every page needs its image: exactly total_images prompts numbered 1 to total_images
+    if len(image_prompts) != total_images:
+        raise ValueError(f"the story plan has {len(image_prompts)} image prompts instead of {total_images}")
+    image_numbers = sorted(prompt_data.get('image_number') for prompt_data in image_prompts if isinstance(prompt_data, dict) and isinstance(prompt_data.get('image_number'), int))
+    if image_numbers != list(range(1, total_images + 1)):
+        raise ValueError(f"the story plan image prompts are not numbered 1 to {total_images}")
 
 
 def test():
@@ -118,4 +201,5 @@ def test():
     story_data = story_generator.generate_story(USER_PROMPT)
     print(story_data)
 
-test()
\ No newline at end of file
+if __name__ == "__main__":
+    test()
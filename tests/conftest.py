@@ -0,0 +1,9 @@
+"""Make the root modules and the story_and_image_gen / book_format modules importable, like the scripts do."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'story_and_image_gen'), os.path.join(ROOT, 'book_format')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
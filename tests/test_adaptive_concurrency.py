@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from adaptive_concurrency import AdaptiveConcurrencyLimiter, parse_duration
+
+
+def limiter(initial=4, max_limit=16, **kwargs):
+    kwargs.setdefault("decrease_interval", 0)
+    return AdaptiveConcurrencyLimiter("Test", initial, max_limit, min_limit=1, decrease_factor=0.5, headroom=0.1, **kwargs)
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("1s", 1), ("6m0s", 360), ("20ms", 0.02), ("1h2m3.5s", 3723.5), ("0.5", 0.5), ("30", 30),
+    (None, None), ("", None), ("soon", None),
+])
+def test_parse_duration(value, seconds):
+    if seconds is None:
+        assert parse_duration(value) is None
+    else:
+        assert parse_duration(value) == pytest.approx(seconds)
+
+
+def test_limit_only_grows_when_it_was_binding():
+    controller = limiter()
+    for _ in range(20):
+        with controller.slot() as limit_bound:
+            assert not limit_bound
+            controller.on_response(200, {}, limit_bound)
+    assert controller.stats()["limit"] == 4
+
+    bound = [controller.acquire() for _ in range(4)]
+    assert bound == [False, False, False, True]
+    controller.on_response(200, {}, limit_bound=True)
+    assert controller.limit == pytest.approx(4.25)
+    for _ in range(4):
+        controller.release()
+
+
+def test_limit_is_capped_at_max_limit():
+    controller = limiter(initial=4, max_limit=5)
+    for _ in range(100):
+        controller.on_response(200, {}, limit_bound=True)
+    assert controller.stats()["limit"] == 5
+
+
+def test_429_cuts_the_limit_once_per_interval():
+    controller = limiter(initial=8, decrease_interval=60)
+    controller.on_response(429, {})
+    controller.on_response(429, {})
+    stats = controller.stats()
+    assert (stats["limit"], stats["throttled"], stats["decreases"]) == (4, 2, 1)
+
+    controller = limiter(initial=1)
+    controller.on_response(429, {})
+    assert controller.stats()["limit"] == 1
+
+
+def test_other_errors_leave_the_limit_alone():
+    controller = limiter()
+    controller.on_response(500, {}, limit_bound=True)
+    controller.on_response(400, {"x-ratelimit-remaining-requests": "0", "x-ratelimit-limit-requests": "100"}, limit_bound=True)
+    assert controller.limit == 4
+    assert controller.stats()["throttled"] == 0
+
+
+def test_remaining_quota_under_headroom_cuts_the_limit():
+    controller = limiter(initial=8)
+    controller.on_response(200, {"x-ratelimit-remaining-requests": "50", "x-ratelimit-limit-requests": "100",
+                                 "x-ratelimit-remaining-tokens": "500", "x-ratelimit-limit-tokens": "10000"}, limit_bound=True)
+    assert controller.stats()["limit"] == 4
+
+    controller = limiter(initial=8)
+    controller.on_response(200, {"x-ratelimit-remaining-requests": "50", "x-ratelimit-limit-requests": "100"}, limit_bound=True)
+    assert controller.limit == pytest.approx(8.125)
+
+
+def test_retry_after_pauses_new_calls():
+    controller = limiter()
+    controller.on_response(429, {"retry-after": "0.2"})
+    assert controller.stats()["paused_seconds"] == pytest.approx(0.2, abs=0.01)
+    started = time.monotonic()
+    with controller.slot():
+        pass
+    assert time.monotonic() - started >= 0.15
+
+
+def test_exhausted_quota_pauses_until_its_reset():
+    controller = limiter()
+    controller.on_response(200, {"x-ratelimit-remaining-requests": "0", "x-ratelimit-limit-requests": "100",
+                                 "x-ratelimit-reset-requests": "150ms"})
+    stats = controller.stats()
+    assert stats["limit"] == 2
+    assert stats["paused_seconds"] == pytest.approx(0.15, abs=0.01)
+
+
+def test_transport_holds_the_slot_until_the_response_is_closed(monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    openai_client = pytest.importorskip("openai_client")
+    controller = limiter(initial=1)
+    monkeypatch.setattr(openai_client, "IMAGE_CONCURRENCY", controller)
+    monkeypatch.setattr(httpx.HTTPTransport, "handle_request", lambda self, request: httpx.Response(200, stream=httpx.ByteStream(b"image")))
+
+    transport = openai_client.InstrumentedTransport()
+    response = transport.handle_request(httpx.Request("POST", "https://api.openai.com/v1/images/generations"))
+    assert controller.stats()["in_flight"] == 1
+    assert response.read() == b"image"
+    response.close()
+    assert controller.stats()["in_flight"] == 0
+    assert transport.stats()["in_flight"] == 0
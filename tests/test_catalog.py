@@ -0,0 +1,74 @@
+import os
+import sqlite3
+
+import pytest
+
+import catalog
+from catalog import BookCatalog, get_book_catalog
+
+REQUEST = {'user_prompt': "A bubble in the garden", 'text_model': "gpt", 'image_model': "img", 'image_size': "1024x1024", 'target_words': 300, 'target_age': 5}
+
+
+class TrackedConnection(sqlite3.Connection):
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+@pytest.fixture
+def book_catalog(tmp_path):
+    return BookCatalog(str(tmp_path / "catalog.sqlite3"), str(tmp_path / "blobs"))
+
+
+def _story(tmp_path):
+    images = []
+    for image_number in range(3):
+        path = tmp_path / f"output_{image_number}.png"
+        path.write_bytes(b"png %d" % image_number)
+        images.append(str(path))
+    return {'title': "Benny the Bubble", 'story_content': "Benny floated.", 'images': images}
+
+
+def test_add_get_and_find_books(book_catalog, tmp_path):
+    book_id = book_catalog.add_book(_story(tmp_path), REQUEST, image_prompts=["title", "page", "the end"])
+    book = book_catalog.get_book(book_id)
+    assert book['title'] == "Benny the Bubble"
+    assert book['status'] == 'ok'
+    assert [image['prompt'] for image in book['images']] == ["title", "page", "the end"]
+    assert [found['book_id'] for found in book_catalog.find_books(title="benny")] == [book_id]
+    assert book_catalog.find_books(prompt="a dog") == []
+    with pytest.raises(ValueError):
+        book_catalog.get_book("missing")
+
+    story_dict = book_catalog.restore_story(book_id, str(tmp_path / "restored"))
+    assert [open(path, 'rb').read() for path in story_dict['images']] == [b"png 0", b"png 1", b"png 2"]
+
+
+def test_catalog_closes_its_connections(tmp_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracked_connect(*args, **kwargs):
+        opened.append(connect(*args, factory=TrackedConnection, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(sqlite3, "connect", tracked_connect)
+    book_catalog = BookCatalog(str(tmp_path / "catalog.sqlite3"), str(tmp_path / "blobs"))
+    book_id = book_catalog.add_book(_story(tmp_path), REQUEST)
+    book_catalog.get_book(book_id)
+    book_catalog.find_books(title="Benny")
+    with pytest.raises(ValueError):
+        book_catalog.get_book("missing")
+    assert len(opened) == 5
+    assert all(conn.closed for conn in opened)
+
+
+def test_book_catalog_is_opened_on_first_use(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(catalog, "_catalog", None)
+    assert not os.path.exists(catalog.CATALOG_PATH)
+    shared = get_book_catalog()
+    assert os.path.exists(catalog.CATALOG_PATH)
+    assert get_book_catalog() is shared
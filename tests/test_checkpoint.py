@@ -0,0 +1,45 @@
+import os
+import time
+
+from checkpoint import RunCheckpoint, cleanup_checkpoints
+
+REQUEST = {'user_prompt': "a bubble", 'planning_mode': "two_call"}
+IMAGE_PROMPTS = {'image_prompts': [{'image_number': 1, 'prompt': "title"}, {'image_number': 2, 'prompt': "page"}, {'image_number': 3, 'prompt': "the end"}]}
+
+
+def _age(checkpoint, seconds):
+    past = time.time() - seconds
+    os.utime(checkpoint.path, (past, past))
+
+
+def test_resume_redoes_only_failed_or_missing_images(tmp_path):
+    images_dir = tmp_path / "images"
+    images_dir.mkdir()
+    checkpoint = RunCheckpoint.create(REQUEST, str(images_dir), runs_dir=str(tmp_path / "runs"))
+    checkpoint.set_plan({'title': "Benny"}, 1, IMAGE_PROMPTS)
+    (images_dir / "output_0.png").write_bytes(b"png")
+    checkpoint.image_done(0, str(images_dir / "output_0.png"))
+    checkpoint.image_done(1, str(images_dir / "output_1.png"))  # File never reached the disk
+    checkpoint.image_failed(2, "timeout")
+
+    loaded = RunCheckpoint.load(checkpoint.run_id, runs_dir=str(tmp_path / "runs"))
+    assert loaded.has_plan
+    assert [prompt['image_number'] for prompt in loaded.pending_image_prompts()] == [2, 3]
+    assert loaded.done_images() == {0: str(images_dir / "output_0.png")}
+    assert loaded.failed_images() == {2: "timeout"}
+
+
+def test_cleanup_deletes_manifests_of_deleted_workspaces(tmp_path):
+    runs_dir = str(tmp_path / "runs")
+    kept_dir, deleted_dir = tmp_path / "kept" / "images", tmp_path / "deleted" / "images"
+    kept_dir.mkdir(parents=True)
+    kept = RunCheckpoint.create(REQUEST, str(kept_dir), runs_dir=runs_dir)
+    orphan = RunCheckpoint.create(REQUEST, str(deleted_dir), runs_dir=runs_dir)
+    recent_orphan = RunCheckpoint.create(REQUEST, str(deleted_dir), runs_dir=runs_dir)
+    expired = RunCheckpoint.create(REQUEST, str(kept_dir), runs_dir=runs_dir)
+    for checkpoint, seconds in ((kept, 7200), (orphan, 7200), (recent_orphan, 60), (expired, 30 * 24 * 3600)):
+        _age(checkpoint, seconds)
+
+    assert cleanup_checkpoints(3600, runs_dir=runs_dir, keep_max_age=7 * 24 * 3600) == 2
+    assert sorted(os.listdir(runs_dir)) == sorted(os.path.basename(checkpoint.path) for checkpoint in (kept, recent_orphan))
+    assert cleanup_checkpoints(3600, runs_dir=str(tmp_path / "missing")) == 0
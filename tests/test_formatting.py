@@ -0,0 +1,11 @@
+import pytest
+
+formatting = pytest.importorskip("formatting")
+
+
+def test_render_pool_is_shared_and_restarted_after_shutdown():
+    pool = formatting.get_render_pool()
+    assert formatting.get_render_pool() is pool
+    formatting.shutdown_render_pool()
+    assert formatting.get_render_pool() is not pool
+    formatting.shutdown_render_pool()
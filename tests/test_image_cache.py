@@ -0,0 +1,29 @@
+import os
+
+from image_cache import ImageCache
+
+
+def test_fetch_counts_a_hit_only_once_linked(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=10 ** 6)
+    destination = str(tmp_path / "output_0.png")
+    assert not cache.fetch("a", destination)
+    cache.put("a", b"png")
+    assert cache.fetch("a", destination)
+    assert open(destination, "rb").read() == b"png"
+
+    os.remove(cache._path("a"))  # Evicted between two lookups
+    assert not cache.fetch("a", destination)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_size_cap_counts_entries_of_other_processes(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    first, second = ImageCache(cache_dir, max_bytes=25), ImageCache(cache_dir, max_bytes=25)
+    first.put("a", b"x" * 10)
+    os.utime(first._path("a"), (1, 1))  # Least recently used
+    second.put("b", b"x" * 10)
+    first.put("c", b"x" * 10)
+    assert sorted(os.listdir(cache_dir)) == [f"{key}.png" for key in ("b", "c")]
+    assert first.stats()["bytes"] == 20
+    assert first.stats()["evictions"] == 1
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from config import IMAGE_STORE_WRITERS
+from image_store import ImageStore
+
+
+def test_put_get_and_memory_urls(tmp_path):
+    store = ImageStore(persist=False)
+    path = str(tmp_path / "output_1.png")
+    assert store.put(path, b"png") == f"memory:{path}"
+    assert store.get(path) == b"png"
+    assert path in store
+    assert store.src_for(path) == f"memory:{path}"
+    assert store.src_for("missing.png") == "missing.png"
+    assert store.subset([path, "missing.png", None]) == {f"memory:{path}": b"png"}
+    assert not (tmp_path / "output_1.png").exists()
+
+
+def test_write_behind_reaches_disk_on_flush(tmp_path):
+    store = ImageStore(persist=True)
+    path = tmp_path / "images" / "output_1.png"
+    store.put(str(path), b"png")
+    store.put(str(tmp_path / "skipped.png"), b"png", write=False)
+    store.flush()
+    assert path.read_bytes() == b"png"
+    assert not (tmp_path / "skipped.png").exists()
+
+
+def test_stores_share_a_bounded_writer_pool(tmp_path):
+    for book in range(10):
+        store = ImageStore(persist=True)
+        store.put(str(tmp_path / f"book_{book}.png"), b"png")
+        store.flush()
+    writers = [thread for thread in threading.enumerate() if thread.name.startswith("image-store-writer")]
+    assert 1 <= len(writers) <= IMAGE_STORE_WRITERS
+
+
+def test_writes_replace_the_file_atomically(tmp_path):
+    path = tmp_path / "output_1.png"
+    path.write_bytes(b"old")
+    store = ImageStore(persist=True)
+    store.put(str(path), b"new")
+    store.flush()
+    assert path.read_bytes() == b"new"
+    assert [entry.name for entry in tmp_path.iterdir()] == ["output_1.png"]  # No temporary file left behind
+
+
+def test_on_written_waits_for_the_write(tmp_path, monkeypatch):
+    release = threading.Event()
+    write = ImageStore._write
+
+    def slow_write(path, image_bytes):
+        release.wait(10)
+        write(path, image_bytes)
+
+    monkeypatch.setattr(ImageStore, "_write", staticmethod(slow_write))
+    store = ImageStore(persist=True)
+    path = tmp_path / "output_1.png"
+    store.put(str(path), b"png")
+    on_disk = []
+    store.on_written(str(path), lambda: on_disk.append(path.exists()))
+    assert on_disk == []
+    release.set()
+    store.flush()
+    assert on_disk == [True]
+
+    store.on_written(str(path), lambda: on_disk.append("again"))  # Already on disk, called right away
+    assert on_disk == [True, "again"]
+
+
+def test_on_written_is_skipped_when_the_write_fails(tmp_path):
+    store = ImageStore(persist=True)
+    (tmp_path / "file").write_bytes(b"")
+    path = str(tmp_path / "file" / "output_1.png")  # Its directory is a file
+    store.put(path, b"png")
+    called = []
+    store.on_written(path, lambda: called.append(path))
+    with pytest.raises(OSError):
+        store.flush()
+    assert called == []
+
+
+def test_on_written_needs_a_persisted_store(tmp_path):
+    with pytest.raises(ValueError):
+        ImageStore(persist=False).on_written(str(tmp_path / "output_1.png"), lambda: None)
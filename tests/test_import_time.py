@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from import_time_check import HEAVY_MODULES, import_times  # noqa: E402
+
+
+def test_cli_does_not_import_heavy_modules():
+    times = import_times("cli")
+    assert "cli" in times
+    assert sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES) == []
+
+
+def test_import_time_check_passes():
+    result = subprocess.run([sys.executable, os.path.join(ROOT, "benchmarks", "import_time_check.py")], capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
@@ -0,0 +1,85 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from config import TARGET_AGE_MIN, TARGET_WORDS_MAX
+from job_api import BookJobs, JobAPIServer, JobQueueFull, parse_book_request
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    release = threading.Event()
+    # Jobs stay queued until the test ends instead of running the pipeline
+    monkeypatch.setattr(BookJobs, "_run", lambda self, job: release.wait(10))
+    jobs = BookJobs(max_books=1, max_queued=3, jobs_dir=str(tmp_path / "jobs"))
+    yield jobs
+    release.set()
+    jobs.shutdown()
+
+
+@pytest.fixture
+def server(jobs):
+    server = JobAPIServer(jobs, host="127.0.0.1", port=0)
+    server.start()
+    yield server
+    server.stop()
+
+
+def _post(server, body, headers):
+    connection = http.client.HTTPConnection(server.host, server.port, timeout=10)
+    try:
+        connection.putrequest("POST", "/books")
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_concurrent_submissions_respect_the_queued_cap(jobs):
+    results = []
+    start = threading.Barrier(12)
+
+    def submit():
+        start.wait()
+        try:
+            results.append(jobs.submit({'prompt': "a bubble"}).job_id)
+        except JobQueueFull:
+            results.append(None)
+
+    threads = [threading.Thread(target=submit) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len([job_id for job_id in results if job_id is not None]) == 3
+    assert jobs.counts()['queued'] == 3
+
+
+def test_post_validates_the_content_length(server):
+    body = json.dumps({'prompt': "a bubble"}).encode("utf-8")
+    assert _post(server, body, {"Content-Length": str(len(body))})[0] == 202
+    assert _post(server, body, {"Content-Length": "lots"}) == (400, {"error": "Invalid Content-Length header"})
+    assert _post(server, body, {"Content-Length": "-5"})[0] == 400
+    status, payload = _post(server, b"", {"Content-Length": str(10 ** 9)})
+    assert status == 413
+    assert "larger than" in payload['error']
+    assert _post(server, b"{", {"Content-Length": "1"}) == (400, {"error": "Invalid JSON body"})
+
+
+@pytest.mark.parametrize("field, value", [
+    ("target_words", 1000000), ("target_words", 0), ("target_words", True), ("target_words", "300"),
+    ("target_age", 99), ("target_age", 1),
+])
+def test_parse_book_request_bounds_the_story(field, value):
+    with pytest.raises(ValueError, match=field):
+        parse_book_request({'prompt': "a bubble", field: value})
+
+
+def test_parse_book_request_accepts_the_bounds():
+    request = parse_book_request({'prompt': " a bubble ", 'target_words': TARGET_WORDS_MAX, 'target_age': TARGET_AGE_MIN})
+    assert (request['user_prompt'], request['target_words'], request['target_age']) == ("a bubble", TARGET_WORDS_MAX, TARGET_AGE_MIN)
@@ -0,0 +1,132 @@
+import pytest
+
+import workers
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return workers.open_queue(str(tmp_path / "queue.sqlite3"))
+
+
+def test_claim_takes_the_oldest_available_job(queue):
+    assert queue.claim("image", "w1") is None
+    first = queue.enqueue("image", {'image_number': 0}, "book")
+    queue.enqueue("image", {'image_number': 1}, "book", delay=3600)
+    queue.enqueue("text", {}, "book")
+
+    job = queue.claim("image", "w1")
+    assert (job['job_id'], job['payload'], job['attempts']) == (first, {'image_number': 0}, 1)
+    assert queue.claim("image", "w2") is None  # Claimed by w1, and the other one is delayed
+    assert queue.stats() == {"image": {"running": 1, "queued": 1}, "text": {"queued": 1}}
+
+
+def test_expired_lease_is_taken_over(queue):
+    job_id = queue.enqueue("image", {}, "book")
+    queue.claim("image", "w1", lease=-1)  # Its worker died, the lease is already over
+
+    job = queue.claim("image", "w2")
+    assert (job['job_id'], job['attempts']) == (job_id, 2)
+    assert not queue.extend_lease(job_id, "w1")
+    assert queue.extend_lease(job_id, "w2")
+
+
+def test_finish_is_refused_after_a_takeover(queue):
+    job_id = queue.enqueue("image", {}, "book")
+    queue.claim("image", "w1", lease=-1)
+    queue.claim("image", "w2")
+    followed_up = []
+
+    assert not queue.finish(job_id, "w1", follow_up=followed_up.append)
+    assert not queue.retry(job_id, "w1", "late", 0)
+    assert followed_up == []
+    assert queue.book_jobs("book")[0]['status'] == "running"
+
+    assert queue.finish(job_id, "w2", follow_up=followed_up.append)
+    assert len(followed_up) == 1
+    assert queue.book_jobs("book")[0]['status'] == "done"
+
+
+def test_read_connection_sees_committed_rows(queue, tmp_path):
+    book_id = workers.submit_book({'user_prompt': "a bubble"}, books_dir=str(tmp_path / "books"), queue=queue)
+    with queue.read() as conn:
+        assert conn.execute("SELECT status FROM queued_books WHERE book_id = ?", (book_id,)).fetchone()['status'] == "queued"
+    assert workers.load_book(queue, book_id)['request']['user_prompt'] == "a bubble"
+    with pytest.raises(ValueError):
+        workers.load_book(queue, "missing")
+
+
+def test_render_is_enqueued_exactly_once(queue, tmp_path, monkeypatch):
+    book_id = workers.submit_book({'user_prompt': "a bubble"}, books_dir=str(tmp_path / "books"), queue=queue)
+    with queue.transaction() as conn:
+        for image_number in range(12):
+            JobQueue.enqueue_in(conn, "image", {'image_number': image_number, 'prompt': "p"}, book_id)
+    attempts = []
+
+    def run_image_job(job, book, trace):
+        attempts.append(job['payload']['image_number'])
+        if job['payload']['image_number'] == 5:
+            raise RuntimeError("content policy")
+        return lambda conn: workers._enqueue_render_when_images_done(conn, book['book_id'])
+
+    monkeypatch.setitem(workers.STAGE_HANDLERS, "image", run_image_job)
+    processed = workers.run_worker("image", concurrency=4, queue_path=queue.path, poll_interval=0.01, idle_timeout=0.2)
+
+    assert processed == 12
+    assert sorted(attempts) == list(range(12))  # The failed image job is not queued again
+    image_jobs = queue.book_jobs(book_id, "image")
+    assert [job['status'] for job in image_jobs].count("failed") == 1
+    render_jobs = queue.book_jobs(book_id, "render")
+    assert len(render_jobs) == 1
+    assert render_jobs[0]['payload'] == {'failed_images': {'5': "content policy"}}
+    assert workers.load_book(queue, book_id)['status'] == "rendering"
+
+
+def _book_with_image_jobs(queue, tmp_path, nb_images):
+    book_id = workers.submit_book({'user_prompt': "a bubble"}, books_dir=str(tmp_path / "books"), queue=queue)
+    with queue.transaction() as conn:
+        for image_number in range(nb_images):
+            JobQueue.enqueue_in(conn, "image", {'image_number': image_number, 'prompt': "p"}, book_id)
+        workers._update_book(conn, book_id, status='images')
+    return book_id
+
+
+def test_render_is_enqueued_when_the_last_image_result_is_dropped(queue, tmp_path, monkeypatch):
+    book_id = _book_with_image_jobs(queue, tmp_path, 1)
+    job = queue.claim("image", "w1", lease=-1)
+
+    def run_image_job(job, book, trace):
+        # Meanwhile its lease expired, and the worker that took it over finished it without following up
+        taken_over = queue.claim("image", "w2")
+        assert queue.finish(taken_over['job_id'], "w2")
+        return lambda conn: workers._enqueue_render_when_images_done(conn, book['book_id'])
+
+    monkeypatch.setitem(workers.STAGE_HANDLERS, "image", run_image_job)
+    workers._run_job(queue, "image", job, "w1", max_attempts=3, lease=60)
+    assert len(queue.book_jobs(book_id, "render")) == 1
+    assert workers.load_book(queue, book_id)['status'] == "rendering"
+
+
+def test_render_worker_sweeps_books_left_without_a_render(queue, tmp_path, monkeypatch):
+    book_id = _book_with_image_jobs(queue, tmp_path, 2)
+    for worker in ("w1", "w2"):
+        job = queue.claim("image", worker)
+        assert queue.finish(job['job_id'], worker)  # Finished without enqueueing the render
+    waiting_id = _book_with_image_jobs(queue, tmp_path, 1)
+
+    assert workers.enqueue_ready_renders(queue) == 1
+    assert workers.enqueue_ready_renders(queue) == 0
+    assert len(queue.book_jobs(book_id, "render")) == 1
+    assert queue.book_jobs(waiting_id, "render") == []
+
+    rendered = []
+    monkeypatch.setitem(workers.STAGE_HANDLERS, "render", lambda job, book, trace: rendered.append(book['book_id']))
+    workers.run_worker("render", concurrency=2, queue_path=queue.path, poll_interval=0.01, idle_timeout=0.1)
+    assert rendered == [book_id]
+
+
+def test_journal_mode(tmp_path):
+    with JobQueue(str(tmp_path / "shared.sqlite3")).read() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    with JobQueue(str(tmp_path / "local.sqlite3"), journal_mode="WAL").read() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
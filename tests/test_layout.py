@@ -0,0 +1,82 @@
+import itertools
+import subprocess
+
+import pytest
+
+import layout
+from config import FORMAT_OPTIONS
+from layout import PageLayout, page_font_file
+
+SENTENCES = [
+    "Benny the bubble woke up early.",
+    "He floated over the garden, past the roses!",
+    "“Where are you going?” asked the bee.",
+    "“To see the big blue sky,” said Benny.",
+    "Mr. Snail waved from his leaf — slowly, of course.",
+    "The wind carried Benny higher and higher?",
+    "He saw the pond, the trees and the little red house.",
+    "At last he met a cloud…",
+    "They became the best of friends.",
+    "And every morning they played together in the sun.",
+]
+STORY = " ".join(SENTENCES)
+
+
+@pytest.fixture
+def page_layout():
+    return PageLayout(FORMAT_OPTIONS)
+
+
+def test_pages_keep_the_text_and_punctuation(page_layout):
+    pages = page_layout.paginate(STORY, 4)
+    assert " ".join(pages) == STORY
+    assert all(page[-1] in ".!?…" for page in pages)
+    assert any("“Where are you going?”" in page for page in pages)
+    assert not any(page.endswith("Mr.") for page in pages)
+
+
+def test_page_count_and_sentence_breaks(page_layout):
+    for nb_pages in range(1, len(SENTENCES) + 1):
+        pages = page_layout.paginate(STORY, nb_pages)
+        assert len(pages) == nb_pages
+        assert all(pages)
+        assert all(any(page.startswith(sentence) for sentence in SENTENCES) for page in pages)
+
+
+def test_fullest_page_is_as_short_as_possible(page_layout):
+    nb_pages = 4
+    pages = page_layout.paginate(STORY, nb_pages)
+    fewest = min(
+        max(page_layout.count_lines(" ".join(SENTENCES[i:j])) for i, j in zip((0,) + breaks, breaks + (len(SENTENCES),)))
+        for breaks in itertools.combinations(range(1, len(SENTENCES)), nb_pages - 1)
+    )
+    assert max(page_layout.count_lines(page) for page in pages) == fewest
+
+
+def test_short_stories(page_layout):
+    assert page_layout.paginate("", 3) == ["", "", ""]
+    assert page_layout.paginate(STORY, 0) == []
+    assert page_layout.paginate("Benny floated away.", 3) == ["Benny", "floated", "away."]
+    assert page_layout.paginate("Once upon a time, Benny floated.", 2) == ["Once upon a time,", "Benny floated."]
+
+
+def test_page_font_file_asks_fontconfig_for_the_css_fonts(monkeypatch):
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(args)
+        return subprocess.CompletedProcess(args, 0, stdout="/fonts/ComicSansMSBold.ttf")
+
+    monkeypatch.setattr(layout.subprocess, "run", run)
+    css = 'body { font-family: "Comic Sans MS", "Arial-Rounded", sans-serif; }'
+    assert page_font_file.__wrapped__(css) == "/fonts/ComicSansMSBold.ttf"
+    assert calls[0][-1] == "Comic Sans MS,Arial\\-Rounded,sans\\-serif:bold"
+
+
+def test_page_font_file_without_fontconfig(monkeypatch):
+    def run(args, **kwargs):
+        raise FileNotFoundError(args[0])
+
+    monkeypatch.setattr(layout.subprocess, "run", run)
+    assert page_font_file.__wrapped__('body { font-family: "Arial"; }') is None
+    assert page_font_file.__wrapped__("body { color: red; }") is None
@@ -0,0 +1,134 @@
+import json
+import time
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from response_cache import ResponseCache, MemoryResponseCache, SQLiteResponseCache, create_response_cache, create_tool_call
+
+
+def test_response_cache_is_abstract():
+    with pytest.raises(TypeError):
+        ResponseCache()
+
+
+def test_make_key_ignores_field_order():
+    assert ResponseCache.make_key(model="m", temperature=0.7) == ResponseCache.make_key(temperature=0.7, model="m")
+    assert ResponseCache.make_key(model="m") != ResponseCache.make_key(model="n")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache_factory(request, tmp_path):
+    def factory(**kwargs):
+        if request.param == "memory":
+            return MemoryResponseCache(**kwargs)
+        return SQLiteResponseCache(str(tmp_path / "responses.sqlite3"), **kwargs)
+    return factory
+
+
+def test_get_set_and_stats(cache_factory):
+    cache = cache_factory()
+    assert cache.get("a") is None
+    cache.set("a", {"title": "Benny"})
+    assert cache.get("a") == {"title": "Benny"}
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_expired_entries_are_misses(cache_factory):
+    cache = cache_factory(ttl=0.01)
+    cache.set("a", [1, 2])
+    time.sleep(0.05)
+    assert cache.get("a") is None
+
+
+def test_least_recently_used_entries_are_evicted(cache_factory):
+    cache = cache_factory(max_entries=2)
+    cache.set("a", 1)
+    time.sleep(0.01)
+    cache.set("b", 2)
+    time.sleep(0.01)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    time.sleep(0.01)
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_sqlite_cache_is_shared_across_instances(tmp_path):
+    path = str(tmp_path / "responses.sqlite3")
+    SQLiteResponseCache(path).set("a", {"x": 1})
+    assert SQLiteResponseCache(path).get("a") == {"x": 1}
+
+
+class TrackedConnection(sqlite3.Connection):
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def test_sqlite_cache_closes_its_connections(tmp_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracked_connect(*args, **kwargs):
+        opened.append(connect(*args, factory=TrackedConnection, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(sqlite3, "connect", tracked_connect)
+    cache = SQLiteResponseCache(str(tmp_path / "responses.sqlite3"))
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    assert len(opened) == 4
+    assert all(conn.closed for conn in opened)
+
+
+def test_create_response_cache_backends(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert create_response_cache(None) is None
+    assert isinstance(create_response_cache("memory"), MemoryResponseCache)
+    assert isinstance(create_response_cache("sqlite"), SQLiteResponseCache)
+    with pytest.raises(ValueError):
+        create_response_cache("redis")
+
+
+class FakeChatClient:
+    """Returns one chat completion per queued function-arguments dictionary."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.calls += 1
+        arguments = json.dumps(self.responses.pop(0))
+        tool_call = SimpleNamespace(function=SimpleNamespace(arguments=arguments))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(tool_calls=[tool_call]))], usage=None)
+
+
+def _require_pages(arguments):
+    if not arguments.get('pages'):
+        raise ValueError("no pages")
+
+
+def test_invalid_responses_are_not_cached(cache_factory):
+    cache = cache_factory()
+    client = FakeChatClient({'pages': []}, {'pages': [1, 2]})
+    with pytest.raises(ValueError):
+        create_tool_call(client, cache, model="m", validate=_require_pages)
+    assert create_tool_call(client, cache, model="m", validate=_require_pages) == {'pages': [1, 2]}
+    assert create_tool_call(client, cache, model="m", validate=_require_pages) == {'pages': [1, 2]}
+    assert client.calls == 2
+
+
+def test_cached_values_rejected_by_validate_are_fetched_again(cache_factory):
+    cache = cache_factory()
+    cache.set(ResponseCache.make_key(model="m"), {'pages': []})
+    client = FakeChatClient({'pages': [1]})
+    assert create_tool_call(client, cache, model="m", validate=_require_pages) == {'pages': [1]}
+    assert cache.get(ResponseCache.make_key(model="m")) == {'pages': [1]}
@@ -0,0 +1,172 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import retries
+from retries import HedgingPolicy, backoff_delay, call_with_retries, hedged_call, retry_after
+
+
+class TransientError(Exception):
+    def __init__(self, headers=None):
+        super().__init__("transient")
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(retries.time, "sleep", slept.append)
+    return slept
+
+
+def test_backoff_delay_is_jittered_under_an_exponential_cap():
+    for attempt, cap in ((1, 2), (2, 4), (3, 8), (10, 30)):
+        delays = [backoff_delay(attempt, base_delay=2, max_delay=30) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap / 2
+
+
+def test_retry_after_reads_the_error_response_header():
+    assert retry_after(TransientError({"retry-after": "7"})) == 7
+    assert retry_after(TransientError({"retry-after": "soon"})) is None
+    assert retry_after(TransientError()) is None
+    assert retry_after(ValueError()) is None
+
+
+def test_call_with_retries_retries_until_success(sleeps):
+    outcomes = [TransientError(), TransientError(), "image"]
+    retried = []
+
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    result = call_with_retries(call, lambda e: True, max_attempts=3, base_delay=1, max_delay=10,
+                               on_retry=lambda attempt, error, delay: retried.append(attempt))
+    assert result == "image"
+    assert retried == [1, 2]
+    assert len(sleeps) == 2
+
+
+def test_call_with_retries_raises_after_max_attempts(sleeps):
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise TransientError()
+
+    with pytest.raises(TransientError):
+        call_with_retries(call, lambda e: True, max_attempts=3)
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_call_with_retries_raises_non_retryable_errors_at_once(sleeps):
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        call_with_retries(call, lambda e: isinstance(e, TransientError), max_attempts=3)
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+def test_call_with_retries_honours_retry_after(sleeps):
+    outcomes = [TransientError({"retry-after": "7"}), "image"]
+
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert call_with_retries(call, lambda e: True, max_attempts=2, base_delay=1, max_delay=2) == "image"
+    assert sleeps == [7]
+
+
+def test_hedging_policy_delay_is_a_latency_percentile():
+    policy = HedgingPolicy(percentile=90, min_samples=5, min_delay=0.5, max_ratio=0.1, window=10)
+    for seconds in (1, 2, 3, 4):
+        policy.observe(seconds)
+    assert policy.delay() is None
+    for seconds in range(5, 11):
+        policy.observe(seconds)
+    assert policy.delay() == 10
+    policy = HedgingPolicy(percentile=50, min_samples=1, min_delay=5, max_ratio=0.1, window=10)
+    policy.observe(1)
+    assert policy.delay() == 5
+
+
+def test_try_hedge_caps_hedges_at_max_ratio_of_requests():
+    policy = HedgingPolicy(percentile=90, min_samples=1, min_delay=0, max_ratio=0.1, window=10)
+    for _ in range(9):
+        policy.count_request()
+    assert not policy.try_hedge()
+    policy.count_request()
+    assert policy.try_hedge()
+    assert not policy.try_hedge()
+    for _ in range(10):
+        policy.count_request()
+    assert policy.try_hedge()
+    assert policy.stats() == {"requests": 20, "hedges": 2, "hedge_wins": 0, "hedges_denied": 2}
+
+
+def test_hedged_call_runs_inline_until_latencies_are_known():
+    policy = HedgingPolicy(percentile=90, min_samples=1, min_delay=0, max_ratio=1, window=10)
+    assert hedged_call(lambda: "image", policy) == ("image", False, False)
+    assert policy.delay() is not None
+    assert policy.stats()["requests"] == 1
+
+
+def test_hedged_call_returns_the_hedge_when_it_wins():
+    policy = HedgingPolicy(percentile=90, min_samples=1, min_delay=0, max_ratio=1, window=10)
+    policy.observe(0.01)
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "primary"
+
+    try:
+        assert hedged_call(slow, policy, hedge_call=lambda: "hedge") == ("hedge", True, True)
+    finally:
+        release.set()
+    assert policy.stats() == {"requests": 1, "hedges": 1, "hedge_wins": 1, "hedges_denied": 0}
+
+
+def test_hedged_call_waits_for_the_primary_without_budget():
+    policy = HedgingPolicy(percentile=90, min_samples=1, min_delay=0, max_ratio=0, window=10)
+    policy.observe(0.01)
+    hedges = []
+
+    def slow():
+        threading.Event().wait(0.1)
+        return "primary"
+
+    assert hedged_call(slow, policy, hedge_call=lambda: hedges.append(1)) == ("primary", False, False)
+    assert hedges == []
+    assert policy.stats()["hedges_denied"] == 1
+
+
+def test_hedged_call_survives_one_failed_call():
+    policy = HedgingPolicy(percentile=90, min_samples=1, min_delay=0, max_ratio=1, window=10)
+    policy.observe(0.01)
+
+    def failing():
+        threading.Event().wait(0.1)
+        raise TransientError()
+
+    assert hedged_call(failing, policy, hedge_call=lambda: "hedge") == ("hedge", True, True)
+
+    def both_fail():
+        threading.Event().wait(0.1)
+        raise TransientError()
+
+    with pytest.raises(TransientError):
+        hedged_call(both_fail, policy, hedge_call=both_fail)
@@ -0,0 +1,41 @@
+import os
+import time
+
+import utils
+from utils import active_workspace, cleanup_workspaces, create_workspace, last_modified
+
+
+def _age(path, seconds):
+    past = time.time() - seconds
+    for directory, _, files in os.walk(path):
+        for name in [directory] + [os.path.join(directory, file_name) for file_name in files]:
+            os.utime(name, (past, past))
+
+
+def test_cleanup_removes_only_old_workspaces(tmp_path):
+    old, recent = create_workspace(str(tmp_path)), create_workspace(str(tmp_path))
+    _age(old, 7200)
+    assert cleanup_workspaces(str(tmp_path), 3600) == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+
+
+def test_files_written_in_subdirectories_keep_a_workspace(tmp_path):
+    workspace = create_workspace(str(tmp_path))
+    os.makedirs(os.path.join(workspace, "images"))
+    _age(workspace, 7200)
+    with open(os.path.join(workspace, "images", "output_3.png"), "wb") as f:
+        f.write(b"png")
+    assert os.path.getmtime(workspace) < time.time() - 3600  # The root is not touched by the write
+    assert last_modified(workspace) > time.time() - 60
+    assert cleanup_workspaces(str(tmp_path), 3600) == 0
+    assert os.path.exists(workspace)
+
+
+def test_active_workspaces_are_kept(tmp_path):
+    workspace = create_workspace(str(tmp_path))
+    _age(workspace, 7200)
+    with active_workspace(workspace):
+        assert cleanup_workspaces(str(tmp_path), 3600) == 0
+    assert utils._active_workspaces == set()
+    assert cleanup_workspaces(str(tmp_path), 3600) == 1
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Lightweight per-book tracing and process-wide metrics
+
+A Trace records timed spans (story generation, image calls, rate-limit waits, renders...) and
+counters (OpenAI tokens, image and PDF bytes, pages) for one book and is saved as a JSON file.
+Finished traces are folded into the process-wide METRICS, written in the Prometheus text format
+so that a local scraper (e.g. the node_exporter textfile collector) can read them.
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager, nullcontext
+from collections import defaultdict
+from typing import Dict, Optional
+from config import METRICS_PATH
+
+
+class Trace:
+    """Thread-safe record of the spans and counters of one book generation.
+
+    Args:
+        name: name of the traced operation
+        **attributes: attributes of the whole trace (prompt, models, output directory...)
+    """
+
+    def __init__(self, name: str = "book", **attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.duration = None
+        self.spans = []
+        self.counters = defaultdict(int)
+        self._start = time.perf_counter()
+        self._marks = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time the enclosed block. Yields the span attributes so the block can add to them."""
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except Exception as e:
+            attributes['error'] = str(e)
+            raise
+        finally:
+            self.record(name, start, time.perf_counter() - start, **attributes)
+
+    def record(self, name: str, start: float, duration: float, **attributes):
+        """Record a span that was timed by the caller, start being a time.perf_counter() value."""
+        span = {
+            'name': name,
+            'start': round(start - self._start, 6),
+            'duration': round(duration, 6),
+            'thread': threading.current_thread().name,
+            **attributes
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def mark(self, name: str):
+        """Record a span from the start of the trace to now, the first time name is marked (e.g. time to first image)."""
+        now = time.perf_counter()
+        with self._lock:
+            if name in self._marks:
+                return
+            self._marks.add(name)
+        self.record(name, self._start, now - self._start)
+
+    def add(self, counter: str, value: float = 1):
+        """Add value to a counter of the trace."""
+        with self._lock:
+            self.counters[counter] += value
+
+    def span_totals(self) -> Dict[str, Dict[str, float]]:
+        """Return span name -> {count, seconds} summed over the recorded spans."""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                total = totals.setdefault(span['name'], {'count': 0, 'seconds': 0.0})
+                total['count'] += 1
+                total['seconds'] += span['duration']
+        return totals
+
+    def finish(self):
+        """Close the trace and fold it into the process-wide metrics. Calling it again does nothing."""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        METRICS.add_trace(self)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'trace_id': self.trace_id,
+                'name': self.name,
+                'started_at': self.started_at,
+                'duration': round(self.duration if self.duration is not None else time.perf_counter() - self._start, 6),
+                'attributes': self.attributes,
+                'counters': dict(sorted(self.counters.items())),
+                'spans': sorted(self.spans, key=lambda span: span['start'])
+            }
+
+    def save(self, path: str):
+        """Write the trace as JSON to path."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+
+    def summary(self) -> str:
+        """Return a one-line summary of the time spent per span name."""
+        totals = self.span_totals()
+        parts = [f"{name} {total['seconds']:.1f}s" + (f" (x{total['count']})" if total['count'] > 1 else "")
+                 for name, total in sorted(totals.items(), key=lambda item: -item[1]['seconds'])]
+        return ", ".join(parts)
+
+
+def span(trace: Optional[Trace], name: str, **attributes):
+    """Return trace.span(name, ...), or a context yielding a throwaway attributes dict when trace is None."""
+    if trace is None:
+        return nullcontext(attributes)
+    return trace.span(name, **attributes)
+
+
+def add_counter(trace: Optional[Trace], counter: str, value: float = 1):
+    """Add value to a counter of trace, if any."""
+    if trace is not None and value:
+        trace.add(counter, value)
+
+
+def mark(trace: Optional[Trace], name: str):
+    """Mark name on trace, if any."""
+    if trace is not None:
+        trace.mark(name)
+
+
+def finish_trace(trace: Optional[Trace], path: str, error: Optional[Exception] = None):
+    """Finish trace (if any), mark it as failed when error is given, save it to path and print its summary."""
+    if trace is None:
+        return
+    if error is not None:
+        trace.attributes['error'] = str(error)
+        trace.add("errors")
+    trace.finish()
+    try:
+        trace.save(path)
+    except OSError as e:
+        print(f"Warning: could not save trace to {path}: {e}")
+    print(f"⏱️ {trace.summary()}")
+
+
+def _metric_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+class Metrics:
+    """Thread-safe process-wide counters aggregated from finished traces.
+
+    Args:
+        path: file rewritten in the Prometheus text format after every trace, None to keep them in memory only
+    """
+
+    def __init__(self, path: Optional[str] = METRICS_PATH):
+        self.path = path
+        self.traces = 0
+        self.trace_seconds = 0.0
+        self.counters = defaultdict(int)
+        self.spans = defaultdict(lambda: {'count': 0, 'seconds': 0.0})
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # Keeps the newest snapshot from being overwritten by an older one
+        self._gauges = {}  # prefix -> callable returning {name: value}
+
+    def register_gauges(self, prefix: str, collect):
+        """Register a callable returning {name: value} gauges, exported as storybook_{prefix}_{name}."""
+        with self._lock:
+            self._gauges[prefix] = collect
+
+    def add_trace(self, trace: Trace):
+        """Add the counters and span durations of a finished trace."""
+        totals = trace.span_totals()
+        with self._lock:
+            self.traces += 1
+            self.trace_seconds += trace.duration or 0.0
+            for counter, value in trace.counters.items():
+                self.counters[counter] += value
+            for name, total in totals.items():
+                self.spans[name]['count'] += total['count']
+                self.spans[name]['seconds'] += total['seconds']
+        if self.path is not None:
+            try:
+                with self._write_lock:
+                    self.write(self.path)
+            except OSError as e:
+                print(f"Warning: could not write metrics to {self.path}: {e}")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            snapshot = {
+                'traces': self.traces,
+                'trace_seconds': self.trace_seconds,
+                'counters': dict(self.counters),
+                'spans': {name: dict(total) for name, total in self.spans.items()}
+            }
+            collectors = dict(self._gauges)
+        snapshot['gauges'] = {
+            f"{prefix}_{name}": value
+            for prefix, collect in collectors.items() for name, value in collect().items()
+        }
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE storybook_books_total counter",
+            f"storybook_books_total {snapshot['traces']}",
+            "# TYPE storybook_book_seconds_total counter",
+            f"storybook_book_seconds_total {snapshot['trace_seconds']:.6f}",
+            "# TYPE storybook_span_seconds summary"
+        ]
+        for name, total in sorted(snapshot['spans'].items()):
+            lines.append(f'storybook_span_seconds_sum{{span="{name}"}} {total["seconds"]:.6f}')
+            lines.append(f'storybook_span_seconds_count{{span="{name}"}} {total["count"]}')
+        for counter, value in sorted(snapshot['counters'].items()):
+            metric = f"storybook_{_metric_name(counter)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value:g}")
+        for gauge, value in sorted(snapshot['gauges'].items()):
+            metric = f"storybook_{_metric_name(gauge)}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Atomically rewrite path with the current metrics."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+# Process-wide metrics shared by every traced book
+METRICS = Metrics()
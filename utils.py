@@ -3,10 +3,14 @@
 Utility functions for the Story Generator
 """
 
+import os
 import time
-from typing import List, Tuple
-from openai import OpenAIError
-from config import IMAGE_GENERATION_DELAY
+import uuid
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+from config import IMAGE_GENERATION_DELAY, IMAGE_REQUESTS_PER_MINUTE, IMAGE_REQUESTS_BURST, IMAGES_DIR, HTML_DIR, PDF_DIR
 
 
 def add_rate_limiting_delay(seconds: int = IMAGE_GENERATION_DELAY):
@@ -14,6 +18,114 @@ def add_rate_limiting_delay(seconds: int = IMAGE_GENERATION_DELAY):
     time.sleep(seconds)
 
 
+class RateLimiter:
+    """Thread-safe token bucket limiting API calls to a requests-per-minute budget.
+
+    A single instance is meant to be shared by every worker calling the same API,
+    so that the budget holds across the whole pool rather than per worker.
+
+    Args:
+        requests_per_minute: sustained number of calls allowed per minute
+        burst: number of calls allowed back-to-back when the bucket is full
+    """
+
+    def __init__(self, requests_per_minute: float = IMAGE_REQUESTS_PER_MINUTE, burst: int = IMAGE_REQUESTS_BURST):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
+        self.rate = requests_per_minute / 60.0  # tokens per second
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Block until a call is allowed, then consume one token."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_workspace(root: str) -> str:
+    """Create a new uniquely named workspace directory under root and return its path."""
+    workspace = os.path.join(root, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}")
+    os.makedirs(workspace, exist_ok=True)
+    return workspace
+
+
+def workspace_dirs(output_dir=None):
+    """
+    Return the (images_dir, html_dir, pdf_dir) of a book workspace.
+
+        Args:
+            output_dir (str): Root of the book workspace, None for the global images/html/pdf directories
+
+    Returns:
+        tuple: (images_dir, html_dir, pdf_dir)
+    """
+    if output_dir is None:
+        return IMAGES_DIR, HTML_DIR, PDF_DIR
+    return tuple(os.path.join(output_dir, directory) for directory in (IMAGES_DIR, HTML_DIR, PDF_DIR))
+
+
+# Workspaces of the requests in progress in this process, never deleted by cleanup_workspaces
+_active_workspaces = set()
+_active_workspaces_lock = threading.Lock()
+
+
+@contextmanager
+def active_workspace(workspace: str):
+    """Protect a workspace from cleanup_workspaces while its request is in progress."""
+    path = os.path.abspath(workspace)
+    with _active_workspaces_lock:
+        _active_workspaces.add(path)
+    try:
+        yield workspace
+    finally:
+        with _active_workspaces_lock:
+            _active_workspaces.discard(path)
+
+
+def last_modified(path: str) -> float:
+    """Return the newest modification time of a directory tree: writes into a subdirectory do not touch its root."""
+    newest = os.path.getmtime(path)
+    for directory, _, files in os.walk(path):
+        for name in [directory] + [os.path.join(directory, file_name) for file_name in files]:
+            try:
+                newest = max(newest, os.path.getmtime(name))
+            except OSError:
+                continue  # Removed concurrently
+    return newest
+
+
+def cleanup_workspaces(root: str, max_age: float) -> int:
+    """Delete the workspaces under root not in use (see active_workspace) and untouched for more than max_age seconds."""
+    if not os.path.exists(root):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age
+    with _active_workspaces_lock:
+        active = set(_active_workspaces)
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isdir(path) and os.path.abspath(path) not in active and last_modified(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            continue  # Removed concurrently
+    return removed
+
+
 def create_error_output(nb_images: int, error_message: str) -> Tuple:
     """Create standardized error output for the interface."""
     error_output = ["Error occurred", "Error occurred", "Error occurred"]
@@ -23,8 +135,12 @@ def create_error_output(nb_images: int, error_message: str) -> Tuple:
     return tuple(error_output)
 
 
-def create_success_output(story: dict, nb_images: int, image_prompts_list: List[str]) -> Tuple:
-    """Create standardized success output for the interface."""
+def create_success_output(story: dict, nb_images: int, image_prompts_list: List[str], images_dir: str = IMAGES_DIR, failed_images: Optional[Dict[int, str]] = None, ready_images: Optional[Set[int]] = None) -> Tuple:
+    """Create standardized success output for the interface. Failed images are shown as errors.
+
+    When ready_images is given, only those images are shown, the others are still being generated.
+    """
+    failed_images = failed_images or {}
     output = [
         story.get("title", "Untitled"),
         story.get("summary", "No summary available"),
@@ -33,14 +149,22 @@ def create_success_output(story: dict, nb_images: int, image_prompts_list: List[
     
     # Add image outputs (title + content + "The End" page)
     for i in range(nb_images + 2):  # +2 for title page and "The End" page
-        output.append(f"images/output_{i}.png")  # Image path (0-based indexing)
+        if i in failed_images:
+            output.append(None)  # No image
+            output.append(f"Error: {failed_images[i]}")  # Error message as prompt
+            continue
+        if ready_images is not None and i not in ready_images:
+            output.append(None)  # Not generated yet
+        else:
+            output.append(f"{images_dir}/output_{i}.png")  # Image path (0-based indexing)
         output.append(image_prompts_list[i] if i < len(image_prompts_list) else "No prompt available")  # Prompt text
-    print(f"output: {output}")
     return tuple(output) 
 
 
-def create_success_output_dictionnary(story: dict, nb_images: int, image_prompts_list: List[str]) -> dict:
-    """Create standardized success output for the interface."""
+def create_success_output_dictionnary(story: dict, nb_images: int, image_prompts_list: List[str], images_dir: str = IMAGES_DIR, failed_images: Optional[Dict[int, str]] = None) -> dict:
+    """Create standardized success output for the interface. Failed images are listed in 'failed_images'."""
     output = story.copy()
-    output['images'] = [f"images/output_{i}.png" for i in range(nb_images+2)]  # +2 for title and "The End" pages
+    output['images'] = [f"{images_dir}/output_{i}.png" for i in range(nb_images+2)]  # +2 for title and "The End" pages
+    if failed_images:
+        output['failed_images'] = {str(image_number): error for image_number, error in sorted(failed_images.items())}
     return output
\ No newline at end of file
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Stage Workers - Storybook generation split into queue-connected text, image and render stages
+
+A submitted book goes through three stages, each with its own workers pulling jobs from the durable
+JobQueue, so that each pool is sized for its bottleneck and scaled on its own:
+    text    story and image prompts (one job per book, API latency bound)
+    image   one image (one job per image, API latency and rate limit bound)
+    render  storybook PDF once every image job of the book is finished (one job per book, CPU bound)
+
+Workers only import the modules of their stage (an image worker never loads WeasyPrint, a render
+worker never loads openai). They can run as threads, processes (--processes) or on other hosts
+sharing the queue database and BOOKS_DIR.
+
+Usage:
+    python cli.py submit "a golden retriever that wanted to eat the biggest steak in the world"
+    python cli.py worker --stage text
+    python cli.py worker --stage image --concurrency 8
+    python cli.py worker --stage render --processes 4
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import multiprocessing
+from typing import Dict, Optional
+
+# Add package directories to path to access the generation and formatting modules
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, 'story_and_image_gen'))
+sys.path.append(os.path.join(current_dir, 'book_format'))
+
+from job_queue import JobQueue, worker_id
+from retries import backoff_delay
+from tracing import Trace, finish_trace
+from utils import workspace_dirs, create_success_output_dictionnary
+from config import (
+    TEXT_MODEL, TARGET_WORDS, TARGET_AGE, IMAGE_MODEL, IMAGE_SIZE, FORMAT_OPTIONS, STORY_PLANNING_MODE, BOOKS_DIR,
+    QUEUE_PATH, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS, QUEUE_POLL_INTERVAL, QUEUE_RETRY_BASE_DELAY, QUEUE_RETRY_STAGES, STAGE_CONCURRENCY,
+    CATALOG_ENABLED, TRACING_ENABLED
+)
+
+STAGES = ("text", "image", "render")
+
+
+def _create_books_table(queue: JobQueue):
+    with queue.transaction() as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS queued_books ("
+            "book_id TEXT PRIMARY KEY, request TEXT NOT NULL, output_dir TEXT NOT NULL, status TEXT NOT NULL, "
+            "story TEXT, nb_images INTEGER, image_prompts TEXT, pdf TEXT, catalog_id TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+
+def _update_book(conn, book_id: str, **fields):
+    fields['updated_at'] = time.time()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    conn.execute(f"UPDATE queued_books SET {assignments} WHERE book_id = ?", list(fields.values()) + [book_id])
+
+
+def open_queue(path: str = QUEUE_PATH) -> JobQueue:
+    """Open the job queue and the book table of the stage workers."""
+    queue = JobQueue(path)
+    _create_books_table(queue)
+    return queue
+
+
+def submit_book(request: Dict, books_dir: str = BOOKS_DIR, queue: Optional[JobQueue] = None) -> str:
+    """
+    Queue a book for the stage workers and return its book_id.
+
+        Args:
+            request (dict): user_prompt, and optionally text_model, target_words, target_age, image_model, image_size, planning_mode
+            books_dir (str): Root of the book workspaces, shared with the workers
+            queue (JobQueue): Queue to submit to, the one at QUEUE_PATH by default
+
+    Returns:
+        str: book_id, also the name of the book workspace under books_dir
+    """
+    queue = queue or open_queue()
+    request = {
+        'user_prompt': request.get('user_prompt') or request.get('prompt'),
+        'text_model': request.get('text_model', TEXT_MODEL),
+        'target_words': int(request.get('target_words', TARGET_WORDS)),
+        'target_age': int(request.get('target_age', TARGET_AGE)),
+        'image_model': request.get('image_model', IMAGE_MODEL),
+        'image_size': request.get('image_size', IMAGE_SIZE),
+        'planning_mode': request.get('planning_mode', STORY_PLANNING_MODE),
+    }
+    if not request['user_prompt']:
+        raise ValueError("A book request needs a prompt")
+    book_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    now = time.time()
+    with queue.transaction() as conn:
+        conn.execute(
+            "INSERT INTO queued_books (book_id, request, output_dir, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (book_id, json.dumps(request), os.path.abspath(os.path.join(books_dir, book_id)), now, now)
+        )
+        queue.enqueue_in(conn, "text", {}, book_id)
+    return book_id
+
+
+def load_book(queue: JobQueue, book_id: str) -> Dict:
+    """
+    Return a queued book with its request, story and image prompts decoded.
+
+    Raises:
+        ValueError: If book_id was never submitted.
+    """
+    with queue.read() as conn:
+        row = conn.execute("SELECT * FROM queued_books WHERE book_id = ?", (book_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"Book {book_id} is not in the queue {queue.path}")
+    book = dict(row)
+    for field in ('request', 'story', 'image_prompts'):
+        book[field] = json.loads(book[field]) if book[field] else None
+    return book
+
+
+def book_status(queue: JobQueue, book_id: str) -> Dict:
+    """Return the status of a book and the number of its jobs per stage and status."""
+    book = load_book(queue, book_id)
+    jobs = {}
+    for job in queue.book_jobs(book_id):
+        jobs.setdefault(job['stage'], {}).setdefault(job['status'], 0)
+        jobs[job['stage']][job['status']] += 1
+    return {'book_id': book_id, 'status': book['status'], 'title': (book['story'] or {}).get('title'),
+            'pdf': book['pdf'], 'catalog_id': book['catalog_id'], 'error': book['error'], 'jobs': jobs}
+
+
+def _enqueue_render_when_images_done(conn, book_id: str) -> bool:
+    # Idempotent, and runs in a write transaction: whichever worker first sees every image job finished
+    # enqueues the render, exactly once. The failed images are final by then and handed to the render job
+    remaining = conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE book_id = ? AND stage = 'image' AND status IN ('queued', 'running')", (book_id,)
+    ).fetchone()[0]
+    rendering = conn.execute("SELECT COUNT(*) FROM jobs WHERE book_id = ? AND stage = 'render'", (book_id,)).fetchone()[0]
+    if remaining == 0 and rendering == 0:
+        failed_images = {
+            str(json.loads(row['payload'])['image_number']): row['error'] or 'failed'
+            for row in conn.execute("SELECT payload, error FROM jobs WHERE book_id = ? AND stage = 'image' AND status = 'failed'", (book_id,))
+        }
+        JobQueue.enqueue_in(conn, "render", {'failed_images': failed_images}, book_id)
+        _update_book(conn, book_id, status='rendering')
+        return True
+    return False
+
+
+def enqueue_ready_renders(queue: JobQueue) -> int:
+    """
+    Enqueue the render of every book whose image jobs are all finished but that has no render job yet.
+
+    The last image job normally enqueues the render when it finishes; this sweep catches the books it
+    missed, e.g. when that job's result was dropped after its lease was taken over.
+
+    Returns:
+        int: number of renders enqueued
+    """
+    query = (
+        "SELECT book_id FROM queued_books WHERE status = 'images' AND NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.book_id = queued_books.book_id "
+        "AND (jobs.stage = 'render' OR (jobs.stage = 'image' AND jobs.status IN ('queued', 'running'))))"
+    )
+    with queue.read() as conn:
+        book_ids = [row['book_id'] for row in conn.execute(query)]
+    if not book_ids:
+        return 0
+    with queue.transaction() as conn:
+        return sum(_enqueue_render_when_images_done(conn, book_id) for book_id in book_ids)
+
+
+def run_text_job(job: Dict, book: Dict, trace: Optional[Trace]):
+    """Generate the story and image prompts of a book, then queue one image job per prompt."""
+    from story_and_image_generator import generate_story_and_image_prompts
+
+    request = book['request']
+    images_dir = workspace_dirs(book['output_dir'])[0]
+    os.makedirs(images_dir, exist_ok=True)
+    story, nb_images, _, image_prompts = generate_story_and_image_prompts(
+        request['user_prompt'], request['text_model'], request['target_words'], request['target_age'],
+        request['image_model'], request['image_size'], images_dir, trace=trace, planning_mode=request['planning_mode']
+    )
+    print(f"✅ Book {book['book_id']}: '{story.get('title', 'Untitled')}', {len(image_prompts.get('image_prompts', []))} image jobs queued")
+
+    def follow_up(conn):
+        _update_book(conn, book['book_id'], status='images', story=json.dumps(story), nb_images=nb_images, image_prompts=json.dumps(image_prompts))
+        for prompt_data in image_prompts.get('image_prompts', []):
+            JobQueue.enqueue_in(conn, "image", {
+                'image_number': prompt_data.get('image_number', 1) - 1,
+                'prompt': prompt_data.get('prompt', 'No prompt available')
+            }, book['book_id'])
+        _enqueue_render_when_images_done(conn, book['book_id'])  # Only when there are no image prompts at all
+    return follow_up
+
+
+def run_image_job(job: Dict, book: Dict, trace: Optional[Trace]):
+    """Generate one image of a book into its workspace, and queue the render after the last one."""
+    from story_and_image_generator import create_image_generator
+
+    request = book['request']
+    images_dir = workspace_dirs(book['output_dir'])[0]
+    os.makedirs(images_dir, exist_ok=True)
+    image_generator = create_image_generator(
+        book['story'], book['nb_images'], request['text_model'], request['target_age'],
+        request['image_model'], request['image_size'], images_dir, trace=trace
+    )
+    image_generator.generate_image(job['payload']['image_number'], job['payload']['prompt'])
+    return lambda conn: _enqueue_render_when_images_done(conn, book['book_id'])
+
+
+def run_render_job(job: Dict, book: Dict, trace: Optional[Trace]):
+    """Render the storybook PDF of a book from its workspace images, and add it to the catalog."""
+    from formatting import StorybookFormatter
+
+    images_dir, html_dir, pdf_dir = workspace_dirs(book['output_dir'])
+    failed_images = {int(image_number): error for image_number, error in job['payload'].get('failed_images', {}).items()}
+    image_prompts_list = [prompt_data.get('prompt', '') for prompt_data in book['image_prompts'].get('image_prompts', [])]
+    story_dict = create_success_output_dictionnary(book['story'], book['nb_images'], image_prompts_list, images_dir, failed_images)
+
+    formatter = StorybookFormatter(story_dict, FORMAT_OPTIONS, html_dir=html_dir, pdf_dir=pdf_dir, trace=trace)
+    formatter.build_storybook()
+    pdf_path = os.path.join(pdf_dir, "storybook.pdf")
+    status = 'partial' if failed_images or formatter.failed_pages else 'ok'
+
+    catalog_id = None
+    if CATALOG_ENABLED:
+        from catalog import get_book_catalog
+        try:
+            catalog_id = get_book_catalog().add_book(formatter.story_dict, book['request'], pdf_path=pdf_path, image_prompts=image_prompts_list, trace=trace)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: could not add book {book['book_id']} to the catalog: {e}")
+    print(f"✅ Book {book['book_id']} rendered to {pdf_path} ({status})")
+    return lambda conn: _update_book(conn, book['book_id'], status=status, pdf=pdf_path, catalog_id=catalog_id)
+
+
+STAGE_HANDLERS = {"text": run_text_job, "image": run_image_job, "render": run_render_job}
+
+
+def _on_job_failed(stage: str, book_id: str, error: str):
+    """Return the follow-up of a job that failed for good: a failed image still lets the book render without it."""
+    if stage == "image":
+        return lambda conn: _enqueue_render_when_images_done(conn, book_id)
+    return lambda conn: _update_book(conn, book_id, status='error', error=f"{stage} stage: {error}")
+
+
+def _run_job(queue: JobQueue, stage: str, job: Dict, worker: str, max_attempts: int, lease: float):
+    """Run a claimed job and finish, retry or fail it."""
+    if job['attempts'] > max_attempts:
+        # Its workers kept dying before finishing it
+        error = f"lease expired {max_attempts} times"
+        queue.finish(job['job_id'], worker, "failed", error, follow_up=_on_job_failed(stage, job['book_id'], error))
+        return
+
+    book = load_book(queue, job['book_id'])
+    trace = Trace(stage, book_id=job['book_id'], job_id=job['job_id'], attempt=job['attempts']) if TRACING_ENABLED else None
+    trace_path = os.path.join(book['output_dir'], "traces", f"{stage}_{job['job_id']}.json")
+    try:
+        with queue.heartbeat(job['job_id'], worker, lease):
+            follow_up = STAGE_HANDLERS[stage](job, book, trace)
+    except Exception as e:
+        finish_trace(trace, trace_path, error=e)
+        # An image job already made its attempts in the image generator, queueing it again would multiply the API calls
+        if stage in QUEUE_RETRY_STAGES and job['attempts'] < max_attempts:
+            delay = backoff_delay(job['attempts'], QUEUE_RETRY_BASE_DELAY)
+            print(f"⚠️ {stage} job {job['job_id']} of book {job['book_id']} failed ({e}), retrying in {delay:.1f}s")
+            queue.retry(job['job_id'], worker, str(e), delay)
+        else:
+            print(f"Error: {stage} job {job['job_id']} of book {job['book_id']} failed after {job['attempts']} attempt(s): {e}")
+            queue.finish(job['job_id'], worker, "failed", str(e), follow_up=_on_job_failed(stage, job['book_id'], str(e)))
+        return
+    finish_trace(trace, trace_path)
+    if not queue.finish(job['job_id'], worker, "done", follow_up=follow_up):
+        print(f"Warning: {stage} job {job['job_id']} finished after its lease was taken over, result dropped")
+        if stage == "image":
+            # The worker that took it over may already be done with it, so the render may be due now
+            with queue.transaction() as conn:
+                _enqueue_render_when_images_done(conn, job['book_id'])
+
+
+def run_worker(stage: str, concurrency: Optional[int] = None, queue_path: str = QUEUE_PATH, poll_interval: float = QUEUE_POLL_INTERVAL, idle_timeout: Optional[float] = None, max_attempts: int = QUEUE_MAX_ATTEMPTS, lease: float = QUEUE_LEASE_SECONDS, stop: Optional[threading.Event] = None):
+    """
+    Process the jobs of one stage with concurrency threads, until stop is set or no job came for idle_timeout seconds.
+
+        Args:
+            stage (str): "text", "image" or "render"
+            concurrency (int): Jobs processed at the same time, STAGE_CONCURRENCY[stage] by default
+            queue_path (str): Queue database shared with the other workers
+            poll_interval (float): Seconds between two claims when the queue is empty
+            idle_timeout (float): Exit after this many seconds without a job, None to run until stopped
+            max_attempts (int): Attempts of a job before it fails for good
+            lease (float): Seconds a job stays claimed without a heartbeat
+            stop (threading.Event): Optional event stopping the worker
+
+    Returns:
+        int: number of jobs processed
+    """
+    if stage not in STAGE_HANDLERS:
+        raise ValueError(f"Unknown stage: {stage}")
+    concurrency = max(1, concurrency or STAGE_CONCURRENCY[stage])
+    queue = open_queue(queue_path)
+    stop = stop or threading.Event()
+    processed = [0] * concurrency
+    print(f"👷 {stage} worker started with {concurrency} threads on {queue_path}")
+
+    def _loop(index):
+        worker = worker_id(stage)
+        idle_since = time.monotonic()
+        while not stop.is_set():
+            job = queue.claim(stage, worker, lease)
+            if job is None and stage == "render" and enqueue_ready_renders(queue):
+                continue
+            if job is None:
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    return
+                stop.wait(poll_interval)
+                continue
+            _run_job(queue, stage, job, worker, max_attempts, lease)
+            processed[index] += 1
+            idle_since = time.monotonic()
+
+    threads = [threading.Thread(target=_loop, args=(index,), name=f"{stage}-worker-{index}") for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        print(f"👷 Stopping {stage} worker after the jobs in progress")
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return sum(processed)
+
+
+def run_workers(stage: str, processes: int = 1, **kwargs) -> int:
+    """Run run_worker(stage, **kwargs) in processes separate processes (in this process when 1) and return the jobs processed."""
+    if processes <= 1:
+        return run_worker(stage, **kwargs)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes) as pool:
+        return sum(pool.starmap(_run_worker_process, [(stage, kwargs)] * processes))
+
+
+def _run_worker_process(stage, kwargs):
+    return run_worker(stage, **kwargs)